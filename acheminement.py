@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Acheminement de paquets à travers plusieurs routeurs.
+
+    Un paquet relayé est de la forme:
+        relais,<destination>,<limite de sauts>,<source>,<données>
+
+    Un routeur qui le reçoit ne lit que l'en-tête : s'il n'est pas
+    la destination, il décrémente la limite de sauts et transmet le
+    paquet au prochain saut de sa table de routage (voir routage.py),
+    sans décoder les données.
+
+    Les paquets vers un même prochain saut passent par une file
+    d'envoi : un thread par voisin envoie les paquets en attente,
+    regroupés en un seul envoi, pendant que les suivants sont reçus.
+    La file est bornée : si le voisin est plus lent, un paquet reçu
+    pour lui est perdu au lieu d'être accumulé, sans faire attendre la
+    lecture du lien (les autres paquets reçus avec lui ne doivent pas
+    attendre un voisin lent). Seul l'envoi d'un paquet créé ici attend
+    qu'il y ait de la place (contre-pression).
+
+    La file d'un voisin est arrêtée quand sa connexion est fermée
+    (voir SocketServeur.retireFile) : elle envoie encore les paquets
+    déjà reçus, puis son thread s'arrête. Un paquet suivant pour ce
+    voisin crée une nouvelle file.
+
+    :var LIMITE_SAUTS:
+          limite de sauts d'un paquet relayé créé ici
+    :var TAILLE_FILE:
+          nombre de paquets en attente vers un même voisin
+    :var TAILLE_LOT:
+          taille maximale (en octets) d'un envoi groupé
+"""
+
+import queue
+import threading
+
+from trame import ENTETE, MAX_TRAME, ErreurTrame
+
+PREFIXE_RELAIS = b"relais,"
+LIMITE_SAUTS = 16
+TAILLE_FILE = 256
+TAILLE_LOT = 64*1024
+#taille maximale de l'en-tête d'un paquet relayé
+#(deux adresses MAC, la limite de sauts et les séparateurs)
+TAILLE_ENTETE_RELAIS = 64
+
+def estRelais(trame):
+    """
+        la trame est-elle un paquet relayé
+    """
+    return trame[:len(PREFIXE_RELAIS)] == PREFIXE_RELAIS
+
+def lisEnteteRelais(trame):
+    """
+        lit l'en-tête d'un paquet relayé
+
+        :return: tuple ( destination , limite , source , début des données )
+    """
+    morceaux = bytes(trame[:TAILLE_ENTETE_RELAIS]).split(b",",4)
+    if len(morceaux) < 5:
+        raise ValueError("en-tête de paquet relayé invalide")
+    _ , destination , limite , source , _ = morceaux
+    debut = len(destination)+len(limite)+len(source)+len(PREFIXE_RELAIS)+3
+    return ( str(destination,encoding="ascii") , int(limite) ,
+             str(source,encoding="ascii") , debut )
+
+def trameRelais(destination,limite,source,donnees):
+    """
+        crée la trame d'un paquet relayé, en-tête de taille compris
+        (voir trame.py), en une seule copie des données
+    """
+    entete = bytes("relais,%s,%d,%s," % (destination,limite,source),encoding="ascii")
+    taille = len(entete)+len(donnees)
+    if taille > MAX_TRAME:
+        raise ErreurTrame("paquet trop grand : "+str(taille)+" octets")
+    return b"".join( (ENTETE.pack(taille),entete,donnees) )
+
+class FileEnvoi:
+    """
+        File des trames à envoyer à un même voisin, vidée par son thread
+    """
+
+    def __init__(self,envoie,taille=TAILLE_FILE,tailleLot=TAILLE_LOT):
+        """
+            :param envoie: fonction qui envoie des octets (déjà tramés)
+                           au voisin
+        """
+        self.envoie = envoie
+        self.tailleLot = tailleLot
+        self.file = queue.Queue(taille)
+        self.envoyes = 0
+        self.perdus = 0
+        self.actif = True
+        self.thread = threading.Thread(target = self.boucle)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def ajoute(self,trame,bloquant=True):
+        """
+            ajoute une trame à envoyer
+
+            :param bloquant: attendre s'il n'y a plus de place, sinon
+                             la trame est perdue
+            :return: False si la trame est perdue, ou si la file est
+                     arrêtée (voir "actif")
+        """
+        if not self.actif:
+            return False
+        try:
+            self.file.put(trame,bloquant)
+            return True
+        except queue.Full:
+            self.perdus += 1
+            return False
+
+    def boucle(self):
+        """
+            envoie les trames en attente, regroupées
+        """
+        fin = False
+        while not fin:
+            trame = self.file.get()
+            if trame is None:
+                break
+            lot = [trame]
+            taille = len(trame)
+            #regroupe les trames déjà en attente
+            while taille < self.tailleLot:
+                try:
+                    trame = self.file.get_nowait()
+                except queue.Empty:
+                    break
+                if trame is None:
+                    fin = True
+                    break
+                lot.append(trame)
+                taille += len(trame)
+            try:
+                self.envoie( lot[0] if len(lot) == 1 else b"".join(lot) )
+                self.envoyes += len(lot)
+            except OSError as e:
+                print("envoi impossible :",e)
+                self.perdus += len(lot)
+            #arrêtée sans marque de fin (file pleine) : s'arrête une fois vidée
+            if not self.actif and self.file.empty():
+                break
+
+    def ferme(self):
+        """
+            arrête la file : les trames déjà en attente sont encore
+            envoyées, les suivantes sont refusées (voir ajoute)
+        """
+        self.actif = False
+        try:
+            self.file.put_nowait(None)
+        except queue.Full:
+            pass
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Banc d'essai des traitements de la carte du réseau.
+
+    Des topologies synthétiques (voir simulateur.genereLiens) sont
+    créées au format de "mappageReseau", de NB routeurs, et les
+    traitements suivants sont chronométrés:
+        carte : carteSimplifiee, sans le cache de parcours
+        disposition : disposition de toute la carte en anneaux
+        vue : disposition de la carte réduite (voir vuecarte.py), et
+              recherche des noeuds et liens d'une vue de 500x500
+        serialisation : strDepuisMappage de chaque noeud
+        fusion : mappageDepuisStr de ces chaines dans une carte vide, puis
+                 mise à jour des routes, comme à la réception d'une
+                 réponse de recherche
+        sauve, charge : instantané de la carte (voir instantane.py)
+
+    Avec --demarrage, c'est le démarrage d'un routeur qui est mesuré,
+    dans un nouveau processus : durée totale (interpréteur compris),
+    durée de l'import de main.py et de l'initialisation, et mémoire
+    maximale (ko), sans interface puis avec tkinter importé.
+
+    Chaque mesure est la plus courte de plusieurs répétitions (s).
+    Les résultats sont affichés en json ; avec --reference, le rapport
+    avec un résultat précédent est ajouté à chaque mesure (plus de 1 :
+    plus lent qu'avant).
+
+    usage:
+        python banc.py [-n NB [NB ...]] [-t FORME [FORME ...]] [--degre D]
+                       [--repetitions R] [--graine G] [-o FICHIER]
+                       [--reference FICHIER] [--demarrage]
+
+    :var TAILLES:
+          nombres de routeurs testés par défaut
+    :var FORMES:
+          formes de topologie testées par défaut
+    :var DEGRE:
+          nombre moyen de voisins visé pour les formes géométriques
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import main
+import instantane
+import vuecarte
+from topologie import Topologie
+from simulateur import adresseFictive, genereLiens
+
+TAILLES = [10,100,1000,10000,100000]
+FORMES = ["aleatoire","chaine","etoile","grappes"]
+DEGRE = 6
+
+class ServeurBanc:
+    """
+        tient lieu de socketServeur : seule son adresse est utilisée
+    """
+
+    def __init__(self,adresse):
+        self.adresse = adresse
+
+    def getsockname(self):
+        return ( self.adresse , 0 )
+
+def genereTopologie(nb,forme,degre=DEGRE,graine=None):
+    """
+        crée une topologie synthétique de routeurs (périphériques
+        avancés, qui retransmettent tous), vue depuis le routeur 0
+
+        :param degre: nombre moyen de voisins visé, qui donne la portée
+                      des formes géométriques
+    """
+    portee = math.sqrt( degre/(math.pi*max(nb,1)) )
+    adresses = [ adresseFictive(i) for i in range(nb) ]
+    topologie = Topologie()
+    for a in adresses:
+        topologie.ajouteNoeud(a,nom = "routeur "+a[-8:],avance = True)
+    for i,j in genereLiens(nb,forme,portee,graine):
+        topologie.ajouteLien(adresses[i],adresses[j])
+        topologie.ajouteLien(adresses[j],adresses[i])
+    for a in topologie.liens(adresses[0]):
+        topologie.ajouteNoeud(a,direct = True)
+    return topologie
+
+def chronometre(fonction,repetitions,prepare=None):
+    """
+        durée la plus courte de "fonction" sur plusieurs répétitions
+
+        :param prepare: appelée avant chaque répétition, hors chronométrage
+        :return: tuple ( durée , résultat de la dernière répétition )
+    """
+    meilleure = None
+    for k in range(repetitions):
+        if prepare is not None:
+            prepare()
+        debut = time.perf_counter()
+        resultat = fonction()
+        duree = time.perf_counter()-debut
+        if meilleure is None or duree < meilleure:
+            meilleure = duree
+    return meilleure , resultat
+
+def mesure(nb,forme,degre=DEGRE,repetitions=3,graine=None):
+    """
+        chronomètre les traitements de la carte sur une topologie
+
+        :return: dictionnaire des résultats
+    """
+    topologie = genereTopologie(nb,forme,degre,graine)
+    ici = adresseFictive(0)
+    main.socketServeur = ServeurBanc(ici)
+    main.mappageReseau = topologie
+    main.tableRoutage.changeDepart(ici,topologie)
+    mesures = {}
+    resultats = {"routeurs": nb,"forme": forme,
+                 "liens": sum( len(n.liens) for n in topologie.noeuds ),
+                 "mesures": mesures}
+
+    def videCache():
+        topologie.cacheParcours = {}
+    mesures["carte"] , carte = chronometre(main.carteSimplifiee,repetitions,videCache)
+    mesures["disposition"] , _ = chronometre(lambda: main.dispositionReseau(220),repetitions,videCache)
+    def vue():
+        plan = vuecarte.PlanCarte(main.carteSimplifiee(),ici,topologie.liens)
+        #vue centrée, au zoom 1
+        return plan , list(plan.noeudsDans(-250,-250,250,250)) , list(plan.liensDans(-250,-250,250,250))
+    mesures["vue"] , (plan,noeuds,liens) = chronometre(vue,repetitions,videCache)
+    resultats["vue"] = {"gardes": len(plan.positions),"dessines": len(noeuds)+len(liens)}
+    resultats["atteignables"] = len( main.parcoursReseau().adresses )
+
+    mesures["serialisation"] , chaines = chronometre(
+        lambda: [ main.strDepuisMappage(a) for a in topologie ] , repetitions )
+
+    #fusion des chaines envoyées par un voisin, dans une carte
+    #où seuls ce routeur et le voisin sont connus
+    voisins = sorted( topologie.liens(ici) )
+    origine = voisins[0] if voisins else ici
+    def carteVide():
+        main.mappageReseau = Topologie()
+        main.mappageReseau.ajouteNoeud(ici,nom = "origine")
+        if origine != ici:
+            main.mappageReseau.ajouteNoeud(origine,direct = True,avance = True)
+            main.mappageReseau.ajouteLien(ici,origine)
+        main.tableRoutage.changeDepart(ici,main.mappageReseau)
+    def fusionne():
+        #comme reponseRecherche, sans retraits
+        for c in chaines:
+            main.mappageDepuisStr(c,origine)
+        main.tableRoutage.maj()
+    mesures["fusion"] , _ = chronometre(fusionne,repetitions,carteVide)
+    resultats["fusionnes"] = len(main.mappageReseau)
+
+    with tempfile.TemporaryDirectory() as dossier:
+        chemin = os.path.join(dossier,"banc.carte")
+        mesures["sauve"] , _ = chronometre(lambda: instantane.sauve(chemin,topologie),repetitions)
+        resultats["taille"] = os.path.getsize(chemin)
+        mesures["charge"] , _ = chronometre(lambda: instantane.charge(chemin),repetitions)
+
+    main.mappageReseau = Topologie()
+    main.tableRoutage.changeDepart(None,main.mappageReseau)
+    return resultats
+
+#démarrage mesuré dans un nouveau processus
+DEMARRAGE = """
+import json,resource,time
+debut = time.perf_counter()
+import main
+main.FICHIER_NOMS = None
+main.initialisation()
+main.socketServeur.close()
+mesure = {"initialisation": time.perf_counter()-debut}
+if %r:
+    main.importeInterface()
+    mesure["interface"] = time.perf_counter()-debut
+mesure["memoire"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps(mesure))
+"""
+
+def mesureDemarrage(interface=False,repetitions=3):
+    """
+        mesure le démarrage d'un routeur dans un nouveau processus
+
+        :param interface: importer aussi tkinter (voir main.importeInterface)
+        :return: dictionnaire des meilleures mesures
+    """
+    dossier = os.path.dirname(os.path.abspath(__file__))
+    meilleures = {}
+    for k in range(repetitions):
+        debut = time.perf_counter()
+        sortie = subprocess.run( [ sys.executable , "-c" , DEMARRAGE % interface ] ,
+                                 cwd = dossier , capture_output = True ,
+                                 text = True , check = True ).stdout
+        mesure = json.loads( sortie.splitlines()[-1] )
+        mesure["total"] = time.perf_counter()-debut
+        for nom,valeur in mesure.items():
+            meilleures[nom] = min( valeur , meilleures.get(nom,valeur) )
+    return meilleures
+
+def compare(resultats,reference):
+    """
+        ajoute à chaque mesure le rapport avec la même mesure
+        (même forme, même nombre de routeurs) d'un résultat précédent
+    """
+    if "demarrage" in resultats and "demarrage" in reference:
+        for mode,mesures in resultats["demarrage"].items():
+            ancien = reference["demarrage"].get(mode,{})
+            mesures["rapports"] = { nom : valeur/ancien[nom] for nom,valeur in mesures.items()
+                                    if ancien.get(nom) }
+    anciens = { (r["forme"],r["routeurs"]) : r["mesures"] for r in reference.get("resultats",[]) }
+    for r in resultats.get("resultats",[]):
+        ancien = anciens.get( (r["forme"],r["routeurs"]) )
+        if ancien is None:
+            continue
+        r["rapports"] = { nom : duree/ancien[nom]
+                          for nom,duree in r["mesures"].items()
+                          if ancien.get(nom) }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "banc d'essai des traitements de la carte")
+    parser.add_argument("-n",type = int,nargs = "+",default = TAILLES,help = "nombres de routeurs")
+    parser.add_argument("-t","--topologie",nargs = "+",default = FORMES,
+                        choices = ["chaine","etoile","complete","aleatoire","grappes"])
+    parser.add_argument("--degre",type = float,default = DEGRE,
+                        help = "nombre moyen de voisins des formes géométriques")
+    parser.add_argument("--repetitions",type = int,default = 3)
+    parser.add_argument("--graine",type = int,default = 0)
+    parser.add_argument("-o","--sortie",help = "fichier json des résultats")
+    parser.add_argument("--reference",help = "résultats précédents à comparer")
+    parser.add_argument("--demarrage",action = "store_true",
+                        help = "mesure le démarrage d'un routeur, au lieu des traitements de la carte")
+    args = parser.parse_args()
+
+    resultats = {"python": platform.python_version(),
+                 "machine": platform.machine(),
+                 "repetitions": args.repetitions}
+    if args.demarrage:
+        resultats["demarrage"] = {"sansInterface": mesureDemarrage(False,args.repetitions),
+                                  "interface": mesureDemarrage(True,args.repetitions)}
+    else:
+        resultats["degre"] = args.degre
+        resultats["resultats"] = [ mesure(nb,forme,args.degre,args.repetitions,args.graine)
+                                   for forme in args.topologie for nb in args.n ]
+    if args.reference:
+        with open(args.reference,"r",encoding="utf-8") as fichier:
+            compare(resultats,json.load(fichier))
+    texte = json.dumps(resultats,indent = 2,ensure_ascii = False)
+    if args.sortie:
+        with open(args.sortie,"w",encoding="utf-8") as fichier:
+            fichier.write(texte)
+    print(texte)
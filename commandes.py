@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    File des modifications de l'état du routeur (mappage, routes...).
+
+    Les threads (lecture des paquets, recherches...) ne modifient pas
+    l'état eux mêmes : ils envoient des commandes (fonction et
+    arguments) dans une file, et un seul thread, propriétaire de
+    l'état, les applique dans leur ordre d'arrivée. Aucun verrou
+    n'est donc nécessaire autour de l'état.
+
+    Les commandes en attente sont appliquées par lots : ce qui doit
+    suivre chaque modification (mise à jour des routes, de
+    l'affichage) n'est fait qu'une fois par lot (voir
+    FileCommandes.apresLot). Une grande réponse, envoyée en
+    plusieurs commandes, est ainsi appliquée en quelques lots.
+
+    Pour lire l'état depuis un autre thread, une commande
+    (FileCommandes.execute) en demande un instantané (voir
+    Topologie.instantane), qui ne change plus ensuite.
+
+    Tant que la file n'est pas démarrée (FileCommandes.demarre),
+    chaque commande est appliquée tout de suite, par le thread
+    qui l'envoie.
+
+    :var TAILLE_LOT:
+          nombre maximum de commandes appliquées par lot
+"""
+
+import concurrent.futures
+import queue
+import threading
+
+TAILLE_LOT = 256
+
+class FileCommandes:
+    """
+        File de commandes appliquées par un seul thread
+    """
+
+    def __init__(self,apresLot=None,tailleLot=TAILLE_LOT):
+        """
+            :param apresLot: appelée sans argument après chaque lot
+        """
+        self.file = queue.SimpleQueue()
+        self.apresLot = apresLot
+        self.tailleLot = tailleLot
+        #thread propriétaire, s'il est démarré
+        self.thread = None
+        #commandes appliquées directement, avant le démarrage
+        self.verrou = threading.RLock()
+
+    def demarre(self):
+        """
+            démarre le thread propriétaire
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target = self.boucle)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def ferme(self):
+        """
+            applique les commandes en attente, puis arrête le thread
+            propriétaire : les commandes suivantes sont appliquées
+            directement
+        """
+        thread = self.thread
+        if thread is None:
+            return
+        self.file.put(None)
+        if thread is not threading.current_thread():
+            thread.join()
+
+    def proprietaire(self):
+        """
+            le thread actuel peut il modifier l'état directement
+            (thread propriétaire, ou file non démarrée)
+        """
+        thread = self.thread
+        return thread is None or thread is threading.current_thread()
+
+    def envoie(self,fonction,*args):
+        """
+            envoie une commande, appliquée plus tard sans l'attendre
+        """
+        if self.thread is None:
+            self.appliqueDirectement(fonction,args)
+        else:
+            self.file.put( (fonction,args,None) )
+
+    def execute(self,fonction,*args):
+        """
+            envoie une commande, et attend son résultat (après
+            le traitement de fin de son lot)
+        """
+        if self.thread is None:
+            return self.appliqueDirectement(fonction,args)
+        if self.thread is threading.current_thread():
+            return fonction(*args)
+        futur = concurrent.futures.Future()
+        self.file.put( (fonction,args,futur) )
+        return futur.result()
+
+    def synchronise(self):
+        """
+            attend que les commandes déjà envoyées soient appliquées
+        """
+        self.execute(lambda: None)
+
+    def enAttente(self):
+        """
+            nombre de commandes pas encore appliquées
+        """
+        return self.file.qsize()
+
+    def appliqueDirectement(self,fonction,args):
+        with self.verrou:
+            try:
+                return fonction(*args)
+            finally:
+                self.termineLot()
+
+    def termineLot(self):
+        if self.apresLot is not None:
+            try:
+                self.apresLot()
+            except Exception as e:
+                print("erreur après les commandes :",repr(e))
+
+    def boucle(self):
+        """
+            applique les commandes par lots, jusqu'à l'arrêt
+        """
+        actif = True
+        while actif:
+            #attend une commande, puis prend celles déjà arrivées
+            lot = [ self.file.get() ]
+            while len(lot) < self.tailleLot:
+                try:
+                    lot.append( self.file.get_nowait() )
+                except queue.Empty:
+                    break
+            resultats = []
+            for commande in lot:
+                if commande is None:
+                    actif = False
+                    continue
+                fonction,args,futur = commande
+                try:
+                    resultat = fonction(*args)
+                except Exception as e:
+                    #une commande en erreur n'empêche pas les suivantes
+                    if futur is None:
+                        print("erreur de commande :",repr(e))
+                    else:
+                        resultats.append( (futur,None,e) )
+                    continue
+                if futur is not None:
+                    resultats.append( (futur,resultat,None) )
+            self.termineLot()
+            #les résultats ne sont donnés qu'après la fin du lot
+            for futur,resultat,erreur in resultats:
+                if erreur is None:
+                    futur.set_result(resultat)
+                else:
+                    futur.set_exception(erreur)
+        self.thread = None
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Réserve de connexions persistantes vers les autres routeurs.
+
+    En bluetooth, l'établissement d'une connexion coûte bien plus
+    cher que l'envoi d'un message de contrôle. Les connexions sont
+    donc gardées ouvertes, une par destination, et réutilisées pour
+    les paquets suivants.
+
+    La connexion d'un pair est repérée par son adresse, et sert dans
+    les deux sens : une connexion ouverte par le pair (acceptée par le
+    serveur) est adoptée (PoolConnexions.adopte), et réutilisée pour
+    lui répondre au lieu d'en ouvrir une autre. Chaque connexion
+    ouverte ici est donc aussi lue (voir "ouverture").
+
+    Une connexion inutilisée depuis "delaiInactivite" secondes est
+    fermée, sauf si elle porte encore des flux (voir multiplex.py et
+    "garde"), et le nombre total de connexions ouvertes est limité :
+    la moins récemment utilisée qui ne porte pas de flux est fermée pour
+    faire de la place. Si toutes en portent, la limite est dépassée
+    plutôt que de couper des flux ou de refuser la nouvelle connexion.
+    Si l'envoi échoue sur une connexion existante (le pair l'a fermée,
+    ou il s'est éloigné), elle est rouverte une fois de façon transparente.
+    L'échec d'une nouvelle connexion n'est pas retenté.
+
+    :var DELAI_INACTIVITE:
+          durée (s) après laquelle une connexion inutilisée est fermée
+    :var MAX_CONNEXIONS:
+          nombre maximum de connexions ouvertes en même temps
+          (un piconet bluetooth compte au plus 7 esclaves actifs)
+"""
+
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+DELAI_INACTIVITE = 30
+MAX_CONNEXIONS = 7
+
+class Connexion:
+    """
+        connexion ouverte vers une destination
+
+        attributs:
+          destination : tuple de forme (host,channel)
+          socket : socket connecté, ou None
+          adoptee : le socket a-t-il été ouvert par le pair
+          lue : le socket est-il lu par un autre thread, qui le ferme
+                à la fin de sa lecture
+          dernierUsage : date (time.monotonic) du dernier envoi
+          verrou : empêche deux envois simultanés sur le socket
+    """
+
+    __slots__ = ("destination","socket","adoptee","lue","dernierUsage","verrou")
+
+    def __init__(self,destination):
+        self.destination = destination
+        self.socket = None
+        self.adoptee = False
+        self.lue = False
+        self.dernierUsage = time.monotonic()
+        self.verrou = threading.Lock()
+
+    def ferme(self,immediat=False):
+        """
+            ferme le socket, sans lever d'erreur
+
+            Un socket lu n'est coupé qu'en écriture : le pair voit la fin
+            de la connexion et la ferme de son côté, et ce qu'il envoyait
+            entre temps (une réponse sur une connexion adoptée) est encore
+            lu. Le lecteur, réveillé par cette fermeture, ferme alors le
+            socket (voir PoolConnexions.oublie). Un socket sans lecteur est
+            coupé dans les deux sens, puis fermé.
+
+            :param immediat: coupe et ferme aussi un socket lu (arrêt)
+        """
+        sock = self.socket
+        self.socket = None
+        if sock is None:
+            return
+        if self.lue and not immediat:
+            try:
+                sock.shutdown(socket.SHUT_WR)
+            except (OSError,AttributeError):
+                #déjà coupé, ou socket sans shutdown : fermé tout de suite
+                pass
+            else:
+                return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except (OSError,AttributeError):
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+class PoolConnexions:
+    """
+        Garde ouvertes les connexions vers les pairs, repérées
+        par leur adresse (host de la destination)
+    """
+
+    def __init__(self,fabrique,delaiInactivite=DELAI_INACTIVITE,maxConnexions=MAX_CONNEXIONS,
+                 ouverture=None,garde=None,fermeture=None):
+        """
+            :param fabrique: fonction qui prend une destination (host,channel)
+                             et retourne un socket connecté
+            :param ouverture: fonction appelée avec ( socket , destination )
+                              pour chaque connexion ouverte ici, qui doit
+                              lire ce que le pair y envoie
+            :param garde: fonction qui prend l'adresse d'un pair, et indique
+                          si sa connexion doit rester ouverte même inutilisée
+            :param fermeture: fonction appelée avec l'adresse d'un pair
+                              dont la connexion est fermée ou oubliée
+        """
+        self.fabrique = fabrique
+        self.delaiInactivite = delaiInactivite
+        self.maxConnexions = maxConnexions
+        self.ouverture = ouverture
+        self.garde = garde
+        self.fermeture = fermeture
+        #connexions par adresse, de la moins à la plus récemment utilisée
+        self.connexions = OrderedDict()
+        self.verrou = threading.Lock()
+        self.actif = True
+
+    def envoie(self,destination,message):
+        """
+            envoie un message déjà tramé à une destination,
+            en réutilisant la connexion ouverte si elle existe
+
+            :param destination: tuple de forme (host,channel)
+            :param message: octets à envoyer
+        """
+        self.nettoie()
+        for tentative in range(2):
+            connexion = self.connexion(destination)
+            with connexion.verrou:
+                nouvelle = connexion.socket is None
+                try:
+                    if nouvelle:
+                        connexion.socket = self.fabrique(destination)
+                        if self.ouverture is not None:
+                            self.ouverture(connexion.socket,destination)
+                            connexion.lue = True
+                    connexion.socket.sendall(message)
+                    connexion.dernierUsage = time.monotonic()
+                    return
+                except OSError:
+                    #connexion perdue : oublie la et recommence une fois,
+                    #sauf si elle vient d'être ouverte (un pair injoignable
+                    #ferait attendre deux fois le délai de connexion)
+                    connexion.ferme()
+                    self.retire(connexion)
+                    if nouvelle or tentative == 1:
+                        self.previent(destination[0])
+                        raise
+
+    def connexion(self,destination):
+        """
+            donne la connexion d'une destination, en la créant si besoin
+            (et en fermant la moins récemment utilisée si la limite est atteinte)
+        """
+        aFermer = []
+        with self.verrou:
+            connexion = self.connexions.get(destination[0])
+            if connexion is None:
+                aFermer = self.faisPlace()
+                connexion = Connexion(destination)
+                self.connexions[destination[0]] = connexion
+            else:
+                self.connexions.move_to_end(destination[0])
+        self.fermeConnexions(aFermer)
+        return connexion
+
+    def faisPlace(self):
+        """
+            retire les connexions les moins récemment utilisées, pour
+            pouvoir en ajouter une (le verrou doit être pris)
+
+            Les connexions gardées (voir "garde") ne sont pas retirées :
+            si elles le sont toutes, la nouvelle connexion dépasse la limite
+
+            :return: les connexions retirées, à fermer
+        """
+        aFermer = []
+        for adresse,connexion in list(self.connexions.items()):
+            if len(self.connexions) < self.maxConnexions:
+                break
+            if self.garde is not None and self.garde(adresse):
+                continue
+            del self.connexions[adresse]
+            aFermer.append(connexion)
+        #toutes gardées : la limite est dépassée
+        return aFermer
+
+    def adopte(self,destination,sock):
+        """
+            réutilise une connexion ouverte par un pair (acceptée par
+            le serveur) pour lui envoyer les messages suivants, s'il
+            n'y en a pas déjà une vers lui
+
+            :param destination: tuple de forme (host,channel) du pair
+            :return: la connexion a-t-elle été adoptée
+        """
+        aFermer = []
+        with self.verrou:
+            if not self.actif or destination[0] in self.connexions:
+                return False
+            aFermer = self.faisPlace()
+            connexion = Connexion(destination)
+            connexion.socket = sock
+            connexion.adoptee = True
+            #lue par le serveur qui l'a acceptée
+            connexion.lue = True
+            self.connexions[destination[0]] = connexion
+        self.fermeConnexions(aFermer)
+        return True
+
+    def lien(self,adresse):
+        """
+            donne le socket de la connexion vers un pair, ou None
+        """
+        connexion = self.connexions.get(adresse)
+        return None if connexion is None else connexion.socket
+
+    def retire(self,connexion):
+        """
+            oublie une connexion, si elle est toujours celle de sa destination
+        """
+        with self.verrou:
+            if self.connexions.get(connexion.destination[0]) is connexion:
+                del self.connexions[connexion.destination[0]]
+
+    def oublie(self,sock):
+        """
+            oublie la connexion d'un socket fermé (lecture terminée)
+        """
+        oubliees = []
+        with self.verrou:
+            for adresse,connexion in list(self.connexions.items()):
+                if connexion.socket is sock:
+                    del self.connexions[adresse]
+                    oubliees.append(adresse)
+        for adresse in oubliees:
+            self.previent(adresse)
+
+    def nettoie(self):
+        """
+            ferme les connexions inutilisées depuis trop longtemps
+        """
+        limite = time.monotonic() - self.delaiInactivite
+        aFermer = []
+        with self.verrou:
+            for adresse,connexion in list(self.connexions.items()):
+                if connexion.dernierUsage >= limite:
+                    #les suivantes sont plus récentes
+                    break
+                if self.garde is not None and self.garde(adresse):
+                    continue
+                del self.connexions[adresse]
+                aFermer.append(connexion)
+        self.fermeConnexions(aFermer)
+
+    def boucleNettoyage(self):
+        """
+            nettoie régulièrement la réserve, tant qu'elle est active
+        """
+        while self.actif:
+            time.sleep(self.delaiInactivite/2)
+            self.nettoie()
+
+    def demarreNettoyage(self):
+        """
+            démarre un thread de nettoyage de la réserve
+        """
+        t = threading.Thread(target = self.boucleNettoyage)
+        t.daemon = True
+        t.start()
+
+    def ferme(self):
+        """
+            ferme toutes les connexions
+        """
+        self.actif = False
+        with self.verrou:
+            connexions = list(self.connexions.values())
+            self.connexions.clear()
+        self.fermeConnexions(connexions,True)
+
+    def fermeConnexions(self,connexions,immediat=False):
+        """
+            ferme des connexions retirées de la réserve, chacune sous son
+            verrou : un envoi en cours se termine avant la fermeture
+
+            :param immediat: voir Connexion.ferme
+        """
+        for c in connexions:
+            with c.verrou:
+                c.ferme(immediat)
+            self.previent(c.destination[0])
+
+    def previent(self,adresse):
+        """
+            prévient de la fermeture d'une connexion (voir "fermeture")
+        """
+        if self.fermeture is not None:
+            self.fermeture(adresse)
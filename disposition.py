@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Calcul de la disposition de la carte du réseau en anneaux.
+
+    Chaque niveau de distance au point de départ est placé sur un
+    cercle. Pour chaque anneau, plusieurs rotations sont essayées,
+    et celle qui minimise la somme des carrés des longueurs des liens
+    vers les noeuds déjà placés est retenue.
+
+    Avec des positions complexes z, la somme à minimiser pour une
+    rotation phi s'écrit:
+        somme |r*exp(i*(a+phi)) - p|² = C - 2*r*Re( exp(i*phi) * Z )
+    où Z = somme conj(p)*exp(i*a) ne dépend pas de la rotation.
+    Ainsi Z est calculé une seule fois par anneau, puis toutes les
+    rotations candidates sont évaluées ensemble.
+
+    Le calcul utilise numpy s'il est installé, et se replie
+    sur du python pur sinon.
+
+    :var NB_ROTATIONS:
+          nombre de rotations essayées par anneau (tous les 2*PI/NB_ROTATIONS)
+    :var DECALAGE:
+          décalage angulaire fixe de tous les anneaux
+    :var TOLERANCE:
+          écart relatif sous lequel deux rotations sont équivalentes
+          (la première est alors gardée, pour un dessin stable)
+"""
+
+import cmath
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NB_ROTATIONS = 8
+DECALAGE = 0.19
+TOLERANCE = 1e-9
+
+def dispositionAnneaux(points,voisins,rayonCarte,nbRotations=NB_ROTATIONS):
+    """
+        place les noeuds de chaque niveau sur un anneau
+
+        :param points: dictionnaire niveau -> liste d'adresses,
+                       le niveau 0 étant le point de départ
+        :param voisins: fonction donnant les adresses liées à une adresse
+        :param rayonCarte: rayon de l'anneau le plus éloigné
+        :param nbRotations: nombre de rotations essayées par anneau
+
+        :return: dictionnaire adresse -> (x,y)
+    """
+    if numpy is not None:
+        anneau = _anneauNumpy
+    else:
+        anneau = _anneauPython
+    maxdist = max(points.keys()) if points else 0
+    #positions complexes des noeuds déjà placés
+    places = {}
+    for d in sorted(points.keys()):
+        adresses = points[d]
+        nb = len(adresses)
+        if nb%2 == 0: nb += 1 #ajout d'un pt si nombre impaire pour tracer
+        if maxdist != 0:
+            rayon = rayonCarte*d/maxdist
+        else:
+            rayon = 0
+        #liens vers les noeuds déjà placés : (indice dans l'anneau, position)
+        indices = []
+        cibles = []
+        if d != 0:
+            for i,add in enumerate(adresses):
+                for l in voisins(add):
+                    p = places.get(l)
+                    if p is not None:
+                        indices.append(i)
+                        cibles.append(p)
+        positions = anneau(len(adresses),nb,rayon,indices,cibles,nbRotations)
+        for add,z in zip(adresses,positions):
+            places[add] = z
+    return { add : (z.real,z.imag) for add,z in places.items() }
+
+def _anneauNumpy(n,nb,rayon,indices,cibles,nbRotations):
+    """
+        positions d'un anneau, calculées avec numpy
+    """
+    angles = numpy.arange(n)*(2*math.pi/nb) + DECALAGE
+    offset = 0.0
+    if indices:
+        cibles = numpy.array(cibles)
+        Z = numpy.sum( numpy.conj(cibles) * numpy.exp(1j*angles[numpy.array(indices)]) )
+        rotations = numpy.arange(nbRotations)*(2*math.pi/nbRotations)
+        scores = -2*rayon*numpy.real( numpy.exp(1j*rotations)*Z )
+        tolerance = TOLERANCE*rayon*numpy.sum(numpy.abs(cibles))
+        offset = rotations[ int(numpy.flatnonzero(scores <= scores.min()+tolerance)[0]) ]
+    return ( rayon*numpy.exp(1j*(angles+offset)) ).tolist()
+
+def _anneauPython(n,nb,rayon,indices,cibles,nbRotations):
+    """
+        positions d'un anneau, calculées en python pur
+    """
+    angles = [ i*2*math.pi/nb + DECALAGE for i in range(n) ]
+    offset = 0.0
+    if indices:
+        Z = sum( c.conjugate()*cmath.exp(1j*angles[i]) for i,c in zip(indices,cibles) )
+        rotations = [ k*2*math.pi/nbRotations for k in range(nbRotations) ]
+        scores = [ -2*rayon*( cmath.exp(1j*r)*Z ).real for r in rotations ]
+        tolerance = TOLERANCE*rayon*sum( abs(c) for c in cibles )
+        scoreMin = min(scores)
+        for rotation,score in zip(rotations,scores):
+            if score <= scoreMin+tolerance:
+                offset = rotation
+                break
+    return [ rayon*cmath.exp(1j*(a+offset)) for a in angles ]
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Sauvegarde binaire de la topologie et des services (instantané).
+
+    format (entiers non signés de 4 octets, petit-boutistes):
+        en-tête : MAGIQUE, FORMAT, nombre de noeuds, nombre de liens,
+                  taille des chaines, taille des services
+        chaines : chaines utf-8 séparées par un octet nul, les
+                  premières étant les adresses des noeuds, dans
+                  l'ordre de leurs identifiants. Chaque chaine
+                  (adresse ou nom) n'est écrite qu'une fois
+        noms : indice de la chaine du nom de chaque noeud
+        drapeaux : un octet par noeud (DIRECT, AVANCE)
+        debuts : nombre de noeuds + 1 indices dans "cibles"
+        cibles : identifiants des arrivées des liens, les liens
+                 du noeud i étant cibles[debuts[i]:debuts[i+1]]
+        debutsEntrants, sources : de même, les départs des liens
+                                  qui arrivent à chaque noeud (ignorés
+                                  au chargement : les entrants sont
+                                  reconstruits depuis les liens)
+        services : services par hôte (voir services.py), en json
+
+    Les tableaux sont lus d'un bloc, depuis un fichier projeté en
+    mémoire (mmap) ou depuis un flux lu dans l'ordre. Aucun code
+    n'est exécuté au chargement : le fichier est vérifié, puis
+    refusé s'il est incohérent.
+
+    L'écriture se fait dans un fichier temporaire, écrit sur le
+    disque (fsync) avant de remplacer la sauvegarde : une sauvegarde
+    interrompue, ou un arrêt brutal juste après le remplacement, ne
+    laisse pas de fichier tronqué à la place de la précédente.
+
+    Les anciennes sauvegardes texte (test.txt, dictionnaire
+    donné par Topologie.versDict) peuvent être converties:
+        python instantane.py test.txt test.carte
+
+    :var FORMAT:
+          version du format, vérifiée au chargement
+"""
+
+import argparse
+import array
+import ast
+import gc
+import json
+import mmap
+import os
+import struct
+import sys
+
+from topologie import Topologie
+
+MAGIQUE = b"TIPECART"
+FORMAT = 1
+ENTETE_INSTANTANE = struct.Struct("<8sIIIII")
+#drapeaux d'un noeud
+DIRECT = 1
+AVANCE = 2
+#tableau d'entiers de 4 octets
+U32 = "I" if array.array("I").itemsize == 4 else "L"
+
+class ErreurInstantane(ValueError):
+    """
+        fichier qui n'est pas un instantané valide
+    """
+    pass
+
+def versOctets(tableau):
+    """
+        octets petit-boutistes d'un tableau
+    """
+    if sys.byteorder == "big":
+        tableau = array.array(tableau.typecode,tableau)
+        tableau.byteswap()
+    return tableau.tobytes()
+
+def depuisOctets(code,octets):
+    """
+        tableau depuis des octets petit-boutistes
+    """
+    tableau = array.array(code)
+    tableau.frombytes(octets)
+    if sys.byteorder == "big":
+        tableau.byteswap()
+    return tableau
+
+def sauve(chemin,topologie,services=None):
+    """
+        sauvegarde une topologie, et les services d'un
+        RegistreServices s'il est donné
+    """
+    noeuds = topologie.noeuds
+    #chaines : adresses, puis noms pas encore écrits
+    chaines = [ noeud.adresse for noeud in noeuds ]
+    interne = { a : i for i,a in enumerate(chaines) }
+    noms = array.array(U32)
+    for noeud in noeuds:
+        nom = str(noeud.nom)
+        i = interne.get(nom)
+        if i is None:
+            i = len(chaines)
+            interne[nom] = i
+            chaines.append(nom)
+        noms.append(i)
+    drapeaux = bytes( (DIRECT if n.direct else 0) | (AVANCE if n.avance else 0) for n in noeuds )
+    debuts = array.array(U32,[0])
+    cibles = array.array(U32)
+    for noeud in noeuds:
+        cibles.extend( sorted(noeud.liens) )
+        debuts.append( len(cibles) )
+    debutsEntrants = array.array(U32,[0])
+    sources = array.array(U32)
+    for noeud in noeuds:
+        sources.extend( sorted(noeud.entrants) )
+        debutsEntrants.append( len(sources) )
+    blocChaines = "\0".join( c.replace("\0","") for c in chaines ).encode("utf-8")
+    blocServices = json.dumps( services.versDict() if services is not None else {} ).encode("utf-8")
+    entete = ENTETE_INSTANTANE.pack(MAGIQUE,FORMAT,len(noeuds),len(cibles),
+                                    len(blocChaines),len(blocServices))
+    temporaire = chemin + ".tmp"
+    with open(temporaire,"wb") as fichier:
+        for bloc in ( entete , blocChaines , versOctets(noms) , drapeaux ,
+                      versOctets(debuts) , versOctets(cibles) ,
+                      versOctets(debutsEntrants) , versOctets(sources) , blocServices ):
+            fichier.write(bloc)
+        fichier.flush()
+        os.fsync(fichier.fileno())
+    os.replace(temporaire,chemin)
+
+def tailles(entete):
+    """
+        vérifie l'en-tête, et donne la taille de chaque partie du fichier
+    """
+    if len(entete) < ENTETE_INSTANTANE.size:
+        raise ErreurInstantane("fichier tronqué")
+    magique,version,nbNoeuds,nbLiens,tailleChaines,tailleServices = ENTETE_INSTANTANE.unpack_from(entete)
+    if magique != MAGIQUE:
+        raise ErreurInstantane("ce fichier n'est pas un instantané")
+    if version != FORMAT:
+        raise ErreurInstantane("format d'instantané inconnu : "+str(version))
+    return ( nbNoeuds , [ tailleChaines , 4*nbNoeuds , nbNoeuds ,
+                          4*(nbNoeuds+1) , 4*nbLiens ,
+                          4*(nbNoeuds+1) , 4*nbLiens , tailleServices ] )
+
+def construit(nbNoeuds,blocs,services=None):
+    """
+        crée la topologie depuis les parties lues du fichier,
+        après les avoir vérifiées
+    """
+    #les entrants ne sont pas lus : ils sont reconstruits depuis les liens
+    blocChaines,blocNoms,drapeaux,blocDebuts,blocCibles,_,_,blocServices = blocs
+    try:
+        chaines = str(blocChaines,encoding="utf-8").split("\0")
+    except UnicodeError:
+        raise ErreurInstantane("chaines invalides")
+    noms = depuisOctets(U32,blocNoms)
+    debuts = depuisOctets(U32,blocDebuts)
+    cibles = depuisOctets(U32,blocCibles)
+    #vérifie les indices
+    if len(chaines) < nbNoeuds or (noms and max(noms) >= len(chaines)):
+        raise ErreurInstantane("noms invalides")
+    if debuts[0] != 0 or debuts[-1] != len(cibles) or (cibles and max(cibles) >= nbNoeuds):
+        raise ErreurInstantane("liens invalides")
+    if any( debuts[i] > debuts[i+1] for i in range(nbNoeuds) ):
+        raise ErreurInstantane("liens invalides")
+    adresses = chaines[:nbNoeuds]
+    if len(set(adresses)) != nbNoeuds:
+        raise ErreurInstantane("adresses en double")
+    #le ramasse-miettes, déclenché sans cesse par la création des
+    #noeuds et de leurs ensembles, est suspendu pendant la construction
+    ramasse = gc.isenabled()
+    gc.disable()
+    try:
+        topologie = Topologie.depuisTableaux( adresses , [ chaines[i] for i in noms ] ,
+                                              [ bool(d & DIRECT) for d in drapeaux ] ,
+                                              [ bool(d & AVANCE) for d in drapeaux ] ,
+                                              debuts , cibles )
+    finally:
+        if ramasse:
+            gc.enable()
+    if services is not None:
+        try:
+            services.chargeDict( json.loads( str(blocServices,encoding="utf-8") ) )
+        except (ValueError,KeyError,TypeError,AttributeError):
+            raise ErreurInstantane("services invalides")
+    return topologie
+
+def charge(chemin,services=None,projection=True):
+    """
+        charge une topologie, et remplace les services
+        d'un RegistreServices s'il est donné
+
+        :param projection: projeter le fichier en mémoire (mmap),
+                           sinon le lire comme un flux
+        :return: la topologie
+    """
+    with open(chemin,"rb") as fichier:
+        if not projection:
+            return chargeFlux(fichier,services)
+        try:
+            carte = mmap.mmap(fichier.fileno(),0,access=mmap.ACCESS_READ)
+        except (ValueError,OSError):
+            #fichier vide, ou projection impossible
+            return chargeFlux(fichier,services)
+        with carte:
+            #les vues sur le fichier doivent être libérées avant sa fermeture
+            vue = memoryview(carte)
+            blocs = [ vue[:ENTETE_INSTANTANE.size] ]
+            try:
+                nbNoeuds , parties = tailles(blocs[0])
+                position = ENTETE_INSTANTANE.size
+                if position+sum(parties) > len(vue):
+                    raise ErreurInstantane("fichier tronqué")
+                for taille in parties:
+                    blocs.append( vue[position:position+taille] )
+                    position += taille
+                return construit(nbNoeuds,blocs[1:],services)
+            finally:
+                for bloc in blocs:
+                    bloc.release()
+                vue.release()
+
+def chargeFlux(flux,services=None):
+    """
+        charge une topologie depuis un flux (fichier, socket.makefile...),
+        lu dans l'ordre
+    """
+    def lis(taille):
+        donnees = flux.read(taille)
+        if len(donnees) != taille:
+            raise ErreurInstantane("fichier tronqué")
+        return donnees
+    nbNoeuds , parties = tailles( lis(ENTETE_INSTANTANE.size) )
+    return construit(nbNoeuds,[ lis(taille) for taille in parties ],services)
+
+def chargeTexte(chemin):
+    """
+        charge une ancienne sauvegarde texte (dictionnaire
+        donné par Topologie.versDict), sans exécuter son contenu
+    """
+    with open(chemin,"r",encoding="utf-8") as fichier:
+        try:
+            carte = ast.literal_eval( fichier.read() )
+        except (ValueError,SyntaxError):
+            raise ErreurInstantane("sauvegarde texte invalide")
+    try:
+        return Topologie.depuisDict(carte)
+    except (KeyError,TypeError,AttributeError):
+        raise ErreurInstantane("sauvegarde texte invalide")
+
+def convertit(source,destination):
+    """
+        converti une ancienne sauvegarde texte en instantané
+    """
+    sauve( destination , chargeTexte(source) )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "conversion des sauvegardes texte en instantanés")
+    parser.add_argument("source",help = "ancienne sauvegarde texte")
+    parser.add_argument("destination",nargs = "?",help = "instantané (source en .carte par défaut)")
+    args = parser.parse_args()
+    destination = args.destination or os.path.splitext(args.source)[0]+".carte"
+    convertit(args.source,destination)
+    print(args.source,"->",destination)
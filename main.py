@@ -14,25 +14,37 @@
     et un autre pour le tunnel. Ainsi, il se connecte à tous les
     périphériques qu'il trouve à proximité avec ce protocole, et peut
     transmettre des données par la connection tunnel.
+    Entre deux routeurs, une seule connexion porte les paquets et
+    les sessions de tunnel, dans des flux (voir multiplex.py).
 
-    Ce programme utilise la bibliothèque pybluez
+    Ce programme utilise la bibliothèque pybluez, à travers
+    la couche de transport (voir transport.py). Un transport TCP
+    permet aussi de simuler plusieurs routeurs sur une même machine
+    (voir simulateur.py)
+
+    utilisation:
+        python main.py                   routeur avec son interface graphique
+        python main.py --sans-interface  routeur seul (relais), arrêté par Ctrl-C
+                       [--recherche S] [--retransmet ADRESSE[/N]]
+                       [--asyncio] [--statistiques]
 
     versions:
-        python 3.3.5
-        pybluez 0.20 for python 3.3
+        python 3.7 ou plus récent (simulateur et banc compris)
+        pybluez compilé pour la même version de python
         
         
     :var mappageReseau:
-          dictionnaire de toutes les addresses connues de ce point
-          où chaque entrée est repéree par son adresse MAC
+          topologie (voir topologie.py) de toutes les addresses
+          connues de ce point, où chaque noeud est repéré par
+          son adresse MAC
           
-          attributs:
+          attributs d'un noeud:
             nom : nom lisible du périphérique
             direct : le périphérique est-il visible d'ici
             avance : le périphérique a-t-il un serveur
             liens : périphériques contactables à travers celui-ci
           
-        exemple de dictionnaire:
+        exemple (sous forme de dictionnaire, voir Topologie.versDict):
           {
             "XX:XX:XX:XX:00" : {"nom": "ordi1" ,
                                 "direct": True ,
@@ -47,16 +59,34 @@
                                 "avance": False,
                                 "liens": <liste de proximité de telephone>}
           }
+          
+          Il n'est modifié que par le thread propriétaire de l'état
+          (voir commandes.py et etatReseau) : les autres threads
+          y envoient leurs modifications, et en lisent un instantané
+          (voir lisMappage)
 """
 
-import bluetooth
 import threading
+import concurrent.futures
 import time
-import binascii
-import math
 import os,sys
-from tkinter import *
-import tkinter.ttk as ttk
+#asyncio, tkinter, le dessin de la carte et les instantanés ne sont importés qu'à leur
+#première utilisation : un routeur sans interface (--sans-interface)
+#démarre plus vite et utilise moins de mémoire
+
+from topologie import Topologie
+from connexions import PoolConnexions
+from transport import TransportBluetooth
+from trame import LecteurTrames, ErreurTrame, Morceau, encodeTrame, decoupeEnregistrements
+from relais import SessionRelais
+from noms import CacheNoms
+from services import RegistreServices
+from requetes import TableRequetes, IdentifiantsVus, nouvelIdentifiant
+from routage import TableRoutage
+from acheminement import FileEnvoi, estRelais, lisEnteteRelais, trameRelais, LIMITE_SAUTS
+from statistiques import Statistiques
+from commandes import FileCommandes
+from multiplex import Multiplexeur, estFlux
 
 ##  paramètres du programme
 
@@ -64,23 +94,121 @@ import tkinter.ttk as ttk
 UUID_Serveur = "67b7a1d0-fd7b-11e4-b939-0800200c9a66"
 #UUID_Tunnel  = "67b7a1d1-fd7b-11e4-b939-0800200c9a66"
 
+# canal testé pour savoir si un périphérique est contactable
+CANAL_SONDE = 19
+# durée maximale d'une sonde (connexion ou résolution du nom)
+DELAI_SONDE = 5
+# nombre de sondes en parallèle
+MAX_SONDES = 8
+
+# durée maximale d'une recherche réseau (s), réponses des autres routeurs comprises
+DELAI_RECHERCHE = 20
+# temps laissé à chaque routeur pour transmettre sa réponse (s) : un routeur
+# interrogé doit avoir terminé MARGE_RECHERCHE avant celui qui l'interroge
+MARGE_RECHERCHE = 0.5
+
+# fichier de sauvegarde du cache des noms (None : pas de sauvegarde)
+FICHIER_NOMS = os.path.join( os.path.dirname(os.path.abspath(__file__)) , "noms.json" )
+
+# taille maximale lue en une fois sur un socket
+TAILLE_RECEPTION = 4096
+
+# nombre de connexions entrantes en file d'attente
+FILE_ATTENTE_SERVEUR = 64
+
+# serveur dans une boucle asyncio (un seul thread pour toutes les
+# connexions entrantes) au lieu d'un thread par connexion
+SERVEUR_ASYNCIO = False
+# nombre maximum de connexions entrantes du serveur asyncio
+MAX_CONNEXIONS_ENTRANTES = 4096
+# nombre de threads pour les traitements bloquants du serveur asyncio
+TAILLE_EXECUTEUR = 4
+# paquets dont le traitement est long et bloquant
+PAQUETS_BLOQUANTS = ()
+# nombre d'envois en parallèle d'une découverte réseau
+MAX_ENVOIS = 8
+# paquets lus en flux, appliqués au fur et à mesure de leur réception
+PAQUETS_EN_FLUX = (b"reponse,",)
+
+# enregistrement des statistiques dès le démarrage (voir statistiques.py)
+STATISTIQUES = False
+# fichier d'export des statistiques
+FICHIER_STATISTIQUES = os.path.join( os.path.dirname(os.path.abspath(__file__)) , "statistiques.json" )
+# période de mise à jour de la fenêtre des statistiques (ms)
+PERIODE_STATISTIQUES = 1000
+
 ##  variables
 
+#transport utilisé (pybluez par défaut, voir transport.py)
+transport = TransportBluetooth()
 #socket du serveur
 socketServeur = None
 #périphériques directs
 peripheriquesContactables = []
 peripheriquesAdjacents = []
+#port du serveur de chaque périphérique contactable
+portsServeur = {}
+#noms des périphériques déjà résolus (voir noms.py)
+cacheNoms = CacheNoms()
 #mappage réseau à partir de ce point
-mappageReseau = {}
-mappageService = {}
-#recherche
-rechercheLancees = 0
-origineRecherche = ""
+mappageReseau = Topologie()
+#file des modifications de l'état (mappage, routes, périphériques
+#directs, services), appliquées par un seul thread (voir commandes.py)
+etatReseau = FileCommandes()
+#prochain saut vers chaque adresse du mappage (voir routage.py)
+tableRoutage = TableRoutage(mappageReseau)
+#services des périphériques à proximité (voir services.py), modifiés
+#par des commandes de etatReseau ; lus directement par les autres threads
+mappageService = RegistreServices()
+#recherches envoyées aux autres routeurs, en attente de réponse
+requetesRecherche = TableRequetes()
+#découvertes réseau déjà reçues, ignorées si elles reviennent
+decouvertesVues = IdentifiantsVus()
+#version du mappage de chaque routeur déjà reçue : adresse -> ( époque , version )
+versionsPairs = {}
+#fonctions appelées avec ( source , données ) à la réception
+#d'un paquet relayé destiné à ce routeur (voir acheminement.py)
+receveursRelais = []
+#fonctions appelées avec le flux, pour chaque flux ouvert par un
+#autre routeur, selon le début de son argument (voir accepteFlux)
+receveursFlux = {}
+#mesures des chemins critiques (voir statistiques.py)
+statistiques = Statistiques(STATISTIQUES)
+statPaquetsEnvoyes = statistiques.compteur("paquets.envoyes")
+statPaquetsRecus = statistiques.compteur("paquets.recus")
+statOctetsEnvoyes = statistiques.compteur("octets.envoyes")
+statOctetsRecus = statistiques.compteur("octets.recus")
+statErreurs = statistiques.compteur("paquets.erreurs")
+statEnvoi = statistiques.histogramme("paquets.envoi")
+statTraitement = statistiques.histogramme("paquets.traitement")
+statRelaisTransmis = statistiques.compteur("relais.transmis")
+statRelaisRecus = statistiques.compteur("relais.recus")
+statRelaisPerdus = statistiques.compteur("relais.perdus")
+statTunnels = statistiques.compteur("tunnels.octets")
+statRequetes = statistiques.compteur("recherche.requetes")
+statDecouvertes = statistiques.compteur("decouverte.envois")
+statDoublons = statistiques.compteur("decouverte.doublons")
+statReponses = statistiques.compteur("recherche.reponses")
+statFluxOuverts = statistiques.compteur("flux.ouverts")
+#durées des étapes des recherches, et de la mise à jour des routes
+statStandardSonde = statistiques.histogramme("standard.sonde")
+statStandardNom = statistiques.histogramme("standard.nom")
+statStandardInquiry = statistiques.histogramme("standard.inquiry")
+statStandardDuree = statistiques.histogramme("standard.duree")
+statDecouverteSdp = statistiques.histogramme("decouverte.sdp")
+statDecouverteDuree = statistiques.histogramme("decouverte.duree")
+statRechercheInquiry = statistiques.histogramme("recherche.inquiry")
+statRechercheSdp = statistiques.histogramme("recherche.sdp")
+statRechercheAttente = statistiques.histogramme("recherche.attente")
+statRechercheDuree = statistiques.histogramme("recherche.duree")
+statEtatRoutes = statistiques.histogramme("etat.routes")
+statistiques.jauge("mappage.noeuds",lambda: len(mappageReseau))
+statistiques.jauge("mappage.routes",lambda: len(tableRoutage))
+statistiques.jauge("etat.enAttente",lambda: etatReseau.enAttente())
 
 ## classe
 
-class SocketServeur(bluetooth.BluetoothSocket):
+class SocketServeur:
     """
         Classe qui permet de lancer l'application
         sur l'un des ports du périphérique
@@ -90,101 +218,471 @@ class SocketServeur(bluetooth.BluetoothSocket):
         """
             Permet de créer un socket serveur
         """
+        #flux ouverts avec les autres routeurs (voir multiplex.py)
+        self.multiplex = Multiplexeur(self.envoieTrame,accepteFlux)
+        #connexions vers les autres serveurs, une par pair et lues
+        #comme les connexions entrantes ; gardées tant qu'elles portent
+        #des flux
+        self.pool = PoolConnexions(connecteRFCOMM,
+                                   ouverture = self.lisConnexion,
+                                   garde = lambda pair: self.multiplex.actifs(pair) > 0,
+                                   fermeture = self.retireFile)
+        #files d'envoi des paquets relayés, par voisin, tant que
+        #sa connexion est ouverte
+        self.files = {}
+        self.verrouFiles = threading.Lock()
+        #boucle du serveur asyncio, si elle tourne
+        self.boucleAsync = None
         try:
             # initialise un socket RFCOMM
-            bluetooth.BluetoothSocket.__init__( self, bluetooth.RFCOMM )
+            self.socket = transport.socket( transport.RFCOMM )
             # applique le socket sur le premier adaptateur trouvé,
             # et le premier port libre
-            self.bind( ("",bluetooth.PORT_ANY) )
-            # commence l'écoute sur le port, avec une connection
-            # en file d'attente au maximum
-            self.listen(1)
+            self.socket.bind( ("",transport.PORT_ANY) )
+            # commence l'écoute sur le port, les pairs gardant leur
+            # connexion ouverte (voir connexions.py), plusieurs peuvent
+            # se connecter en même temps
+            self.socket.listen(FILE_ATTENTE_SERVEUR)
             # averti le serveur SDP de la présence du serveur
-            bluetooth.advertise_service( self, "Paquet",uuid,[uuid])
+            transport.advertise_service( self.socket, "Paquet",uuid,[uuid])
             #variable interne
             self.creationReussie = True
         except OSError:
-            #erreur dûe à pybluez (pas très descriptive...)
+            #erreur dûe au transport (pas très descriptive avec pybluez...)
             #variable interne
             self.creationReussie = False
             #defini une valeure bidon d'addresse de serveur
             self.getsockname = lambda: ("XX:XX:XX:XX:XX:XX",0)
             #variable interne
             self.actif = True
+            self.socket = None
             return
         #initialise la liste des connections
         self.connections = []
         #variable interne
         self.actif = True
+        #ferme régulièrement les connexions sortantes inutilisées
+        self.pool.demarreNettoyage()
+    
+    def accept(self):
+        """
+            attend une connexion entrante
+            
+            :return: tuple ( socket , adresse )
+        """
+        return self.socket.accept()
+    
+    def getsockname(self):
+        """
+            donne l'adresse du serveur, sous forme (host,channel)
+        """
+        return self.socket.getsockname()
+    
+    def lisConnexion(self,sock,destination):
+        """
+            lit dans un nouveau thread une connexion ouverte vers un pair
+            (voir connexions.py) : le pair peut y répondre
+        """
+        dat = threading.Thread(target = self.serveurDataThread,args = [sock])
+        dat.daemon = True
+        dat.start()
+    
+    def sertConnexion(self,connexion):
+        """
+            lit une connexion acceptée (voir serveurDataThread), puis
+            la retire de la liste des connexions
+            
+            :param connexion: liste [ adresse , socket ] de "connections"
+        """
+        try:
+            self.serveurDataThread(connexion[1])
+        finally:
+            self.connections.remove(connexion)
     
     def serveurDataThread(self,sock):
         """
             permet l'attente de données entrantes sur le socket
             sans arreter le reste du code
         """
-        tampon = ""
-        tailleMessage = None
+        #tampon de réception, réutilisé pour tous les paquets (voir trame.py)
+        lecteur = LecteurTrames(prefixesFlux = PAQUETS_EN_FLUX)
+        #lecture du paquet en flux en cours (voir recoitMorceau)
+        enCours = None
+        try:
+            pair = sock.getpeername()[0]
+        except OSError:
+            pair = None
         #tant que des données arrivent
+        #(l'envoyeur garde la connexion ouverte entre ses paquets)
         while True:
             #reçoit des données
-            dat = sock.recv()
+            try:
+                recu = lecteur.recoit(sock)
+            except OSError:
+                break
             #ferme si plus de données
-            if not dat:
+            if not recu:
+                break
+            statOctetsRecus.ajoute(recu)
+            #traite tous les paquets complets du tampon
+            try:
+                for trame in lecteur.trames():
+                    #morceau d'une réponse : appliqué sans attendre la suite
+                    if type(trame) is Morceau:
+                        enCours = self.recoitMorceau(sock,trame,enCours)
+                        continue
+                    statPaquetsRecus.ajoute()
+                    #paquet relayé : transmis sans être décodé, et sans attendre
+                    #(perdu si la file du prochain saut est pleine) : un
+                    #voisin lent ne doit pas bloquer les autres paquets du lien
+                    if estRelais(trame):
+                        self.achemine(trame,False)
+                        continue
+                    #paquet d'un flux : rangé sans attendre
+                    if estFlux(trame):
+                        self.recoitFlux(pair,trame)
+                        continue
+                    debut = statistiques.horloge()
+                    try:
+                        self.utilisePaquet(sock,str(trame,encoding="utf-8"))
+                    except ErreurTrame:
+                        raise
+                    except Exception as e:
+                        #un paquet mal traité n'arrête pas la lecture des suivants
+                        statErreurs.ajoute()
+                        print("erreur de traitement :",repr(e))
+                    statTraitement.depuis(debut)
+            except ErreurTrame as e:
+                print("paquet refusé :",e)
                 break
-            #ajoute les données au tampon
-            tampon += dat
-            #recupère la taille requise
-            if ":" in tampon and not tailleMessage:
-                p = tampon.find(";")
-                tailleMessage = int(l[:p])
-                tampon = l[p:]
-            #attend d'avoir reçu un paquet entier
-            if tailleMessage:
-                if len( tampon ) >= tailleMessage:
-                    self.utilisePaquet(sock,tampon[:tailleMessage])
-                    tampon = tampon[tailleMessage:]
+        sock.close()
+        self.finConnexion(pair,sock)
+    
+    def recoitFlux(self,pair,trame):
+        """
+            transmet un paquet de flux reçu au multiplexeur
+        """
+        try:
+            self.multiplex.recoit(pair,trame)
+        except ValueError as e:
+            statErreurs.ajoute()
+            print("paquet de flux refusé :",e)
+    
+    def finConnexion(self,pair,sock):
+        """
+            oublie une connexion dont la lecture est terminée : les flux
+            du pair sont arrêtés s'il ne reste aucune connexion vers lui
+        """
+        self.pool.oublie(sock)
+        if self.pool.lien(pair) is None:
+            self.multiplex.lienPerdu(pair)
         
+    async def serveurAsync(self,maxConnexions=MAX_CONNEXIONS_ENTRANTES):
+        """
+            attend les connexions entrantes, et lit chacune d'elles
+            dans une tâche asyncio : toutes les connexions sont
+            servies par le même thread
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        #threads des traitements bloquants
+        self.executeur = concurrent.futures.ThreadPoolExecutor(TAILLE_EXECUTEUR)
+        #réveillé par une connexion entrante, ou par close()
+        self.reveilAsync = asyncio.Event()
+        self.boucleAsync = loop
+        lecteurs = set()
+        self.socket.setblocking(False)
+        fd = self.socket.fileno()
+        loop.add_reader(fd,self.reveilAsync.set)
+        try:
+            while self.actif:
+                await self.reveilAsync.wait()
+                self.reveilAsync.clear()
+                #accepte toutes les connexions en attente
+                while self.actif:
+                    try:
+                        extSocket , address = self.accept()
+                    except BlockingIOError:
+                        break
+                    except OSError:
+                        return
+                    if len(lecteurs) >= maxConnexions:
+                        print("trop de connexions, refuse",address)
+                        extSocket.close()
+                        continue
+                    #démarre une tâche de discussion
+                    connexion = [ address , extSocket ]
+                    self.connections.append( connexion )
+                    tache = loop.create_task( self.lecteurAsync(extSocket) )
+                    lecteurs.add(tache)
+                    tache.add_done_callback( lecteurs.discard )
+                    tache.add_done_callback( lambda t,c=connexion: self.connections.remove(c) )
+        finally:
+            loop.remove_reader(fd)
+            self.boucleAsync = None
+            for tache in lecteurs:
+                tache.cancel()
+            self.executeur.shutdown(wait=False)
+    
+    async def lecteurAsync(self,sock):
+        """
+            équivalent de serveurDataThread pour le serveur asyncio:
+            lit le socket quand des données sont disponibles
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        lecteur = LecteurTrames(prefixesFlux = PAQUETS_EN_FLUX)
+        enCours = None
+        lisible = asyncio.Event()
+        pair = sock.getpeername()[0]
+        #non bloquant : il n'est pas adopté pour répondre au pair
+        #(voir connexions.py), les réponses partent par une connexion
+        #ouverte d'ici
+        sock.setblocking(False)
+        fd = sock.fileno()
+        loop.add_reader(fd,lisible.set)
+        try:
+            while True:
+                await lisible.wait()
+                lisible.clear()
+                #reçoit des données
+                try:
+                    recu = lecteur.recoit(sock)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    break
+                #ferme si plus de données
+                if not recu:
+                    break
+                statOctetsRecus.ajoute(recu)
+                #traite tous les paquets complets du tampon
+                try:
+                    for trame in lecteur.trames():
+                        if type(trame) is Morceau:
+                            enCours = self.recoitMorceau(sock,trame,enCours)
+                            continue
+                        statPaquetsRecus.ajoute()
+                        if estRelais(trame):
+                            #sans attendre : la boucle ne doit pas bloquer
+                            self.achemine(trame,False)
+                        elif estFlux(trame):
+                            self.recoitFlux(pair,trame)
+                        else:
+                            self.utilisePaquetAsync(sock,str(trame,encoding="utf-8"))
+                except ErreurTrame as e:
+                    print("paquet refusé :",e)
+                    break
+        finally:
+            loop.remove_reader(fd)
+            sock.close()
+            self.finConnexion(pair,sock)
+    
+    def utilisePaquetAsync(self,sender,dat):
+        """
+            interprète un paquet depuis la boucle asyncio : les
+            paquets longs à traiter le sont dans un autre thread
+        """
+        if dat.split(",",1)[0] in PAQUETS_BLOQUANTS:
+            import asyncio
+            futur = asyncio.get_running_loop().run_in_executor(self.executeur,self.utilisePaquet,sender,dat)
+            futur.add_done_callback(afficheErreur)
+        else:
+            debut = statistiques.horloge()
+            try:
+                self.utilisePaquet(sender,dat)
+            except Exception as e:
+                statErreurs.ajoute()
+                print("erreur de traitement :",repr(e))
+            statTraitement.depuis(debut)
+    
+    def recoitMorceau(self,sender,morceau,enCours):
+        """
+            traite un morceau d'un paquet lu en flux (voir trame.py)
+            
+            :param enCours: lecture du paquet (générateur, voir lisReponse),
+                            ou None au premier morceau ou après une erreur
+            :return: la lecture du paquet, ou None s'il est terminé
+        """
+        if morceau.premier:
+            statPaquetsRecus.ajoute()
+            enCours = lisReponse(sender.getpeername()[0])
+            next(enCours)
+        if enCours is None:
+            #la suite d'un paquet mal traité est ignorée
+            return None
+        try:
+            enCours.send(morceau.donnees)
+            if morceau.dernier:
+                enCours.send(None)
+        except StopIteration:
+            pass
+        except Exception as e:
+            statErreurs.ajoute()
+            print("erreur de traitement :",repr(e))
+            enCours.close()
+            return None
+        if morceau.dernier:
+            return None
+        return enCours
+    
     def utilisePaquet(self,sender,dat):
         """
             interprète les données d'un paquet reçu
         """
-        print("recu paquet:\n",dat)
         liste = dat.split(",")
         if liste[0] == "decouverte":
-            #demande de découverte réseau en profondeur
-            addresses = [ ( i.split("/")[0] , int(i.split("/")[1]) ) for i in liste[1:] ]
-            decouverteReseau(sender,adresses)
+            #demande de découverte réseau en profondeur:
+            #  decouverte,<identifiant>
+            #(une demande déjà reçue par un autre chemin est ignorée)
+            ident = liste[1]
+            if not decouvertesVues.nouveau(ident):
+                statDoublons.ajoute()
+                return
+            origine = sender.getpeername()[0]
+            #dans son propre thread, comme la recherche
+            t = threading.Thread(target = decouverteReseau,args = [origine,ident])
+            t.daemon = True
+            t.start()
         elif liste[0] == "recherche":
-            #demande de recherche réseau en profondeur
-            addresses = [ ( i.split("/")[0] , int(i.split("/")[1]) ) for i in liste[1:] ]
-            rechercheReseau(adresses)
+            #demande de recherche réseau en profondeur:
+            #  recherche,<identifiant>,<délai>,<époque>,<version>,<adresses déjà inspectées>
+            #(époque et version : mappage d'ici déjà connu par l'envoyeur)
+            ident , delai = int(liste[1]) , float(liste[2])
+            connu = ( liste[3] , int(liste[4]) )
+            origine = sender.getpeername()[0]
+            #dans son propre thread : la lecture des paquets suivants,
+            #dont les réponses attendues, n'est pas bloquée
+            t = threading.Thread(target = rechercheReseau,
+                                 args = [origine,liste[5:],delai,ident,connu])
+            t.daemon = True
+            t.start()
         elif liste[0] == "reponse":
-            #réponse à une recherche réseau
+            #réponse à une recherche réseau:
+            #  reponse,<identifiant>,<époque>,<version>,<complet>,<éléments séparés par ;>
+            #(voir reponseDepuisMappage)
+            _ , ident , epoque , version , complet , infos = dat.split(",",5)
+            items = infos.split(";") if infos else []
             #point de départ du retour
-            addStart = sender.getsockname()[0]
-            #récupère les autres infos
-            info = dat[8 + info[8:].find(",") : ]
-            items = infos.split(";")
+            addStart = sender.getpeername()[0]
             #envoie ce paquet traité
-            reponseRecherche(addStart,items)
+            etatReseau.envoie(reponseRecherche,addStart,int(ident),items,epoque,int(version),complet == "1")
     
     def envoiePaquet(self,dest,dat):
         """
             Permet d'envoyer un paquet de donnée à un destinataire
             
-            :param dest: tuple de forme (host,channel)
+            La connexion vers le destinataire est gardée ouverte
+            pour les paquets suivants (voir connexions.py)
+            
+            :param dest: tuple de forme (host,channel),
+                         ou adresse MAC d'un périphérique contactable
         """
-        #trouve la taille du paquet
-        tailleMessage = len( bytes(dat,encoding="utf-8") )
-        #crée le paquet
-        message = str(tailleMessage) + ";" + dat
-        #ouvre une connection
-        sock = bluetooth.BluetoothSocket( bluetooth.RFCOMM )
-        sock.connect( (dest[0] , bluetooth.PORT_ANY) )
+        #crée le paquet, précédé de sa taille
+        message = encodeTrame( bytes(dat,encoding="utf-8") )
         #envoie le message
-        sock.send(message)
-        #ferme la connection
-        sock.close()
+        self.envoieTrame(dest,message)
+        statPaquetsEnvoyes.ajoute()
+    
+    def envoieTrame(self,dest,message):
+        """
+            envoie des paquets déjà tramés (voir trame.py) à un destinataire
+            
+            :param dest: tuple de forme (host,channel),
+                         ou adresse MAC d'un périphérique contactable
+        """
+        if isinstance(dest,str):
+            dest = (dest , portsServeur.get(dest,transport.PORT_ANY))
+        debut = statistiques.horloge()
+        self.pool.envoie(dest,message)
+        statEnvoi.depuis(debut)
+        statOctetsEnvoyes.ajoute(len(message))
+    
+    def fileVers(self,voisin):
+        """
+            donne la file d'envoi des paquets relayés vers un voisin
+        """
+        with self.verrouFiles:
+            file = self.files.get(voisin)
+            if file is None:
+                file = FileEnvoi( lambda message: self.envoieTrame(voisin,message) )
+                self.files[voisin] = file
+            return file
+    
+    def retireFile(self,voisin):
+        """
+            arrête et oublie la file d'envoi vers un voisin dont la
+            connexion est fermée : ses paquets en attente sont encore
+            envoyés, et elle est recréée au prochain paquet pour lui
+        """
+        with self.verrouFiles:
+            file = self.files.pop(voisin,None)
+        if file is not None:
+            file.ferme()
+    
+    def ajouteVers(self,voisin,trame,bloquant=True):
+        """
+            ajoute une trame à la file d'envoi d'un voisin
+            
+            :return: False si la trame est perdue (file pleine)
+        """
+        while True:
+            file = self.fileVers(voisin)
+            if file.ajoute(trame,bloquant):
+                return True
+            #file arrêtée entre temps : une nouvelle est créée
+            if file.actif:
+                return False
+    
+    def envoieRelais(self,dest,donnees,limite=LIMITE_SAUTS):
+        """
+            envoie des données à un routeur éventuellement éloigné,
+            relayées par les routeurs intermédiaires
+            
+            :param dest: adresse MAC du destinataire
+            :param donnees: octets à envoyer
+            :return: False s'il n'y a pas de route vers "dest"
+        """
+        saut = tableRoutage.prochainSaut(dest)
+        if saut is None:
+            return False
+        trame = trameRelais(dest,limite,self.getsockname()[0],donnees)
+        self.ajouteVers(saut,trame)
+        return True
+    
+    def achemine(self,trame,bloquant=True):
+        """
+            traite un paquet relayé : le donne aux receveurs s'il
+            est destiné à ce routeur, sinon le transmet au prochain saut
+            
+            :param trame: le paquet, sans son en-tête de taille
+            :param bloquant: attendre si la file du prochain saut est pleine
+        """
+        try:
+            destination , limite , source , debut = lisEnteteRelais(trame)
+        except (ValueError,UnicodeError) as e:
+            print("paquet relayé refusé :",e)
+            return
+        #destiné à ce routeur
+        if destination == self.getsockname()[0]:
+            statRelaisRecus.ajoute()
+            recoitRelais(source,bytes(trame[debut:]))
+            return
+        #transmet au prochain saut
+        if limite <= 1:
+            statRelaisPerdus.ajoute()
+            print("paquet relayé perdu : limite de sauts atteinte, vers",destination)
+            return
+        saut = tableRoutage.prochainSaut(destination)
+        if saut is None:
+            statRelaisPerdus.ajoute()
+            print("paquet relayé perdu : pas de route vers",destination)
+            return
+        #copie nécessaire : la trame n'est valable que jusqu'à la suivante
+        if self.ajouteVers( saut , trameRelais(destination,limite-1,source,trame[debut:]) , bloquant ):
+            statRelaisTransmis.ajoute()
+        else:
+            statRelaisPerdus.ajoute()
     
     def close(self):
         """
@@ -192,12 +690,26 @@ class SocketServeur(bluetooth.BluetoothSocket):
         """
         #change la variable interne
         self.actif = False
+        #arrête les files d'envoi et les flux, et ferme les connexions sortantes
+        with self.verrouFiles:
+            for file in self.files.values():
+                file.ferme()
+        self.multiplex.ferme()
+        self.pool.ferme()
+        #réveille le serveur asyncio, pour qu'il s'arrête
+        if self.boucleAsync is not None:
+            try:
+                self.boucleAsync.call_soon_threadsafe(self.reveilAsync.set)
+            except RuntimeError:
+                pass
+        if self.socket is None:
+            return
         #arrête la pub
-        bluetooth.stop_advertising( self )
+        transport.stop_advertising( self.socket )
         #ferme le socket
-        bluetooth.BluetoothSocket.close(self)
+        self.socket.close()
 
-class SocketTunnel(bluetooth.BluetoothSocket):
+class SocketTunnel:
     """
         Permet la retransmission d'un service
         dans les deux sens de communication
@@ -209,81 +721,172 @@ class SocketTunnel(bluetooth.BluetoothSocket):
         """
         #récupère les infos
         self.origine = addOrigine
+        self.nomProtocole = serviceInfo["protocol"]
         
         if serviceInfo["protocol"] == "RFCOMM":
-            self.protocole = bluetooth.RFCOMM
+            self.protocole = transport.RFCOMM
         elif serviceInfo["protocol"] == "L2CAP":
-            self.protocole = bluetooth.L2CAP
+            self.protocole = transport.L2CAP
         
         self.port = serviceInfo["port"]
+        #sessions en cours
+        self.sessions = []
+        #nom des statistiques du tunnel (voir statistiques.py)
+        self.nomStat = "tunnels.%s.%d" % (self.origine,self.port)
         
         #crée un service correspondant
-        bluetooth.BluetoothSocket.__init__(self, self.protocole)
+        self.socket = transport.socket(self.protocole)
         try:
-            self.bind( ("",bluetooth.PORT_ANY) )
+            self.socket.bind( ("",transport.PORT_ANY) )
+            self.socket.listen(FILE_ATTENTE_SERVEUR)
         except OSError:
             print("[retransmission de "+self.origine+"] impossible")
             return
         
         #fais de la pub
-        bluetooth.advertise_service(self,serviceInfo["name"],
+        transport.advertise_service(self.socket,serviceInfo["name"],
                                          serviceInfo["service-id"],
                                          serviceInfo["service-classes"],
                                          serviceInfo["profiles"])
+        #débit des sessions en cours
+        statistiques.jauge(self.nomStat+".sessions",lambda: len(self.sessions))
+        statistiques.jauge(self.nomStat+".debit",lambda: sum( s.debit() for s in list(self.sessions) ))
     
     def begin(self):
         """
             démarre la retransmission d'information
+            
+            chaque connexion extérieure est retransmise dans sa
+            propre session, plusieurs sessions pouvant être actives
+            en même temps (voir relais.py)
         """
         while True:
             #attend une connexion extérieure
             try:
                 print("[retransmission de "+self.origine+"] en attente de connexion")
-                extSocket , addresse = self.accept()
+                extSocket , addresse = self.socket.accept()
             except OSError:
                 return
-            #tente une connexion vers l'arrivée
-            print("[retransmission de "+self.origine+"] connexion de"+addresse)
-            socketSortie = bluetooth.BluetoothSocket( self.protocole )
-            socketSortie.connect( (self.origine,self.port) )
-            #démarre les deux sens de transmission
-            self.transArretee = False
-            transIn = threading.Thread(target=lambda: self.boucleRetrans(self,socketSortie))
-            transIn.daemon = True
-            transOut= threading.Thread(target=lambda: self.boucleRetrans(socketSortie,self))
-            transOut.daemon = True
-            transIn.start()
-            transOut.start()
-            #attend
-            while not self.transArretee:
-                time.sleep(1)
-            print("[retransmission de "+self.origine+"] arrêt de connexion")
-            #ferme les sockets
-            extSocket.close()
-            socketSortie.close()
-        
-    def boucleRetrans(self,entree,sortie):
+            #démarre la session
+            t = threading.Thread(target = self.session, args = [extSocket,addresse])
+            t.daemon = True
+            t.start()
+    
+    def session(self,extSocket,addresse):
         """
-            retransmet des données en boucle, sans s'arrêter
+            retransmet une connexion extérieure vers l'arrivée
         """
-        #boucle de données
-        while not self.transArretee:
-            d = entree.recv()
-            if not d:
-                break
-            sortie.send(d)
-        self.transArretee = True
+        #tente une connexion vers l'arrivée, directe ou par les autres routeurs
+        print("[retransmission de "+self.origine+"] connexion de",addresse)
+        try:
+            socketSortie = connecteService(self.origine,self.port,self.nomProtocole)
+        except OSError:
+            print("[retransmission de "+self.origine+"] arrivée injoignable")
+            extSocket.close()
+            return
+        #retransmet dans les deux sens, jusqu'à l'arrêt d'un des deux
+        session = SessionRelais(extSocket,socketSortie,addresse)
+        self.sessions.append(session)
+        try:
+            session.execute()
+        finally:
+            self.sessions.remove(session)
+            statTunnels.ajoute(session.entrant+session.sortant)
+        print("[retransmission de "+self.origine+"] arrêt de connexion :",session)
     
     def close(self):
         """
             ferme le socket
         """
         #ferme le socket
-        bluetooth.stop_advertising(self)
-        self.close()
+        transport.stop_advertising(self.socket)
+        self.socket.close()
+        statistiques.retire(self.nomStat+".sessions")
+        statistiques.retire(self.nomStat+".debit")
 
 ## fonctions
 
+def recoitRelais(source,donnees):
+    """
+        reçoit les données d'un paquet relayé destiné à ce routeur
+        
+        :param source: adresse MAC du routeur qui a envoyé les données
+    """
+    if not receveursRelais:
+        print("paquet relayé reçu de",source,":",len(donnees),"octets")
+    for receveur in receveursRelais:
+        receveur(source,donnees)
+
+def connecteService(add,port,protocole="RFCOMM"):
+    """
+        ouvre une connexion vers le service "port" de "add" : directement
+        s'il est à portée, sinon par un flux (voir multiplex.py) vers le
+        prochain routeur de la route, qui s'y connecte de la même façon
+        
+        :param protocole: "RFCOMM" ou "L2CAP"
+        :return: socket connecté, ou flux
+    """
+    route = tableRoutage.route(add)
+    if route is not None and route[1] > 1:
+        statFluxOuverts.ajoute()
+        return socketServeur.multiplex.ouvre(route[0],"service,%s,%d,%s" % (add,port,protocole))
+    sock = transport.socket( getattr(transport,protocole) )
+    try:
+        sock.connect( (add,port) )
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def accepteFlux(flux):
+    """
+        sert un flux ouvert par un autre routeur, dans son propre thread,
+        avec le receveur choisi par le début de son argument
+    """
+    receveur = receveursFlux.get( flux.argument.split(",",1)[0] )
+    if receveur is None:
+        print("flux inconnu de",flux.pair,":",flux.argument)
+        flux.close()
+        return
+    try:
+        receveur(flux)
+    except Exception as e:
+        print("erreur de flux :",repr(e))
+    finally:
+        flux.close()
+
+def retransmetService(flux):
+    """
+        retransmet un flux vers un service, pour la session de tunnel
+        d'un autre routeur :
+          service,<adresse>,<port>,<protocole>
+    """
+    _ , add , port , protocole = flux.argument.split(",")
+    try:
+        sortie = connecteService(add,int(port),protocole)
+    except OSError:
+        print("[retransmission de "+add+"] arrivée injoignable pour",flux.pair)
+        return
+    session = SessionRelais(flux,sortie,flux.pair)
+    session.execute()
+    statTunnels.ajoute(session.entrant+session.sortant)
+
+receveursFlux["service"] = retransmetService
+
+def connecteRFCOMM(dest):
+    """
+        ouvre une connexion RFCOMM vers "dest"
+        
+        :param dest: tuple de forme (host,channel)
+    """
+    sock = transport.socket( transport.RFCOMM )
+    try:
+        sock.connect( dest )
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
 def initialisation():
     global socketServeur
     """
@@ -291,9 +894,21 @@ def initialisation():
         et démarre les service appropriés sur les ports.
     """
     socketServeur = SocketServeur(UUID_Serveur)
+    #retrouve les noms déjà résolus
+    cacheNoms.fichier = FICHIER_NOMS
+    cacheNoms.charge()
+    #les routes partent de l'adresse du serveur
+    tableRoutage.changeDepart( socketServeur.getsockname()[0] )
+    #l'état n'est plus modifié que par son thread propriétaire
+    etatReseau.demarre()
     
     if socketServeur.creationReussie:
         print("addresse du serveur : ",socketServeur.getsockname() )
+        #jauges du serveur, qui n'existent que s'il a été créé
+        statistiques.jauge("connexions.entrantes",lambda: len(socketServeur.connections))
+        statistiques.jauge("connexions.sortantes",lambda: len(socketServeur.pool.connexions))
+        statistiques.jauge("relais.enAttente",lambda: sum( f.file.qsize() for f in list(socketServeur.files.values()) ))
+        statistiques.jauge("flux.actifs",lambda: socketServeur.multiplex.actifs())
     else:
         print("création du socket serveur impossible")
         print("avez vous allumé votre adaptateur bluetooth?")
@@ -313,57 +928,129 @@ def bouclePrincipale():
             extSocket , address = socketServeur.accept()
         except OSError:
             return
-        #ajoute la connection à la liste actuelle
-        socketServer.connections.append( [ address , extSocket ] )
+        #ajoute la connection à la liste actuelle (retirée à la fin de sa lecture)
+        connexion = [ address , extSocket ]
+        socketServeur.connections.append( connexion )
+        #sert aussi à répondre au pair (voir connexions.py)
+        socketServeur.pool.adopte(address,extSocket)
         #démarre un thread de discussion
-        dat = threading.Thread(target = socketServeur.serveurDataThread,args = [extSocket])
+        dat = threading.Thread(target = socketServeur.sertConnexion,args = [connexion])
         dat.daemon = True
         dat.start()
 
+def bouclePrincipaleAsync():
+    """
+        même rôle que bouclePrincipale, avec une boucle asyncio
+        (voir SocketServeur.serveurAsync)
+    """
+    import asyncio
+    #boucle à sélecteur : add_reader n'existe pas sur la boucle windows par défaut
+    loop = asyncio.SelectorEventLoop()
+    try:
+        loop.run_until_complete( socketServeur.serveurAsync() )
+    finally:
+        loop.close()
+
+def afficheErreur(futur):
+    """
+        affiche l'erreur d'un traitement terminé, s'il y en a une
+    """
+    if not futur.cancelled() and futur.exception() is not None:
+        print("erreur de traitement :",repr(futur.exception()))
+
+def sondePeripherique(p):
+    """
+        teste si un périphérique est vraiment contactable
+        (connexion au canal CANAL_SONDE), et donne son nom
+        
+        :return: tuple ( contactable , nom )
+    """
+    with statistiques.chronometre(statStandardSonde):
+        sock = transport.socket( transport.RFCOMM )
+        try:
+            sock.settimeout(DELAI_SONDE)
+            sock.connect( (p , CANAL_SONDE) )
+        except OSError:
+            return False , None
+        finally:
+            sock.close()
+    with statistiques.chronometre(statStandardNom):
+        return True , nomPeripherique(p,DELAI_SONDE)
+
+def nomPeripherique(p,delai=10):
+    """
+        donne le nom d'un périphérique, depuis le cache des noms
+        ou en le demandant au périphérique
+        
+        :return: le nom, ou None s'il n'a pas pu être résolu
+    """
+    return cacheNoms.nom( p , lambda a: transport.lookup_name(a,delai) )
+
+def nomConnu(p):
+    """
+        donne le nom d'un périphérique s'il est dans le cache des noms,
+        sans jamais le demander au périphérique
+        
+        :return: le nom, ou None s'il n'est pas connu
+    """
+    entree = cacheNoms.cherche(p)
+    return None if entree is None else entree[0]
+
+def sondePeripheriques(pairs):
+    """
+        sonde les périphériques en parallèle (au plus MAX_SONDES à la fois)
+        
+        donne les périphériques contactables, sous forme de tuples
+        ( adresse , nom ), au fur et à mesure que les sondes se terminent
+    """
+    if not pairs:
+        return
+    with concurrent.futures.ThreadPoolExecutor( min(MAX_SONDES,len(pairs)) ) as executeur:
+        futurs = { executeur.submit(sondePeripherique,p) : p for p in pairs }
+        for futur in concurrent.futures.as_completed(futurs):
+            p = futurs[futur]
+            try:
+                contactable , nom = futur.result()
+            except OSError:
+                contactable , nom = False , None
+            if not contactable:
+                print("os error on:",p)
+                continue
+            print("success on:",nom,p)
+            yield p , nom
+
 def rechercheStandard():
     """
         Effectue une recherche rapide (sans contacter
         les autres périphériques)
+        
+        Les périphériques sont sondés en parallèle, et ajoutés
+        au mappage dès que leur sonde réussit
+        
+        Le mappage est à jour au retour de la recherche
     """
-    #variable interne
-    global enCours_rechercheStandard
-    enCours_rechercheStandard = True
-    majCouleurs()
+    debut = statistiques.horloge()
     #effectue une recherche
-    pairs = bluetooth.discover_devices()
+    with statistiques.chronometre(statStandardInquiry):
+        pairs = transport.discover_devices()
     #recherche les périphériques vraiment contactables
-    i = 0
-    while i<len(pairs):
-        p = pairs[i]
-        sock = bluetooth.BluetoothSocket( bluetooth.RFCOMM )
-        try:
-            sock.connect( (p , 19) )
-        except OSError:
-            print("os error on:",bluetooth.lookup_name(p),p)
-            pairs.remove(p)
-            i -= 1
-        else:
-            print("success on:",bluetooth.lookup_name(p),p)
-        finally:
-            sock.close()
-        i += 1
-    #associe les noms
     periph = []
-    for i in pairs:
-        periph.append( (i,bluetooth.lookup_name(i)) )
-    #met à jour la liste
-    global peripheriquesAdjacents
-    peripheriquesAdjacents  = pairs[:]
-    #met à jour le mappage
-    mappageDepuisListes()
-    #màj variable interne
-    enCours_rechercheStandard = False
-    majCouleurs()
+    noms = {}
+    for p , nom in sondePeripheriques(pairs):
+        periph.append( (p,nom) )
+        noms[p] = nom
+        #ajoute tout de suite le périphérique au mappage
+        etatReseau.envoie(ajouteAdjacent,p,nom)
+    #met à jour la liste et le mappage
+    etatReseau.envoie(mappageDepuisListes,noms,[ p for p,nom in periph ])
+    cacheNoms.sauve()
+    etatReseau.synchronise()
+    statStandardDuree.depuis(debut)
     #retourne la liste nommée
     print("recherche std:",periph)
     return periph
 
-def decouverteReseau(periph=[]):
+def decouverteReseau(origine="",ident=None):
     """
         Permet d'accéder à tous les périphériques à proximité qui
         possèdent le service de réseau actif, et leurs demander
@@ -377,148 +1064,179 @@ def decouverteReseau(periph=[]):
               affecte à chaque periphérique actif une liste
               d'autres périphériques qu'il peut atteindre
         
-        Cette recherche peut prendre du temps
+        La demande est inondée : chaque routeur la transmet à ses
+        voisins dès qu'il les connait, en parallèle, puis effectue sa
+        recherche locale. Elle porte un identifiant unique, et un
+        routeur qui la reçoit à nouveau par un autre chemin l'ignore
+        (voir requetes.IdentifiantsVus) : chaque lien n'est parcouru
+        qu'une fois dans chaque sens au plus, et la découverte atteint
+        tout le réseau en un temps proportionnel à son diamètre
         
-        :param periph: liste des périphériques déjà découverts
-                       sous forme d'un tuple ( adresse MAC , port RFCOMM )
+        :param origine: adresse MAC du routeur qui a transmis la
+                        demande, qui n'est pas interrogé à nouveau
+                        ("" : découverte lancée ici)
+        :param ident: identifiant de la découverte (None : nouvelle découverte)
         
-        :return: None
+        :return: tuple ( nombre de demandes transmises , nombre de voisins à informer )
     """
-    #variable interne
-    global enCours_decouverteReseau
-    enCours_decouverteReseau = True
-    majCouleurs()
+    if ident is None:
+        ident = nouvelIdentifiant()
+        decouvertesVues.nouveau(ident)
+    debut = statistiques.horloge()
     #recherche les périphériques à proximité qui ont ce programme
     print("trouve le service")
-    liste = bluetooth.find_service("Paquet",UUID_Serveur)
+    with statistiques.chronometre(statDecouverteSdp):
+        liste = transport.find_service("Paquet",UUID_Serveur)
     print("trouvé : ",liste)
+    for i in liste:
+        portsServeur[ i["host"] ] = i["port"]
     liste = [ i["host"] for i in liste ]
     #affecte à la liste locale
-    global peripheriquesContactables
-    peripheriquesContactables = liste[:]
-    #ajoute l'adresse actuelle à la liste
-    periph.append( socketServeur.getsockname() )
-    #supprime les éléments déjà inspectés
-    for item in liste:
-        if item[0] in periph:
-            liste.remove(item)
-    #crée l'argument du paquet de recherche
-    arg = ",".join( [ item[0] + "/" + str(item[1]) for item in liste ] )
+    etatReseau.envoie(changeContactables,liste[:])
+    #ni l'envoyeur, ni ce routeur ne sont informés
+    exclus = { origine , socketServeur.getsockname()[0] }
+    aInformer = [ add for add in dict.fromkeys(liste) if not add in exclus ]
     #demande aux periphériques d'effectuer leur recherche
-    for add in liste:
-        socketServeur.envoiePaquet( add , "decouverte," + arg )
+    envoyes = envoieATous( aInformer , "decouverte," + ident )
+    statDecouvertes.ajoute(envoyes)
     #effectue une recherche locale
     local = rechercheStandard()
-    #affecte à la liste locale
-    global peripheriquesAdjacents
-    peripheriquesAdjacents = liste
-    #variables d'état
-    enCours_decouverteReseau = False
-    majCouleurs()
+    statDecouverteDuree.depuis(debut)
+    return envoyes , len(aInformer)
+
+def envoieATous(adresses,paquet):
+    """
+        envoie un paquet à plusieurs périphériques en parallèle
+        (au plus MAX_ENVOIS à la fois), chaque envoi pouvant
+        attendre une connexion
+        
+        :return: nombre d'envois réussis
+    """
+    if not adresses:
+        return 0
+    def envoie(add):
+        try:
+            socketServeur.envoiePaquet(add,paquet)
+            return True
+        except OSError:
+            print("envoi impossible à",add)
+            return False
+    with concurrent.futures.ThreadPoolExecutor( min(MAX_ENVOIS,len(adresses)) ) as executeur:
+        return sum( executeur.map(envoie,adresses) )
 
-def mappageDepuisListes():
+def changeContactables(liste):
+    """
+        remplace la liste des périphériques contactables
+        (commande de etatReseau)
+    """
+    global peripheriquesContactables
+    peripheriquesContactables = liste
+
+def mappageDepuisListes(noms={},adjacents=None):
     """
         Met à jour le mappage, à partir des liste de connections disponibles
+        (commande de etatReseau)
+        
+        :param noms: noms déjà résolus des périphériques adjacents ; les
+                     autres ne sont cherchés que dans le cache des noms (la
+                     commande ne doit pas attendre un périphérique), et leur
+                     nom actuel est gardé s'ils n'y sont pas
+        :param adjacents: nouvelle liste des périphériques adjacents
+                          (None : garde la liste actuelle)
     """
+    global peripheriquesAdjacents
+    if adjacents is not None:
+        peripheriquesAdjacents = adjacents
+    contactables = set(peripheriquesContactables)
     for p in peripheriquesAdjacents:
-        #crée un nouvel élément
-        item = { "nom": bluetooth.lookup_name(p) ,
-                 "direct": True ,
-                 "avance": p in peripheriquesContactables,
-                 "liens": [] }
-        #modifie si déjà ds le mappage actuel
-        if p in mappageReseau.keys():
-            item["liens"] = mappageReseau[p]["liens"]
-        #ajout au mappage
-        mappageReseau[p] = item
+        nom = noms[p] if p in noms else nomConnu(p)
+        #crée ou met à jour l'élément, en gardant ses liens
+        mappageReseau.ajouteNoeud(p, nom = nom,
+                                     direct = True,
+                                     avance = p in contactables)
     #représentationdu point de départ
     add = socketServeur.getsockname()[0]
-    mappageReseau[add] = {"nom": "origine",
-                          "direct": True,
-                          "avance": True,
-                          "liens": peripheriquesAdjacents[:]}
-    #réaffiche la liste
-    majListe()
+    mappageReseau.ajouteNoeud(add,"origine",True,True)
+    mappageReseau.remplaceLiens(add,peripheriquesAdjacents)
+
+def ajouteAdjacent(p,nom):
+    """
+        ajoute un périphérique adjacent au mappage, relié
+        au point de départ, sans toucher aux autres
+        (commande de etatReseau)
+    """
+    add = socketServeur.getsockname()[0]
+    mappageReseau.ajouteNoeud(p, nom = nom,
+                                 direct = True,
+                                 avance = p in peripheriquesContactables)
+    mappageReseau.ajouteNoeud(add,"origine",True,True)
+    mappageReseau.ajouteLien(add,p)
 
 def mappageServiceDepuisListe(liste):
     """
         ajoute les services adjacents trouvés à partir
         d'une recherche de service à la liste
+        (commande de etatReseau)
     """
-    for item in liste:
-        add = item["host"]
-        nom = item["name"]
-        profiles = item["profiles"]
-        sid = item["service-id"]            #inutile : toujours null
-        classes = item["service-classes"]
-        protocol = item["protocol"]
-        port = item["port"]
-        raw = item["rawrecord"]
-        #extrait l'uuid
-        uuid = str(binascii.hexlify( raw.split(b'\t')[3] ))[2:-1]
-        uuid = str(uuid[:8]+'-'+uuid[8:12]+'-'+uuid[12:16]+'-'+uuid[16:20]+'-'+uuid[20:32])
-        #converti en str les profiles
-        profiles = [ (str(i[0])[2:-1],i[1]) for i in profiles ]
-        #converti en str les classes
-        classes = [ str(i)[2:-1] for i in classes ]
-        #converti en str le nom
-        if nom: nom = str(nom)[2:-1]
-        else:nom = "None"
-        #récupère l'élement du mappage
-        if add in mappageService:
-            periph = mappageService[add]
-        else:
-            periph = []
-            mappageService[add] = periph
+    for add,service in mappageService.ajoute(liste):
+        print("service",service["name"],"de",add,"uuid:",service["service-id"])
+
+def rafraichitServices(hotes,resultats):
+    """
+        range les services des hôtes interrogés, et oublie les hôtes
+        expirés qui ne sont plus à proximité (commande de etatReseau)
         
-        #ajoute le service à la liste
-        if not (protocol,port) in [ (i["protocol"],i["port"]) for i in periph]:
-            periph.append( {"protocol"       : protocol,
-                            "name"           : nom,
-                            "profiles"       : profiles,
-                            "service-id"     : uuid,
-                            "service-classes": classes,
-                            "port"           : port} )
-            print("proto ",item["name"],"has uuid:",sid)
-            print("service id:",item["profiles"]," classes",item["service-classes"])
-
-def mappageDepuisStr(str,origine):
+        :param hotes: hôtes à proximité
+        :param resultats: couples ( hôte , services trouvés ),
+                          voir RegistreServices.interroge
+        :return: liste des services nouveaux, sous forme (hôte, service)
+    """
+    mappageService.oublieAbsents(hotes)
+    nouveaux = []
+    for add,liste in resultats:
+        nouveaux.extend( mappageService.remplace(add,liste) )
+    return nouveaux
+
+def mappageDepuisStr(chaine,origine,complet=False):
     """
         ajoute des périphériques au réseau à partir d'une chaine de
         caractère. Prend comme point de réduction de ces périphériques
         l'adresse "origine"
+        
+        :param complet: la chaine vient d'une réponse complète : ses liens
+                        remplacent ceux connus (les liens retirés depuis
+                        ne sont pas listés dans une telle réponse)
     """
     #sépare les infos
-    infos = str.split(",")
+    infos = chaine.split(",")
     add = infos[0]
     nom = infos[1]
-    direct = bool( infos[2] )
-    avance = bool( infos[3] )
+    direct = infos[2] == "1"
+    avance = infos[3] == "1"
     liens = infos[4][1:-1]
-    #trouve l'élément d'origine
-    if origine in mappageReseau.keys():
-        oItem = mappageReseau[add]
-    else:
-        oItem = {}
-    if direct:
-        if not add in oItem["liens"]:
-            oItem["liens"].append(add)
-    #trouve l'élément spécifié
-    if add in mappageReseau.keys():
-        item = mappageReseau[add]
-    else:
-        item = {"liens":[]}
+    #relie l'élément d'origine
+    if direct and add != origine:
+        mappageReseau.ajouteLien(origine,add)
+    #les infos d'ici ne sont connues que d'ici
+    if add == socketServeur.getsockname()[0]:
+        return
+    #"origine" se décrit lui même sous le nom "origine" : garde le nom connu
+    if add == origine:
+        nom = None
     #mise à jour des infos
-    item["nom"] = nom
-    item["direct"] = add in peripheriquesAdjacents
-    item["avance"] = avance
-    for l in liens:
-        if not l in item["liens"]:
-            item["liens"].append(l)
-    #réaffiche la liste
-    majListe()
+    mappageReseau.ajouteNoeud(add, nom = nom,
+                                   direct = add in peripheriquesAdjacents,
+                                   avance = avance)
+    if complet:
+        mappageReseau.remplaceLiens(add, liens.split(".") if liens else [])
+    elif liens:
+        for l in liens.split("."):
+            mappageReseau.ajouteLien(add,l)
+    #les routes et la liste sont mises à jour une fois par lot de
+    #commandes (voir apresModifications) : un noeud aux nombreux
+    #liens, modifié par chaque élément, serait sinon relâché à chaque fois
 
-def rechercheReseau(origine="",periph=[]):
+def rechercheReseau(origine="",periph=None,delai=DELAI_RECHERCHE,idRequete=None,connu=("",0)):
     """
         Permet d'accéder à tous les périphériques à proximité qui
         possèdent le service de réseau actif, et leurs demander
@@ -531,84 +1249,242 @@ def rechercheReseau(origine="",periph=[]):
               affecte à chaque periphérique actif une liste
               d'autres périphériques qu'il peut atteindre
         
-        Cette recherche peut prendre du temps
+        Chaque périphérique interrogé reçoit une requête (voir requetes.py),
+        et la recherche se termine dès la dernière réponse, ou au bout de
+        "delai" secondes avec les réponses déjà reçues
         
-        :param periph: liste des périphériques déjà découverts
+        :param origine: adresse MAC du routeur qui a demandé la recherche,
+                        à qui la réponse est envoyée ("" : recherche locale)
+        :param periph: liste des périphériques déjà inspectés
                        sous forme d'adresse MAC
-        :param time: temps maximum de la recherche
+        :param delai: temps maximum de la recherche (s)
+        :param idRequete: identifiant de la requête de "origine"
+        :param connu: tuple ( époque , version ) du mappage d'ici déjà
+                      connu par "origine" : seuls les changements
+                      depuis cette version lui sont envoyés
         
-        :return: None
+        :return: tuple ( nombre de réponses , nombre de périphériques interrogés )
     """
-    #variable interne
-    global enCours_rechercheReseau
-    enCours_rechercheReseau = True
-    majCouleurs()
-    #cherche tous les services à proximité
+    fin = time.monotonic()+delai
+    debut = statistiques.horloge()
+    #cherche les services des périphériques à proximité
+    #(seuls les périphériques nouveaux ou expirés sont interrogés)
     print("trouve les service")
-    services = bluetooth.find_service()
+    with statistiques.chronometre(statRechercheInquiry):
+        hotes = transport.discover_devices()
+    with statistiques.chronometre(statRechercheSdp):
+        #seules les interrogations, qui attendent les périphériques, sont faites ici
+        resultats = mappageService.interroge(hotes,transport.find_service)
+    for add,service in etatReseau.execute(rafraichitServices,hotes,resultats):
+        print("service",service["name"],"de",add,"uuid:",service["service-id"])
     #recherche les périphériques à proximité qui ont ce programme
     liste = []
-    for item in services:
-        if item["service-id"] == UUID_Serveur:
-            liste.append( item["host"] )
+    for add,port in mappageService.hotesAvecService(UUID_Serveur,hotes):
+        liste.append(add)
+        portsServeur[add] = port
     print("trouvé : ",liste)
     #affecte à la liste locale
-    global peripheriquesContactables
-    peripheriquesContactables = liste
-    mappageServiceDepuisListe(services)
-    #ajoute l'adresse actuelle à la liste
-    periph.append( socketServeur.getsockname() )
+    etatReseau.envoie(changeContactables,liste)
+    #périphériques déjà inspectés, dont l'adresse actuelle
+    inspectes = set(periph or ())
+    inspectes.add( socketServeur.getsockname()[0] )
     #supprime les éléments déjà inspectés
-    for item in liste:
-        if item[0] in periph:
-            liste.remove(item)
-    #crée l'argument du paquet de recherche
-    arg = ",".join( [ item[0] + "/" + str(item[1]) for item in liste ] )
+    aInterroger = [ add for add in liste if not add in inspectes ]
+    #crée l'argument du paquet de recherche : les périphériques
+    #interrogés ici ne le sont pas à nouveau par les suivants
+    inspectes.update(aInterroger)
+    arg = ",".join(inspectes)
     #demande aux periphériques d'effectuer leur recherche
-    global rechercheLancees
-    rechercheLancee = 0
-    for add in liste:
-        socketServeur.envoiePaquet( add , "recherche," + arg )
-        rechercheLancees += 1
+    requetes = []
+    for add in aInterroger:
+        #délai laissé au périphérique pour répondre à temps
+        reste = fin-time.monotonic()-MARGE_RECHERCHE
+        if reste <= 0:
+            break
+        ident , futur = requetesRecherche.cree(add)
+        #version de son mappage déjà reçue
+        epoque , version = versionsPairs.get(add,("",0))
+        try:
+            socketServeur.envoiePaquet( add , "recherche,%d,%.3f,%s,%d,%s" % (ident,reste,epoque,version,arg) )
+        except OSError:
+            print("recherche impossible sur",add)
+            requetesRecherche.abandonne(ident)
+            continue
+        requetes.append( (ident,futur) )
+    statRequetes.ajoute(len(requetes))
     #effectue une recherche locale
     local = rechercheStandard() #mappage màj en mm temps
-    #attends les réponses
+    #attends les réponses (le mappage est mis à jour à leur arrivée)
     print("attends retour...")
-    while rechercheLancees > 0:
-        time.sleep(0.1)
+    with statistiques.chronometre(statRechercheAttente):
+        reponses = requetesRecherche.attend(requetes,fin)
+    statReponses.ajoute(len(reponses))
+    if len(reponses) < len(requetes):
+        print("recherche incomplète :",len(requetes)-len(reponses),"périphérique(s) sans réponse")
     #retourne à l'envoyeur
     if origine != "":
-        #crée une chaine de réponse
-        argAdj = ";".join( [ strDepuisMappage(a) for a in mappageReseau.keys() ] )
+        #crée une chaine de réponse (changements depuis la version connue)
+        argAdj = reponseDepuisMappage(*connu)
         #envoie cette réponse
-        socketServeur.envoiePaquet(origine,"reponse," + arg )
-    #màj variable interne
-    enCours_rechercheReseau = False
-    majCouleurs()
+        try:
+            socketServeur.envoiePaquet(origine,"reponse,%d,%s" % (idRequete,argAdj) )
+        except OSError:
+            print("réponse impossible à",origine)
+    statRechercheDuree.depuis(debut)
+    return len(reponses) , len(requetes)
 
-def strDepuisMappage(address):
+def strDepuisMappage(address,carte=None):
     """
         donne la représentation sous forme de chaine de caractère
         d'un objet du mappage
+        
+        :param carte: mappage à lire (par défaut, voir lisMappage)
     """
-    item = mappageReseau[address]
+    if carte is None:
+        carte = lisMappage()
+    item = carte.noeud(address)
     #infos de base
-    str = address+","+item["nom"]+","+str(int(item["direct"]))+","+str(int(item["avance"]))
+    chaine = address+","+item.nom+","+str(int(item.direct))+","+str(int(item.avance))
     #liens
-    str += ",[" + ".".join( item["liens"] ) + "]"
+    chaine += ",[" + ".".join( carte.liens(address) ) + "]"
     
-    return str
+    return chaine
 
-def reponseRecherche(origine,items):
+def reponseDepuisMappage(epoque,depuis):
+    """
+        crée la réponse à une recherche : les noeuds ajoutés ou modifiés
+        et les liens retirés depuis la version "depuis" du mappage,
+        ou tout le mappage si cette version est trop ancienne
+        (ou d'une autre époque)
+        
+        :return: chaine "<époque>,<version>,<complet>,<éléments séparés par ;>",
+                 un lien retiré étant noté "-<départ>,<arrivée>"
+    """
+    #instantané : les changements faits pendant la création de la
+    #réponse seront envoyés la prochaine fois
+    carte = lisMappage()
+    version = carte.version
+    changements = None
+    if epoque == carte.epoque:
+        changements = carte.changements(depuis)
+    if changements is None:
+        adresses , retraits , complet = list(carte) , [] , 1
+    else:
+        adresses , retraits = changements
+        complet = 0
+    items = [ strDepuisMappage(a,carte) for a in adresses ]
+    items += [ "-" + d + "," + a for d,a in retraits ]
+    return "%s,%d,%d,%s" % (carte.epoque,version,complet,";".join(items))
+
+def lisMappage():
+    """
+        donne le mappage à lire : "mappageReseau" lui même dans le
+        thread propriétaire de l'état (ou si la file n'est pas
+        démarrée), sinon un instantané, qui ne change plus
+        (voir Topologie.instantane)
+    """
+    if etatReseau.proprietaire():
+        return mappageReseau
+    return etatReseau.execute(lambda: mappageReseau.instantane())
+
+def reponseRecherche(origine,ident,items,epoque="",version=0,complet=True):
     """
         traite les informations relatives à un retour de recherche
+        (commande de etatReseau)
+        
+        :param origine: adresse MAC du routeur qui répond
+        :param ident: identifiant de la requête
+        :param epoque,version: version du mappage de "origine" décrite
+        :param complet: la réponse décrit-elle tout son mappage,
+                        ou seulement les changements
+    """
+    #ajout des items au mappage (même pour une réponse tardive)
+    retraits = []
+    appliqueElements(items,origine,retraits,complet)
+    termineReponse(origine,ident,len(items),retraits,epoque,version,complet)
+
+def appliqueElements(items,origine,retraits,complet=False):
+    """
+        applique au mappage des éléments d'une réponse de recherche
+        (commande de etatReseau, voir appliqueElement)
     """
-    #réponse à une recherche
-    global rechercheLancees
-    rechercheLancees -= 1
-    #ajout des items au mappage
-    for i in items:
-        mappageDepuisStr(i,origine)
+    for item in items:
+        appliqueElement(item,origine,retraits,complet)
+
+def appliqueElement(item,origine,retraits,complet=False):
+    """
+        applique au mappage un élément d'une réponse de recherche
+        
+        :param retraits: reçoit les liens retirés, appliqués à la
+                         fin de la réponse (voir termineReponse)
+        :param complet: l'élément vient d'une réponse complète
+                        (voir mappageDepuisStr)
+    """
+    if item.startswith("-"):
+        retraits.append( item[1:].split(",") )
+    else:
+        mappageDepuisStr(item,origine,complet)
+
+def termineReponse(origine,ident,nombre,retraits,epoque,version,complet):
+    """
+        termine le traitement d'une réponse de recherche, dont les
+        "nombre" éléments ont été appliqués (voir reponseRecherche)
+        (commande de etatReseau)
+    """
+    #liens retirés (les liens d'ici ne sont connus que d'ici)
+    ici = socketServeur.getsockname()[0]
+    for depart,arrivee in retraits:
+        if depart != ici:
+            mappageReseau.retireLien(depart,arrivee)
+    #retient la version reçue, pour ne demander ensuite que les changements
+    precedente = versionsPairs.get(origine)
+    if precedente is None or precedente[0] != epoque or precedente[1] < version:
+        versionsPairs[origine] = ( epoque , version )
+    print("réponse de",origine,":",nombre,"éléments",
+          "(complète)" if complet else "(changements)")
+    #réponse à une recherche : réveille la recherche en attente
+    if not requetesRecherche.termine(ident,origine,nombre):
+        print("réponse tardive ou inconnue de",origine)
+
+def lisReponse(origine):
+    """
+        générateur qui applique une réponse de recherche au fur et
+        à mesure de sa réception (voir SocketServeur.recoitMorceau)
+        
+        Chaque morceau du paquet envoyé (send) est découpé en éléments
+        (voir trame.decoupeEnregistrements), envoyés aussitôt au
+        mappage en une commande (voir etatReseau) ; None termine
+        la réponse. Seuls les éléments d'un morceau sont gardés :
+        la réponse n'est jamais copiée en entier
+        
+        :param origine: adresse MAC du routeur qui répond
+    """
+    #en-tête : reponse,<identifiant>,<époque>,<version>,<complet>,
+    entete = b""
+    while entete.count(b",") < 5:
+        morceau = yield
+        if morceau is None:
+            raise ValueError("réponse tronquée")
+        entete += bytes(morceau)
+    _ , ident , epoque , version , complet , morceau = entete.split(b",",5)
+    ident , version = int(ident) , int(version)
+    epoque = str(epoque,encoding="utf-8")
+    complet = complet == b"1"
+    #éléments, séparés par ;
+    decoupe = decoupeEnregistrements(b";")
+    next(decoupe)
+    retraits = []
+    nombre = 0
+    while True:
+        elements = [ str(e,encoding="utf-8") for e in decoupe.send(morceau) ]
+        if elements:
+            #"retraits" n'est rempli que par le thread propriétaire
+            etatReseau.envoie(appliqueElements,elements,origine,retraits,complet)
+            nombre += len(elements)
+        if morceau is None:
+            break
+        morceau = yield
+    etatReseau.envoie(termineReponse,origine,ident,nombre,retraits,epoque,version,complet)
 
 def extraitAddresses(carte):
     """
@@ -623,11 +1499,20 @@ def extraitAddresses(carte):
                             "<add6>" : {},
                             "<add7>" : {}}}
           donne: ["<add1>","<add2>", ... ,"<add7>"]
+        
+        Pour une carte de "mappageReseau", parcoursReseau donne
+        directement ces adresses (Parcours.adresses)
     """
+    #parcours en profondeur sans récursion
     listeAdd = []
-    for k in carte.keys():
-        listeAdd.append(k)
-        listeAdd.extend( extraitAddresses(carte[k]) )
+    pile = [ iter(carte.items()) ]
+    while pile:
+        for k,sousCarte in pile[-1]:
+            listeAdd.append(k)
+            pile.append( iter(sousCarte.items()) )
+            break
+        else:
+            pile.pop()
     return listeAdd
 
 def extraitNiveau(carte,add):
@@ -647,15 +1532,21 @@ def extraitNiveau(carte,add):
                  "<add3>" -> 2
                  
                  etc...
+        
+        Pour une carte de "mappageReseau", parcoursReseau donne
+        directement ces niveaux (Parcours.niveaux)
     """
-    #si add de niveau 1
-    if add in carte.keys():
-        return 1
-    #sinon, récursion
-    else:
-        for p in carte.keys():
-            if add in extraitAddresses(carte[p]):
-                return extraitNiveau( carte[p] , add )+1
+    #parcours en largeur de la carte
+    niveau = 1
+    courants = [carte]
+    while courants:
+        suivants = []
+        for c in courants:
+            if add in c:
+                return niveau
+            suivants.extend( c.values() )
+        courants = suivants
+        niveau += 1
 
 def carteSimplifiee(depart=None,interdits=[]):
     """
@@ -677,44 +1568,89 @@ def carteSimplifiee(depart=None,interdits=[]):
                "<add4>" : { "<add5>" : {},
                             "<add6>" : {},
                             "<add7>" : {}}}
+        
+        La carte est obtenue par un seul parcours en largeur
+        (voir Topologie.parcours), gardé en cache jusqu'à la
+        prochaine modification du mappage : elle est partagée,
+        et ne doit pas être modifiée
+    """
+    return parcoursReseau(depart,interdits).carte
+
+def parcoursReseau(depart=None,interdits=[],carte=None):
+    """
+        donne le parcours complet de "mappageReseau" depuis le
+        point de départ : carte, niveau de chaque adresse
+        et liste des adresses
+        
+        :param carte: mappage à parcourir (par défaut, voir lisMappage)
     """
     #récupère l'adresse du serveur actuel
-    add = socketServeur.getsockname()[0]
     if not depart:
-        depart = add
-    #copie les interdits, pour ne pas les modifier
-    interdits2 = interdits[:]
-    interdits2.append( depart )
-    interdits2 = list(set(interdits2))
-    #récupère les liens actuels
-    liens = mappageReseau[depart]["liens"]
-    #crée le dictionnaire à retourner
-    connexions = {}
-    #parcoure le mappage réseau
-    for l in liens:
-        if not l in interdits2[:]:
-            if mappageReseau[l]["avance"]:
-                #actualise les interdits pour cette recherche
-                interditsActuels = interdits2[:]
-                liensMod = liens[:]
-                liensMod.remove(l)
-                interditsActuels.extend(liensMod)
-                interditsActuels = list(set(interditsActuels))
-                #démarre une nouvelle recherche à partir de l
-                carteL = carteSimplifiee(l,interditsActuels)
-                #ajout au dictionnaire
-                connexions[l] = carteL
-                #ajout des adresses parcourues aux interdits
-                interdits2.extend( extraitAddresses(carteL) )
-                interdits2 = list(set(interdits2))
-            else:
-                connexions[l] = {}
-                interdits2.append(l)
-    #retourne la carte
-    return connexions
+        depart = socketServeur.getsockname()[0]
+    if carte is None:
+        carte = lisMappage()
+    return carte.parcours(depart,interdits)
+
+def demarreTunnel(add,item):
+    """
+        démarre la retransmission d'un service, dans son thread
+        
+        :param item: service de "add" (voir services.py)
+        :return: le tunnel (SocketTunnel)
+    """
+    #socket de retransmission
+    retrans = SocketTunnel(add,item)
+    #démarre le thread
+    t = threading.Thread(target = retrans.begin)
+    t.daemon = True
+    t.start()
+    return retrans
+
+def routeurSansInterface(periode=0,services=()):
+    """
+        fait tourner le routeur sans interface graphique, jusqu'à
+        un Ctrl-C : le serveur répond aux découvertes et recherches
+        des autres routeurs, et achemine les paquets relayés
+        
+        :param periode: période des recherches réseau lancées d'ici (s),
+                        0 pour n'en lancer aucune
+        :param services: services à retransmettre, sous forme de tuples
+                         ( adresse , numéro du service de l'adresse ) ;
+                         une recherche est lancée au démarrage pour les trouver
+    """
+    tunnels = {}
+    arret = threading.Event()
+    try:
+        while True:
+            if periode or (services and not tunnels):
+                rechercheReseau()
+            for add,num in services:
+                if (add,num) in tunnels:
+                    continue
+                liste = mappageService.services(add)
+                if num < len(liste):
+                    print("retransmission de",add,":",liste[num]["name"])
+                    tunnels[(add,num)] = demarreTunnel(add,liste[num])
+                else:
+                    print("service",num,"de",add,"introuvable")
+            if arret.wait(periode or None):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for tunnel in tunnels.values():
+            tunnel.close()
 
 ## Interface graphique
 
+def importeInterface():
+    """
+        importe tkinter, seulement quand l'interface graphique est demandée
+    """
+    global Tk,Toplevel,Canvas,Button,Label,Listbox,Checkbutton,IntVar,W,E,END,ttk
+    from tkinter import Tk,Toplevel,Canvas,Button,Label,Listbox,Checkbutton,IntVar,W,E,END
+    import tkinter.ttk as ttk
+
 #variables d'état : action en cours
 enCours_decouverteReseau = False
 enCours_rechercheStandard = False
@@ -735,95 +1671,95 @@ liste_peripheriques = None
 #addresse d'origine de la retransmission
 addresseSelectionnee = None
 
-def afficheReseau():
+#dernier instantané du mappage publié pour l'interface (voir apresModifications)
+carteAffichee = None
+#liste des périphériques : lignes affichées (adresse -> (nom,type)),
+#et version du mappage affichée
+lignesListe = {}
+versionListe = None
+#activités en cours montrées par les couleurs des boutons
+couleursAffichees = None
+#période de mise à jour de l'interface (ms)
+DELAI_MAJ_LISTE = 16
+
+def apresModifications():
     """
-        affiche une carte du réseau
+        appelée par le thread propriétaire après chaque lot de
+        commandes (voir commandes.py) : met à jour les routes une
+        seule fois pour tout le lot, et publie un instantané du
+        mappage pour l'interface
     """
-    #paramètres du dessin de la carte
-    rayonCarte = 220
-    tailleFenetre = 500
-    #récupère la carte simplifiée
-    carte = carteSimplifiee()
-    #crée les listes
-    noeuds = {}
+    global carteAffichee
+    with statistiques.chronometre(statEtatRoutes):
+        tableRoutage.maj()
+    if interfaceInitialise:
+        carteAffichee = mappageReseau.instantane()
+
+etatReseau.apresLot = apresModifications
+
+def dispositionReseau(rayonCarte,carte=None):
+    """
+        calcule la disposition de la carte du réseau, sans la dessiner
+        
+        :param carte: mappage à dessiner (par défaut, voir lisMappage)
+        :return: tuple ( dictionnaire adresse -> (x,y) , liste des liens )
+    """
+    if carte is None:
+        carte = lisMappage()
+    #récupère la carte simplifiée, avec les niveaux
+    parcours = parcoursReseau(None,[],carte)
+    #crée la liste des liens
     liens = []
     #recupère les points
     points = { 0:[socketServeur.getsockname()[0]] }
-    maxdist = 0
-    for p in extraitAddresses(carte):
-        dist = extraitNiveau(carte,p)
+    for p in parcours.adresses:
+        dist = parcours.niveaux[p]
         if not dist in points.keys():
             points[dist] = []
-            if maxdist < dist:
-                maxdist = dist
         points[dist].append(p)
-    #place les noeuds
-    for d in points.keys():
-        nb = len( points[d] )
-        if nb%2 == 0: nb += 1 #ajout d'un pt si nombre impaire pour tracer
-        if maxdist != 0:
-            rayon = rayonCarte*d/maxdist
-        else:
-            rayon = 0
-            
-        #trouve la plus petite somme de distance de liens
-        #avec 8 valeurs de rotation ajoutée ( tt les PI/4 )
-        sommeMin = math.tan(math.pi/2)
-        offsetChoisi = 0
-        if d !=0:
-            for offset in range(8):
-                angleOffset = offset * math.pi/4
-                sommeDist = 0
-                for i in range(len( points[d] )):
-                    posX = rayon*math.cos( i *2*math.pi / nb + angleOffset + 0.19)
-                    posY = rayon*math.sin( i *2*math.pi / nb + angleOffset + 0.19)
-                    add = points[d][i]
-                    for l in mappageReseau[add]["liens"]:
-                        if l in noeuds.keys():
-                            dX = posX - noeuds[l][0]
-                            dY = posY - noeuds[l][1]
-                            sommeDist += dX**2 + dY**2
-                if sommeDist < sommeMin:
-                    sommeMin = sommeDist
-                    offsetChoisi = angleOffset
-        
-        #affecte les positions choisies aux noeuds
-        for i in range(len( points[d] )):
-            posX = rayon*math.cos( i *2*math.pi / nb + offsetChoisi + 0.19)
-            posY = rayon*math.sin( i *2*math.pi / nb + offsetChoisi + 0.19)
-            noeuds[points[d][i] ] = ( posX, posY )
-    #attribue les liens
+    #place les noeuds sur des anneaux
+    from disposition import dispositionAnneaux
+    noeuds = dispositionAnneaux(points,carte.liens,rayonCarte)
+    #attribue les liens, une seule fois par paire
+    dejaVus = set()
     for p in noeuds.keys():
-        px,py = noeuds[p]
-        for i in mappageReseau[p]["liens"]:
-            if (not (i,p) in liens) and (not (p,i) in liens):
-                liens.append((i,p))
+        for i in carte.liens(p):
+            if i in noeuds and not (p,i) in dejaVus:
+                dejaVus.add( (i,p) )
+                liens.append( (i,p) )
+    return noeuds , liens
+
+def afficheReseau():
+    """
+        affiche une carte du réseau, que l'on peut déplacer (glisser)
+        et zoomer (molette)
+        
+        Sur un grand réseau, les sous-arbres éloignés sont regroupés,
+        et ouverts par un double-clic (voir vuecarte.py)
+    """
+    from vuecarte import VueCarte
+    #paramètres du dessin de la carte
+    tailleFenetre = 500
     #crée la fenetre
     fen = Toplevel()
     fen.title("Carte du réseau")
-    canvas = Canvas(fen,width=tailleFenetre,height=tailleFenetre)
-    canvas.pack()
-    #ajoute les liens
-    for a,b in liens:
-        x1,y1 = noeuds[a]
-        x2,y2 = noeuds[b]
-        canvas.create_line(x1+tailleFenetre//2-60,y1+tailleFenetre//2,
-                           x2+tailleFenetre//2-60,y2+tailleFenetre//2,
-                           fill="black",width=3)
-    #ajoute les noeuds
-    for n in noeuds.keys():
-        x,y = noeuds[n]
-        x += tailleFenetre//2
-        y += tailleFenetre//2
-        color = "white"
-        if mappageReseau[n]["nom"] == "origine":
-            color = "blue"
-        elif mappageReseau[n]["avance"]:
-            color = "purple"
-        canvas.create_rectangle(x-70,y-10,x-50,y+10,fill = color)
-        canvas.create_text(x,y,text=n)
+    canvas = Canvas(fen,width=tailleFenetre,height=tailleFenetre,background="white")
+    canvas.pack(fill="both",expand=True)
+    #la vue garde l'instantané affiché : la carte ne change pas pendant qu'on la parcourt
+    VueCarte(canvas,carteAffichee,socketServeur.getsockname()[0])
     
 #fonctions de lancement de threads
+def lanceActivite(indicateur,fonction):
+    """
+        exécute une activité lancée depuis l'interface, puis baisse
+        son indicateur ("enCours_...") : les boutons ne suivent que ces
+        activités, pas celles demandées par les autres routeurs
+    """
+    try:
+        fonction()
+    finally:
+        globals()[indicateur] = False
+
 def startDecouverteReseau():
     """
         démarre un thread de découverte du réseau
@@ -832,7 +1768,7 @@ def startDecouverteReseau():
         global enCours_decouverteReseau
         if not enCours_decouverteReseau:
             enCours_decouverteReseau = True
-            t = threading.Thread( target = decouverteReseau )
+            t = threading.Thread( target = lanceActivite, args = ["enCours_decouverteReseau",decouverteReseau] )
             t.daemon = True
             t.start()
         majCouleurs()
@@ -845,7 +1781,7 @@ def startRechercheStandard():
         global enCours_rechercheStandard
         if not enCours_rechercheStandard:
             enCours_rechercheStandard = True
-            t = threading.Thread( target = rechercheStandard )
+            t = threading.Thread( target = lanceActivite, args = ["enCours_rechercheStandard",rechercheStandard] )
             t.daemon = True
             t.start()
         majCouleurs()
@@ -858,7 +1794,7 @@ def startRechercheReseau():
         global enCours_rechercheReseau
         if not enCours_rechercheReseau:
             enCours_rechercheReseau = True
-            t = threading.Thread( target = rechercheReseau )
+            t = threading.Thread( target = lanceActivite, args = ["enCours_rechercheReseau",rechercheReseau] )
             t.daemon = True
             t.start()
         majCouleurs()
@@ -873,7 +1809,7 @@ def pressListRetransmettre(listePeriph,listeServices):
     global addresseSelectionnee
     addresseSelectionnee = add
     #màj la liste des services
-    it = mappageService[add]
+    it = mappageService.services(add)
     listeServices.delete(0, listeServices.size() )
     for s in it:
         listeServices.insert(END,s["name"]+" : "+s["protocol"]+","+str(s["port"]) )
@@ -886,7 +1822,7 @@ def pressBtOkRetransmettre(listePeriph,listeServices):
     if len(listeServices.curselection()) < 1:
         return
     sel = int(listeServices.curselection()[0])
-    item = mappageService[addresseSelectionnee][sel]
+    item = mappageService.services(addresseSelectionnee)[sel]
     print("démarre une retransmission de:")
     print(addresseSelectionnee)
     print("service:")
@@ -899,7 +1835,7 @@ def startRetransmission(add,num):
         avec une petite fenêtre
     """
     #récupère le service
-    item = mappageService[add][num]
+    item = mappageService.services(add)[num]
     #fenetre
     fen = Toplevel()
     info = Label(fen,text="Retransmission...")
@@ -910,12 +1846,16 @@ def startRetransmission(add,num):
     info3.pack()
     info4 = Label(fen,text="protocole : "+item["protocol"]+" : "+str(item["port"]))
     info4.pack()
-    #socket de retransmission
-    retrans = SocketTunnel(add,item)
-    #démarre le thread
-    t = threading.Thread(target = retrans.begin)
-    t.daemon = True
-    t.start()
+    route = tableRoutage.route(add)
+    if route is None:
+        texteRoute = "route : inconnue"
+    elif route[1] == 1:
+        texteRoute = "route : direct"
+    else:
+        texteRoute = "route : par "+route[0]+" ("+str(route[1])+" sauts)"
+    info5 = Label(fen,text=texteRoute)
+    info5.pack()
+    demarreTunnel(add,item)
 
 def configRetransmettre():
     """
@@ -928,7 +1868,7 @@ def configRetransmettre():
     list2Txt = Label(fen,text="choix du service")
     #liste des peripheriques
     list = Listbox(fen,width=100)
-    for i in mappageService.keys():
+    for i in mappageService.hotes():
         list.insert(END,i)
     #liste des services
     list2 = Listbox(fen,width=100)
@@ -972,27 +1912,60 @@ def majCouleurs():
         else:
             bt_rechercheAv.configure(bg="SystemButtonFace")
 
-def majListe():
-    if interfaceInitialise:
-        global liste_peripheriques
-        #supprime tous les éléments
-        e = liste_peripheriques.get_children()
-        for i in e:
-            liste_peripheriques.delete(i)
-        #recrée tous les éléments
-        for k in mappageReseau.keys():
-            item = mappageReseau[k]
-            type = "normal"
-            if item["avance"]:
-                type = "avancé"
-                
-            if item["nom"] == "origine":
-                type = "départ"
-                
-            liste_peripheriques.insert('',"end",values=(k,item["nom"],type ),tags=(type))
-        liste_peripheriques.tag_configure('normal', background='white')
-        liste_peripheriques.tag_configure('avancé', background='purple')
-        liste_peripheriques.tag_configure('départ', background='blue')
+def surveilleInterface():
+    """
+        met à jour l'interface depuis le thread de tkinter, toutes
+        les DELAI_MAJ_LISTE ms : les couleurs des boutons si une
+        activité a commencé ou s'est terminée, la liste si un
+        nouvel instantané du mappage a été publié
+        (voir apresModifications)
+        
+        Les autres threads ne touchent jamais aux widgets : une
+        grande réponse, appliquée en plusieurs lots, n'est
+        réaffichée qu'une fois par période
+    """
+    global couleursAffichees
+    couleurs = (enCours_decouverteReseau,enCours_rechercheStandard,enCours_rechercheReseau)
+    if couleurs != couleursAffichees:
+        couleursAffichees = couleurs
+        majCouleurs()
+    appliqueMajListe()
+    liste_peripheriques.after(DELAI_MAJ_LISTE,surveilleInterface)
+
+def appliqueMajListe():
+    """
+        met à jour la liste des périphériques, en ne modifiant
+        que les lignes ajoutées, changées ou supprimées
+        
+        chaque ligne est repérée par l'adresse MAC du périphérique
+    """
+    global versionListe
+    carte = carteAffichee
+    #rien à faire si le mappage n'a pas changé
+    if carte is None or versionListe == (carte.epoque,carte.version):
+        return
+    versionListe = (carte.epoque,carte.version)
+    presents = set()
+    for k,item in carte.elements():
+        type = "normal"
+        if item.avance:
+            type = "avancé"
+            
+        if item.nom == "origine":
+            type = "départ"
+        
+        presents.add(k)
+        ligne = (item.nom,type)
+        ancienne = lignesListe.get(k)
+        if ancienne is None:
+            liste_peripheriques.insert('',"end",iid=k,values=(k,item.nom,type),tags=(type,))
+        elif ancienne != ligne:
+            liste_peripheriques.item(k,values=(k,item.nom,type),tags=(type,))
+        lignesListe[k] = ligne
+    #supprime les périphériques disparus
+    for k in [ k for k in lignesListe if not k in presents ]:
+        liste_peripheriques.delete(k)
+        del lignesListe[k]
 
 #crée la fenètre
 def menu(fenetre):
@@ -1016,6 +1989,9 @@ def menu(fenetre):
     liste_peripheriques.heading("addresse",text = "adresse")
     liste_peripheriques.heading("nom",text = "nom")
     liste_peripheriques.heading("type",text = "type")
+    liste_peripheriques.tag_configure('normal', background='white')
+    liste_peripheriques.tag_configure('avancé', background='purple')
+    liste_peripheriques.tag_configure('départ', background='blue')
     
     #ajout à la fenètre
     bt_decouverte.grid(row=0,sticky=W+E)
@@ -1027,8 +2003,10 @@ def menu(fenetre):
     liste_peripheriques.grid(column=1,row=0,rowspan=6)
     
     #variable d'état
-    global interfaceInitialise
+    global interfaceInitialise,carteAffichee
     interfaceInitialise = True
+    carteAffichee = lisMappage()
+    surveilleInterface()
     #affichage à l'écran
     fenetre.mainloop()
 
@@ -1036,49 +2014,64 @@ def menu(fenetre):
 
 def debugSauve():
     """
-        permet de sauvegarder la carte
-        dans un fichier texte
+        permet de sauvegarder la carte et les services
+        dans un instantané (voir instantane.py)
     """
     path = os.path.abspath(os.path.dirname(sys.argv[0]))
     os.chdir(path.replace("\\","/"))
     nomFichier = input("nom de la sauvegarde:")
-    if not nomFichier.endswith(".txt"):
-        nomFichier += ".txt"
+    import instantane
+    if not nomFichier.endswith(".carte"):
+        nomFichier += ".carte"
     try:
-        fichier = open(nomFichier,"w")
-        fichier.write( str(mappageReseau) )
-    except:
-        print("erreur pendant l'ouverture du fichier")
-    finally:
-        fichier.close()
+        instantane.sauve(nomFichier,lisMappage(),mappageService)
+    except OSError:
+        print("erreur pendant l'écriture du fichier")
    
 def debugCharge():
     """
-        permet de charger la carte
-        depuis un fichier texte
+        permet de charger la carte et les services depuis
+        un instantané, ou la carte depuis une ancienne
+        sauvegarde texte (.txt)
     """
-    global mappageReseau
     path = os.path.abspath(os.path.dirname(sys.argv[0]))
     os.chdir(path.replace("\\","/"))
     nomFichier = input("nom de la sauvegarde:")
-    if not nomFichier.endswith(".txt"):
-        nomFichier += ".txt"
+    import instantane
+    services = None
     try:
-        fichier = open(nomFichier,"r")
-        mappageReseau = eval( fichier.read() )
-    except:
-        print("erreur pendant l'ouverture du fichier")
-    finally:
-        fichier.close() 
+        if nomFichier.endswith(".txt"):
+            carte = instantane.chargeTexte(nomFichier)
+        else:
+            if not nomFichier.endswith(".carte"):
+                nomFichier += ".carte"
+            #services lus à part, rangés par la commande
+            services = RegistreServices()
+            carte = instantane.charge(nomFichier,services)
+    except (OSError,instantane.ErreurInstantane) as e:
+        print("erreur pendant l'ouverture du fichier :",e)
+        return
+    etatReseau.execute(remplaceMappage,carte,services)
+
+def remplaceMappage(carte,services=None):
+    """
+        remplace le mappage par une carte chargée, et les
+        services s'ils sont donnés (commande de etatReseau)
+        
+        :param services: RegistreServices chargé avec la carte
+    """
+    global mappageReseau
+    mappageReseau = carte
+    if services is not None:
+        mappageService.chargeDict(services.versDict())
     #update addresse du serveur
     socketServeur.creationReussie = False
     add = "XX:XX:XX:XX:XX:XX"
-    for i in mappageReseau.keys():
-        if mappageReseau[i]["nom"] == "origine":
+    for i,item in mappageReseau.elements():
+        if item.nom == "origine":
             add = i
     socketServeur.getsockname = lambda: (add,0)
-    #update fenetre
-    majListe()
+    tableRoutage.changeDepart(add,mappageReseau)
 
 def debugFenetre():
     """
@@ -1090,35 +2083,127 @@ def debugFenetre():
     #boutons
     sauve = Button(fen,text="Sauvegarder",command=debugSauve)   #sauve le réseau
     charge = Button(fen,text="Charger",command=debugCharge)     #charge la carte
+    stats = Button(fen,text="Statistiques",command=fenetreStatistiques)   #mesures des chemins critiques
     #package
     sauve.pack()
     charge.pack()
-    
-
-## début du programme
+    stats.pack()
 
-#démarre le serveur
-initialisation()
-
-#démarre l'acceptation de connections
-main = threading.Thread(target = bouclePrincipale)
-main.daemon = True
-main.start()
-
-#création de la fenetre
-fenetre = Tk()
-fenetre.title("Bluetooth routing")
-
-#fenêtre de débogguage
-debugFenetre()
-
-menu(fenetre)
+def texteStatistique(valeur):
+    """
+        texte affiché pour la valeur d'une mesure (voir statistiques.py),
+        les durées étant en ms
+    """
+    if not isinstance(valeur,dict):
+        return str(valeur)
+    if not valeur["nombre"]:
+        return "-"
+    return "n=%d  moy=%.2f  p50=%.2f  p99=%.2f  max=%.2f ms" % (
+           valeur["nombre"],1000*valeur["moyenne"],1000*valeur["p50"],
+           1000*valeur["p99"],1000*valeur["max"])
 
-#ferme le serveur
-socketServeur.close()
+def exporteStatistiques():
+    """
+        enregistre les statistiques dans FICHIER_STATISTIQUES (json)
+    """
+    try:
+        statistiques.sauve(FICHIER_STATISTIQUES)
+        print("statistiques enregistrées dans",FICHIER_STATISTIQUES)
+    except OSError as e:
+        print("erreur pendant l'écriture des statistiques :",e)
 
+def fenetreStatistiques():
+    """
+        crée une fenêtre des statistiques, mise à jour
+        toutes les PERIODE_STATISTIQUES ms
+    """
+    fen = Toplevel()
+    fen.title("Statistiques")
+    #active ou désactive l'enregistrement
+    actif = IntVar(fen,int(statistiques.actif))
+    case = Checkbutton(fen,text="Enregistrer",variable=actif,
+                       command=lambda: statistiques.active(bool(actif.get())))
+    zero = Button(fen,text="Remettre à zéro",command=statistiques.remetAZero)
+    exporte = Button(fen,text="Exporter",command=exporteStatistiques)
+    table = ttk.Treeview(fen,columns=("valeur",),height=20)
+    table.heading("#0",text="Mesure")
+    table.heading("valeur",text="Valeur")
+    table.column("#0",width=220)
+    table.column("valeur",width=380)
+    case.grid(row=0,column=0,sticky=W)
+    zero.grid(row=0,column=1)
+    exporte.grid(row=0,column=2)
+    table.grid(row=1,column=0,columnspan=3)
+    def maj():
+        if not fen.winfo_exists():
+            return
+        mesures = statistiques.versDict()["mesures"]
+        #lignes repérées par le nom de la mesure
+        for nom in table.get_children():
+            if not nom in mesures:
+                table.delete(nom)
+        for nom,valeur in mesures.items():
+            if table.exists(nom):
+                table.item(nom,values=(texteStatistique(valeur),))
+            else:
+                table.insert('',"end",iid=nom,text=nom,values=(texteStatistique(valeur),))
+        fen.after(PERIODE_STATISTIQUES,maj)
+    maj()
     
 
+## début du programme
 
-
-
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = "routeur bluetooth")
+    parser.add_argument("--sans-interface",action = "store_true",
+                        help = "routeur seul, sans fenêtre (relais)")
+    parser.add_argument("--asyncio",action = "store_true",
+                        help = "serveur dans une boucle asyncio (voir SERVEUR_ASYNCIO)")
+    parser.add_argument("--recherche",type = float,default = 0,metavar = "S",
+                        help = "période des recherches réseau sans interface (s)")
+    parser.add_argument("--retransmet",action = "append",default = [],metavar = "ADRESSE[/N]",
+                        help = "retransmet le service N (0 par défaut) de ADRESSE, sans interface")
+    parser.add_argument("--statistiques",action = "store_true",
+                        help = "enregistre les statistiques dès le démarrage")
+    args = parser.parse_args()
+    if args.asyncio:
+        SERVEUR_ASYNCIO = True
+    if args.statistiques:
+        statistiques.active()
+    
+    #démarre le serveur
+    initialisation()
+    if args.sans_interface and not socketServeur.creationReussie:
+        sys.exit(1)
+    
+    #démarre l'acceptation de connections
+    if socketServeur.creationReussie:
+        if SERVEUR_ASYNCIO:
+            main = threading.Thread(target = bouclePrincipaleAsync)
+        else:
+            main = threading.Thread(target = bouclePrincipale)
+        main.daemon = True
+        main.start()
+    
+    if args.sans_interface:
+        services = []
+        for service in args.retransmet:
+            add , _ , num = service.partition("/")
+            services.append( (add,int(num or 0)) )
+        routeurSansInterface(args.recherche,services)
+    else:
+        importeInterface()
+        
+        #création de la fenetre
+        fenetre = Tk()
+        fenetre.title("Bluetooth routing")
+        
+        #fenêtre de débogguage
+        debugFenetre()
+        
+        menu(fenetre)
+    
+    #ferme le serveur
+    socketServeur.close()
+    cacheNoms.sauve()
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Flux multiplexés sur la connexion entre deux routeurs.
+
+    Un routeur ne garde qu'une connexion par pair (voir connexions.py),
+    utilisée dans les deux sens. En plus des paquets de contrôle, elle
+    porte des flux : des connexions logiques (sessions de tunnel...),
+    qui s'ouvrent et se ferment par un seul paquet, sans établir de
+    nouvelle connexion bluetooth.
+
+    Chaque paquet d'un flux est de la forme:
+        flux,<sens><identifiant>,<type>,<données>
+    où le sens est "+" pour un paquet envoyé par le routeur qui a
+    ouvert le flux, "-" pour l'autre (chacun numérote ses flux), et
+    le type:
+        o : ouverture, les données décrivant ce qui est demandé
+        d : données
+        c : crédit, les données donnant un nombre d'octets
+        f : fermeture, dans les deux sens
+
+    Contrôle de flux par crédits : un routeur n'envoie sur un flux
+    que FENETRE octets de plus que ce que le pair a déjà lu. Le pair
+    rend du crédit au fur et à mesure de sa lecture. Les données
+    reçues en attente de lecture sont donc bornées, et la lecture
+    de la connexion n'attend jamais un flux lent : un tunnel chargé
+    ne bloque ni les autres flux, ni les paquets de contrôle. Les
+    données sont envoyées par morceaux d'au plus TAILLE_MORCEAU, entre
+    lesquels passent les paquets des autres flux.
+
+    Un flux (Flux) s'utilise comme un socket connecté (recv_into,
+    sendall, shutdown, close) : il peut être donné à une
+    SessionRelais (voir relais.py).
+
+    :var FENETRE:
+          crédit initial de chaque sens d'un flux (octets)
+    :var TAILLE_MORCEAU:
+          taille maximale des données d'un paquet de flux
+"""
+
+import itertools
+import threading
+
+from trame import ENTETE
+
+PREFIXE_FLUX = b"flux,"
+FENETRE = 64*1024
+TAILLE_MORCEAU = 16*1024
+#types de paquets
+OUVERTURE = b"o"
+DONNEES = b"d"
+CREDIT = b"c"
+FERMETURE = b"f"
+#taille maximale de l'en-tête d'un paquet de flux
+TAILLE_ENTETE_FLUX = 32
+
+def estFlux(trame):
+    """
+        la trame est-elle un paquet de flux
+    """
+    return trame[:len(PREFIXE_FLUX)] == PREFIXE_FLUX
+
+def lisEnteteFlux(trame):
+    """
+        lit l'en-tête d'un paquet de flux
+
+        :return: tuple ( ouvert par l'envoyeur , identifiant , type , début des données )
+    """
+    morceaux = bytes(trame[:TAILLE_ENTETE_FLUX]).split(b",",3)
+    if len(morceaux) < 4 or len(morceaux[1]) < 2 or not morceaux[1][:1] in b"+-":
+        raise ValueError("en-tête de paquet de flux invalide")
+    _ , ident , genre , _ = morceaux
+    debut = len(PREFIXE_FLUX)+len(ident)+len(genre)+2
+    return ident[:1] == b"+" , int(ident[1:]) , genre , debut
+
+def trameFlux(ouvertIci,ident,genre,donnees=b""):
+    """
+        crée la trame d'un paquet de flux, en-tête de taille compris
+    """
+    entete = b"flux,%s%d,%s," % (b"+" if ouvertIci else b"-",ident,genre)
+    return b"".join( (ENTETE.pack(len(entete)+len(donnees)),entete,donnees) )
+
+class Flux:
+    """
+        Connexion logique avec un autre routeur, utilisable comme un socket
+
+        attributs:
+          pair : adresse MAC du routeur à l'autre bout
+          ident : identifiant, donné par le routeur qui l'a ouvert
+          ouvertIci : le flux a-t-il été ouvert par ce routeur
+          argument : ce qui a été demandé à l'ouverture
+          credit : octets qui peuvent encore être envoyés
+    """
+
+    def __init__(self,multiplexeur,pair,ident,ouvertIci,argument=""):
+        self.multiplexeur = multiplexeur
+        self.pair = pair
+        self.ident = ident
+        self.ouvertIci = ouvertIci
+        self.argument = argument
+        self.credit = multiplexeur.fenetre
+        #données reçues, pas encore lues
+        self.recus = bytearray()
+        #octets lus depuis le dernier crédit rendu
+        self.lus = 0
+        self.condition = threading.Condition()
+        #fermeture demandée par le pair, ou ici
+        self.finDistante = False
+        self.ferme = False
+
+    def cle(self):
+        return ( self.pair , self.ident , self.ouvertIci )
+
+    def envoiePaquet(self,genre,donnees=b""):
+        self.multiplexeur.envoie( self.pair , trameFlux(self.ouvertIci,self.ident,genre,donnees) )
+
+    def recv_into(self,vue):
+        """
+            reçoit des données dans "vue", en attendant qu'il y en ait
+
+            :return: nombre d'octets reçus (0 si le flux est fermé)
+        """
+        with self.condition:
+            while not self.recus and not (self.finDistante or self.ferme):
+                self.condition.wait()
+            n = min( len(vue) , len(self.recus) )
+            vue[:n] = self.recus[:n]
+            del self.recus[:n]
+            self.lus += n
+            #rend le crédit par paquets d'au moins une demi-fenêtre
+            rendu = 0
+            if self.lus >= self.multiplexeur.fenetre//2 and not (self.finDistante or self.ferme):
+                rendu = self.lus
+                self.lus = 0
+        if rendu:
+            try:
+                self.envoiePaquet( CREDIT , b"%d" % rendu )
+            except OSError:
+                self.coupe()
+        return n
+
+    def recv(self,taille):
+        tampon = bytearray(taille)
+        n = self.recv_into(tampon)
+        return bytes(tampon[:n])
+
+    def sendall(self,donnees):
+        """
+            envoie toutes les données, en attendant le crédit du pair
+        """
+        vue = memoryview(donnees).cast("B")
+        while len(vue):
+            with self.condition:
+                while self.credit <= 0 and not (self.finDistante or self.ferme):
+                    self.condition.wait()
+                if self.finDistante or self.ferme:
+                    raise BrokenPipeError("flux fermé")
+                n = min( len(vue) , self.credit , TAILLE_MORCEAU )
+                self.credit -= n
+            try:
+                self.envoiePaquet( DONNEES , vue[:n] )
+            except OSError:
+                self.coupe()
+                raise
+            vue = vue[n:]
+
+    def recoit(self,genre,donnees):
+        """
+            traite un paquet reçu du pair, sans jamais attendre
+            (appelé par la lecture de la connexion)
+        """
+        violation = False
+        with self.condition:
+            if genre == DONNEES:
+                #le pair ne doit pas dépasser le crédit donné
+                if len(self.recus)+len(donnees) > self.multiplexeur.fenetre:
+                    violation = True
+                else:
+                    self.recus += donnees
+            elif genre == CREDIT:
+                self.credit += int(donnees)
+            elif genre == FERMETURE:
+                self.finDistante = True
+            self.condition.notify_all()
+        if violation:
+            print("flux",self.ident,"de",self.pair,": crédit dépassé")
+            self.close()
+        elif genre == FERMETURE:
+            self.multiplexeur.oublie(self)
+
+    def coupe(self):
+        """
+            arrête le flux ici (connexion perdue), sans prévenir le pair
+        """
+        with self.condition:
+            self.ferme = True
+            self.condition.notify_all()
+        self.multiplexeur.oublie(self)
+
+    def shutdown(self,comment=None):
+        self.close()
+
+    def close(self):
+        """
+            ferme le flux dans les deux sens, en prévenant le pair
+        """
+        with self.condition:
+            if self.ferme:
+                return
+            self.ferme = True
+            prevenir = not self.finDistante
+            self.condition.notify_all()
+        self.multiplexeur.oublie(self)
+        if prevenir:
+            try:
+                self.envoiePaquet(FERMETURE)
+            except OSError:
+                pass
+
+    def getpeername(self):
+        return ( self.pair , self.ident )
+
+    def __str__(self):
+        return "flux %d avec %s (%s)" % (self.ident,self.pair,self.argument)
+
+class Multiplexeur:
+    """
+        Flux ouverts avec les autres routeurs
+    """
+
+    def __init__(self,envoie,accepte,fenetre=FENETRE):
+        """
+            :param envoie: fonction ( adresse du pair , trame ), qui envoie
+                           une trame sur la connexion vers le pair
+            :param accepte: fonction ( flux ), appelée dans un nouveau thread
+                            pour chaque flux ouvert par un pair
+        """
+        self.envoie = envoie
+        self.accepte = accepte
+        self.fenetre = fenetre
+        #flux ouverts : ( pair , identifiant , ouvert ici ) -> Flux
+        self.flux = {}
+        self.verrou = threading.Lock()
+        self.compteur = itertools.count(1)
+
+    def ouvre(self,pair,argument):
+        """
+            ouvre un flux vers un pair, sans attendre sa réponse :
+            des données peuvent être envoyées tout de suite
+
+            :param argument: ce qui est demandé au pair (texte)
+            :return: le flux
+        """
+        flux = Flux(self,pair,next(self.compteur),True,argument)
+        with self.verrou:
+            self.flux[flux.cle()] = flux
+        try:
+            flux.envoiePaquet( OUVERTURE , bytes(argument,encoding="utf-8") )
+        except OSError:
+            self.oublie(flux)
+            raise
+        return flux
+
+    def recoit(self,pair,trame):
+        """
+            traite un paquet de flux reçu d'un pair, sans jamais attendre
+
+            :param trame: le paquet, sans son en-tête de taille
+        """
+        ouvertParPair , ident , genre , debut = lisEnteteFlux(trame)
+        #les données de la trame ne sont valables que jusqu'à la suivante
+        donnees = bytes(trame[debut:])
+        cle = ( pair , ident , not ouvertParPair )
+        with self.verrou:
+            flux = self.flux.get(cle)
+            if flux is None and genre == OUVERTURE and ouvertParPair:
+                flux = Flux(self,pair,ident,False,str(donnees,encoding="utf-8"))
+                self.flux[cle] = flux
+                nouveau = True
+            else:
+                nouveau = False
+        if nouveau:
+            t = threading.Thread(target = self.accepte,args = [flux])
+            t.daemon = True
+            t.start()
+        elif flux is not None:
+            flux.recoit(genre,donnees)
+        #paquet d'un flux déjà fermé ici : ignoré
+
+    def oublie(self,flux):
+        with self.verrou:
+            if self.flux.get(flux.cle()) is flux:
+                del self.flux[flux.cle()]
+
+    def actifs(self,pair=None):
+        """
+            nombre de flux ouverts (avec "pair", ou en tout)
+        """
+        with self.verrou:
+            if pair is None:
+                return len(self.flux)
+            return sum( 1 for cle in self.flux if cle[0] == pair )
+
+    def lienPerdu(self,pair):
+        """
+            arrête les flux d'un pair dont la connexion est perdue
+        """
+        with self.verrou:
+            perdus = [ f for cle,f in self.flux.items() if cle[0] == pair ]
+        for flux in perdus:
+            flux.coupe()
+
+    def ferme(self):
+        """
+            ferme tous les flux
+        """
+        with self.verrou:
+            tous = list(self.flux.values())
+        for flux in tous:
+            flux.close()
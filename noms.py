@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Cache des noms des périphériques.
+
+    La résolution du nom d'un périphérique (lookup_name) est l'une
+    des opérations bluetooth les plus lentes. Les noms trouvés sont
+    donc gardés pendant DUREE_NOM secondes, et les échecs pendant
+    DUREE_ECHEC secondes (un périphérique sans nom n'est pas
+    interrogé à chaque recherche).
+
+    Le cache garde au plus "taille" adresses (les moins récemment
+    utilisées sont oubliées), et peut être sauvegardé dans un fichier
+    json, pour qu'un routeur redémarré retrouve les noms sans
+    les redemander.
+
+    :var DUREE_NOM:
+          durée de validité d'un nom trouvé (s)
+    :var DUREE_ECHEC:
+          durée pendant laquelle un échec de résolution est gardé (s)
+    :var TAILLE_CACHE:
+          nombre maximum d'adresses gardées
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DUREE_NOM = 24*3600
+DUREE_ECHEC = 300
+TAILLE_CACHE = 4096
+
+class CacheNoms:
+    """
+        Noms des périphériques, repérés par adresse MAC
+
+        chaque entrée est un couple ( nom , expiration ), le nom
+        valant None si la résolution a échoué, et l'expiration
+        étant une date (time.time) pour pouvoir être sauvegardée
+    """
+
+    def __init__(self,fichier=None,dureeNom=DUREE_NOM,dureeEchec=DUREE_ECHEC,taille=TAILLE_CACHE):
+        """
+            :param fichier: fichier de sauvegarde, ou None
+        """
+        self.fichier = fichier
+        self.dureeNom = dureeNom
+        self.dureeEchec = dureeEchec
+        self.taille = taille
+        self.entrees = OrderedDict()
+        self.verrou = threading.Lock()
+        self.modifie = False
+
+    def __len__(self):
+        return len(self.entrees)
+
+    def cherche(self,adresse):
+        """
+            donne l'entrée valide d'une adresse, ou None
+        """
+        with self.verrou:
+            entree = self.entrees.get(adresse)
+            if entree is None:
+                return None
+            if entree[1] < time.time():
+                del self.entrees[adresse]
+                self.modifie = True
+                return None
+            self.entrees.move_to_end(adresse)
+            return entree
+
+    def ajoute(self,adresse,nom):
+        """
+            garde le nom d'une adresse (None si la résolution a échoué)
+        """
+        duree = self.dureeNom if nom is not None else self.dureeEchec
+        with self.verrou:
+            self.entrees[adresse] = ( nom , time.time()+duree )
+            self.entrees.move_to_end(adresse)
+            while len(self.entrees) > self.taille:
+                self.entrees.popitem(last=False)
+            self.modifie = True
+
+    def nom(self,adresse,resolution):
+        """
+            donne le nom d'une adresse, en le résolvant s'il
+            n'est pas dans le cache
+
+            :param resolution: fonction qui donne le nom d'une adresse,
+                               ou None si elle n'en trouve pas
+        """
+        entree = self.cherche(adresse)
+        if entree is not None:
+            return entree[0]
+        try:
+            nom = resolution(adresse)
+        except OSError:
+            nom = None
+        self.ajoute(adresse,nom)
+        return nom
+
+    def charge(self):
+        """
+            charge le cache depuis son fichier, s'il existe
+        """
+        if not self.fichier or not os.path.exists(self.fichier):
+            return
+        try:
+            with open(self.fichier,"r",encoding="utf-8") as fichier:
+                entrees = json.load(fichier)
+        except (OSError,ValueError):
+            print("cache des noms illisible :",self.fichier)
+            return
+        maintenant = time.time()
+        with self.verrou:
+            for adresse,(nom,expiration) in entrees.items():
+                if expiration >= maintenant:
+                    self.entrees[adresse] = ( nom , expiration )
+            while len(self.entrees) > self.taille:
+                self.entrees.popitem(last=False)
+            self.modifie = False
+
+    def sauve(self):
+        """
+            sauvegarde le cache dans son fichier, s'il a changé
+            (écriture dans un fichier temporaire, puis remplacement)
+        """
+        if not self.fichier or not self.modifie:
+            return
+        with self.verrou:
+            entrees = dict(self.entrees)
+            self.modifie = False
+        temporaire = self.fichier + ".tmp"
+        try:
+            with open(temporaire,"w",encoding="utf-8") as fichier:
+                json.dump(entrees,fichier)
+                #sur le disque avant le remplacement : un arrêt brutal
+                #ne laisse pas un fichier tronqué à la place de l'ancien
+                fichier.flush()
+                os.fsync(fichier.fileno())
+            os.replace(temporaire,self.fichier)
+        except OSError:
+            print("sauvegarde du cache des noms impossible :",self.fichier)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Retransmission de données entre deux sockets (tunnel).
+
+    Chaque sens de transmission lit dans un tampon préalloué
+    (recv_into) et envoie tout ce qui a été lu avant de lire à
+    nouveau : si un côté est plus lent, l'autre n'est plus lu,
+    ce qui le ralentit à son tour (contre-pression).
+
+    Dès qu'un sens se termine (fin de données ou erreur), les deux
+    sockets sont coupés, ce qui débloque immédiatement l'autre sens :
+    la session s'arrête sans attente.
+
+    Les tampons sont gardés d'une session à l'autre.
+
+    :var TAILLE_TAMPON_RELAIS:
+          taille du tampon de chaque sens de transmission
+"""
+
+import socket
+import threading
+import time
+
+from trame import fonctionReception
+
+TAILLE_TAMPON_RELAIS = 64*1024
+
+#tampons libres, réutilisés par les sessions suivantes
+_tamponsLibres = []
+_verrouTampons = threading.Lock()
+
+def prendTampon():
+    """
+        donne un tampon libre, ou en crée un
+    """
+    with _verrouTampons:
+        if _tamponsLibres:
+            return _tamponsLibres.pop()
+    return bytearray(TAILLE_TAMPON_RELAIS)
+
+def rendTampon(tampon):
+    """
+        rend un tampon pour une prochaine session
+    """
+    with _verrouTampons:
+        _tamponsLibres.append(tampon)
+
+def fonctionEnvoi(sock):
+    """
+        donne la fonction qui envoie toutes les données d'une vue sur
+        le socket, même s'il n'en accepte qu'une partie à chaque envoi,
+        choisie une fois selon ce que le socket sait faire
+
+        :return: fonction ( vue )
+    """
+    if hasattr(sock,"sendall"):
+        return sock.sendall
+    #socket sans sendall
+    def envoie(vue):
+        while len(vue):
+            n = sock.send(vue)
+            vue = vue[n:]
+    return envoie
+
+def coupe(sock):
+    """
+        coupe un socket dans les deux sens, sans lever d'erreur
+    """
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except (OSError,AttributeError):
+        pass
+
+class SessionRelais:
+    """
+        Retransmission entre un client extérieur et le service d'origine
+
+        attributs:
+          client : adresse du client extérieur
+          entrant : octets transmis du client vers le service
+          sortant : octets transmis du service vers le client
+          debut, fin : dates (time.monotonic) de la session
+    """
+
+    def __init__(self,extSocket,socketSortie,client=None):
+        self.extSocket = extSocket
+        self.socketSortie = socketSortie
+        self.client = client
+        self.entrant = 0
+        self.sortant = 0
+        self.debut = time.monotonic()
+        self.fin = None
+
+    def boucle(self,entree,sortie,sens):
+        """
+            retransmet les données de "entree" vers "sortie"
+            jusqu'à la fin des données
+        """
+        recoit = fonctionReception(entree)
+        envoie = fonctionEnvoi(sortie)
+        tampon = prendTampon()
+        vue = memoryview(tampon)
+        try:
+            while True:
+                n = recoit(vue)
+                if not n:
+                    break
+                envoie(vue[:n])
+                if sens:
+                    self.entrant += n
+                else:
+                    self.sortant += n
+        except OSError:
+            pass
+        finally:
+            vue.release()
+            rendTampon(tampon)
+            #arrête l'autre sens
+            coupe(self.extSocket)
+            coupe(self.socketSortie)
+
+    def execute(self):
+        """
+            retransmet dans les deux sens, jusqu'à la fin de la session
+        """
+        autreSens = threading.Thread(target = self.boucle,
+                                     args = [self.socketSortie,self.extSocket,False])
+        autreSens.daemon = True
+        autreSens.start()
+        self.boucle(self.extSocket,self.socketSortie,True)
+        autreSens.join()
+        self.extSocket.close()
+        self.socketSortie.close()
+        self.fin = time.monotonic()
+
+    def duree(self):
+        return (self.fin or time.monotonic()) - self.debut
+
+    def debit(self):
+        """
+            débit moyen de la session (octets par seconde, deux sens)
+        """
+        duree = self.duree()
+        if duree <= 0:
+            return 0
+        return (self.entrant+self.sortant)/duree
+
+    def __str__(self):
+        return "%d octets entrants, %d sortants en %.2f s (%.0f o/s)" % (
+               self.entrant,self.sortant,self.duree(),self.debit())
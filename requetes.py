@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Suivi des requêtes envoyées aux autres routeurs.
+
+    Chaque requête reçoit un identifiant, envoyé dans le paquet, et
+    un futur (concurrent.futures.Future). La réponse, qui reprend
+    l'identifiant, termine le futur : celui qui a envoyé la requête
+    attend ses futurs jusqu'à une date limite, sans sonder de compteur,
+    et se réveille dès la dernière réponse.
+
+    Une réponse arrivée après l'abandon de sa requête (date limite
+    dépassée) est signalée comme tardive.
+
+    Une requête inondée (découverte), transmise par chaque routeur à
+    tous ses voisins, n'attend pas de réponse : elle porte un identifiant
+    unique, que chaque routeur garde un moment (IdentifiantsVus) pour
+    ignorer les copies reçues par d'autres chemins.
+
+    :var DUREE_VUS:
+          durée pendant laquelle un identifiant reçu est gardé (s)
+    :var TAILLE_VUS:
+          nombre maximum d'identifiants gardés
+"""
+
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DUREE_VUS = 120
+TAILLE_VUS = 4096
+
+def nouvelIdentifiant():
+    """
+        identifiant unique d'une requête inondée (64 bits aléatoires, en hexadécimal)
+    """
+    return os.urandom(8).hex()
+
+class TableRequetes:
+    """
+        Requêtes en attente de réponse, repérées par identifiant
+    """
+
+    def __init__(self):
+        self.verrou = threading.Lock()
+        self.compteur = itertools.count(1)
+        #identifiant -> ( destinataire , futur )
+        self.attente = {}
+
+    def __len__(self):
+        return len(self.attente)
+
+    def cree(self,destinataire=None):
+        """
+            crée une requête vers "destinataire"
+
+            :return: tuple ( identifiant , futur )
+        """
+        futur = concurrent.futures.Future()
+        with self.verrou:
+            ident = next(self.compteur)
+            self.attente[ident] = ( destinataire , futur )
+        return ident , futur
+
+    def termine(self,ident,source,resultat):
+        """
+            termine une requête avec sa réponse
+
+            :param source: adresse de l'envoyeur de la réponse, qui
+                           doit être le destinataire de la requête
+            :return: False si la requête est inconnue ou déjà abandonnée
+        """
+        with self.verrou:
+            attente = self.attente.get(ident)
+            if attente is None or (attente[0] is not None and attente[0] != source):
+                return False
+            del self.attente[ident]
+        attente[1].set_result(resultat)
+        return True
+
+    def abandonne(self,ident):
+        """
+            abandonne une requête : sa réponse sera ignorée
+        """
+        with self.verrou:
+            attente = self.attente.pop(ident,None)
+        if attente is not None:
+            attente[1].cancel()
+
+    def attend(self,requetes,fin):
+        """
+            attend les réponses de plusieurs requêtes jusqu'à la date
+            "fin" (time.monotonic), puis abandonne celles restées sans réponse
+
+            :param requetes: liste de tuples ( identifiant , futur )
+            :return: dictionnaire identifiant -> résultat des requêtes terminées
+        """
+        futurs = [ f for i,f in requetes ]
+        concurrent.futures.wait( futurs , timeout = max(0,fin-time.monotonic()) )
+        resultats = {}
+        for ident,futur in requetes:
+            if futur.done() and not futur.cancelled():
+                resultats[ident] = futur.result()
+            else:
+                self.abandonne(ident)
+        return resultats
+
+class IdentifiantsVus:
+    """
+        Identifiants des requêtes inondées déjà reçues, gardés
+        "duree" secondes (au plus "taille", les plus anciens
+        étant oubliés)
+    """
+
+    def __init__(self,duree=DUREE_VUS,taille=TAILLE_VUS):
+        self.duree = duree
+        self.taille = taille
+        self.verrou = threading.Lock()
+        #identifiant -> expiration (time.monotonic), du plus ancien au plus récent
+        self.vus = OrderedDict()
+
+    def __len__(self):
+        return len(self.vus)
+
+    def nouveau(self,ident):
+        """
+            retient un identifiant reçu
+
+            :return: False s'il a déjà été reçu (requête en double)
+        """
+        maintenant = time.monotonic()
+        with self.verrou:
+            #oublie les identifiants expirés, ou en trop
+            while self.vus:
+                premier , expiration = next(iter(self.vus.items()))
+                if expiration > maintenant and len(self.vus) < self.taille:
+                    break
+                del self.vus[premier]
+            if ident in self.vus:
+                return False
+            self.vus[ident] = maintenant+self.duree
+            return True
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Table de routage : pour chaque adresse atteignable depuis
+    le routeur, le prochain saut (voisin direct par lequel passer)
+    et le nombre de sauts.
+
+    La table est un arbre des plus courts chemins de la topologie
+    (voir topologie.py), avec les mêmes règles que Topologie.parcours :
+    seuls le départ et les périphériques avancés retransmettent.
+
+    Elle est mise à jour à partir des changements de la topologie
+    (voir Topologie.changements), sans recalcul complet:
+      - un lien ajouté, ou un périphérique devenu avancé, ne peut
+        que raccourcir des routes : elles sont relâchées depuis ce point
+      - un lien retiré qui ne fait pas partie de l'arbre ne change rien
+      - un lien retiré de l'arbre (ou un relais qui n'est plus avancé)
+        détache le sous-arbre qui en dépend, qui est raccroché par
+        les liens entrants de ses noeuds, puis relâché
+
+    La recherche d'une route est une simple lecture de dictionnaire,
+    sans verrou. Pendant une mise à jour, les routes changées sont donc
+    préparées à part (voir TableRoutage.changees), puis publiées à la
+    fin : une route qui change passe directement de l'ancienne à la
+    nouvelle, sans disparaître le temps du calcul, et un recalcul
+    complet remplace toute la table d'un coup.
+
+    Les liens n'ont pas de mesure de qualité dans la topologie : les
+    routes sont comptées en nombre de sauts.
+"""
+
+import threading
+from collections import deque
+
+class TableRoutage:
+    """
+        Prochain saut et nombre de sauts de chaque adresse atteignable
+        depuis "depart"
+    """
+
+    def __init__(self,topologie,depart=None):
+        self.topologie = topologie
+        self.depart = depart
+        self.verrou = threading.Lock()
+        #adresse -> ( adresse du prochain saut , nombre de sauts )
+        self.routes = {}
+        #routes changées par la mise à jour en cours, pas encore publiées :
+        #adresse -> route, ou None si elle est retirée
+        self.changees = {}
+        #arbre des plus courts chemins, par identifiant de la topologie
+        self.idDepart = None
+        self.sauts = {}
+        self.parent = {}
+        self.premier = {}
+        self.enfants = {}
+        #version de la topologie prise en compte
+        self.version = None
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __contains__(self,adresse):
+        return adresse in self.routes
+
+    def route(self,adresse):
+        """
+            donne la route vers une adresse, sous forme
+            ( adresse du prochain saut , nombre de sauts ), ou None
+        """
+        return self.routes.get(adresse)
+
+    def prochainSaut(self,adresse):
+        """
+            donne le voisin direct par lequel atteindre une adresse, ou None
+        """
+        route = self.routes.get(adresse)
+        if route is None:
+            return None
+        return route[0]
+
+    def changeDepart(self,depart,topologie=None):
+        """
+            change le point de départ (ou la topologie) des routes
+        """
+        with self.verrou:
+            self.depart = depart
+            if topologie is not None:
+                self.topologie = topologie
+            self.version = None
+        self.maj()
+
+    def maj(self):
+        """
+            prend en compte les changements de la topologie
+            depuis la dernière mise à jour
+        """
+        with self.verrou:
+            topo = self.topologie
+            #version lue avant les changements : un changement fait
+            #pendant la mise à jour sera repris la fois suivante
+            version = topo.version
+            if version == self.version:
+                return
+            changements = None
+            if self.version is not None and self.idDepart is not None:
+                changements = topo.changements(self.version)
+            self.changees = {}
+            if changements is None:
+                self.recalcule()
+                self.routes = { a : r for a,r in self.changees.items() if r is not None }
+            else:
+                self.applique(*changements)
+                self.publie()
+            self.changees = {}
+            self.version = version
+
+    def publie(self):
+        """
+            applique à la table les routes changées par la mise à jour
+        """
+        routes = self.routes
+        for adresse,route in self.changees.items():
+            if route is None:
+                routes.pop(adresse,None)
+            else:
+                routes[adresse] = route
+
+    def recalcule(self):
+        """
+            recalcule toute la table (dans les routes changées)
+        """
+        self.sauts = {}
+        self.parent = {}
+        self.premier = {}
+        self.enfants = {}
+        self.idDepart = self.topologie.index.get(self.depart)
+        if self.idDepart is None:
+            return
+        self.sauts[self.idDepart] = 0
+        self.relache( [self.idDepart] )
+
+    def relais(self,ident):
+        """
+            le noeud retransmet-il vers ses liens
+        """
+        return ident == self.idDepart or self.topologie.noeuds[ident].avance
+
+    def applique(self,modifies,retraits):
+        """
+            met à jour la table avec les noeuds modifiés
+            et les liens retirés (voir Topologie.changements)
+        """
+        index = self.topologie.index
+        #sous-arbres à détacher
+        racines = set()
+        for depart,arrivee in retraits:
+            i = index[arrivee]
+            if self.parent.get(i) == index[depart]:
+                racines.add(i)
+        #noeuds dont les liens ont pu raccourcir des routes
+        aRelacher = []
+        for adresse in modifies:
+            u = index[adresse]
+            if not u in self.sauts:
+                continue
+            if self.relais(u):
+                aRelacher.append(u)
+            else:
+                racines.update( self.enfants.get(u,()) )
+        if racines:
+            self.detache(racines,aRelacher)
+        self.relache(aRelacher)
+
+    def attache(self,ident,parent):
+        """
+            fait passer la route de "ident" par "parent"
+        """
+        ancien = self.parent.get(ident)
+        if ancien is not None:
+            self.enfants[ancien].discard(ident)
+        self.parent[ident] = parent
+        self.enfants.setdefault(parent,set()).add(ident)
+        self.sauts[ident] = self.sauts[parent]+1
+        premier = ident if parent == self.idDepart else self.premier[parent]
+        self.premier[ident] = premier
+        noeuds = self.topologie.noeuds
+        self.changees[ noeuds[ident].adresse ] = ( noeuds[premier].adresse , self.sauts[ident] )
+
+    def detache(self,racines,aRelacher):
+        """
+            retire les sous-arbres de "racines" de la table, puis
+            raccroche leurs noeuds par leurs liens entrants
+
+            :param aRelacher: reçoit les noeuds raccrochés
+        """
+        noeuds = self.topologie.noeuds
+        sousArbre = set()
+        pile = list(racines)
+        while pile:
+            w = pile.pop()
+            if w in sousArbre:
+                continue
+            sousArbre.add(w)
+            pile.extend( self.enfants.get(w,()) )
+        for w in sousArbre:
+            p = self.parent.pop(w)
+            if not p in sousArbre:
+                self.enfants[p].discard(w)
+            self.enfants.pop(w,None)
+            del self.sauts[w]
+            del self.premier[w]
+            self.changees[ noeuds[w].adresse ] = None
+        #raccroche chaque noeud au meilleur de ses entrants restés dans la table
+        for w in sousArbre:
+            meilleur = None
+            for x in tuple(noeuds[w].entrants):
+                if x in self.sauts and not x in sousArbre and self.relais(x):
+                    if meilleur is None or self.sauts[x] < self.sauts[meilleur]:
+                        meilleur = x
+            if meilleur is not None:
+                self.attache(w,meilleur)
+                aRelacher.append(w)
+
+    def relache(self,file):
+        """
+            raccourcit les routes à partir des noeuds de "file",
+            tant qu'un lien donne une route plus courte
+        """
+        noeuds = self.topologie.noeuds
+        sauts = self.sauts
+        file = deque(file)
+        while file:
+            u = file.popleft()
+            if not u in sauts or not self.relais(u):
+                continue
+            d = sauts[u]+1
+            for v in tuple(noeuds[u].liens):
+                if v != self.idDepart and d < sauts.get(v,d+1):
+                    self.attache(v,u)
+                    file.append(v)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Registre des services des périphériques à proximité.
+
+    Les services trouvés par le serveur SDP (find_service) sont
+    rangés par hôte, puis par couple (protocole, port) : trouver
+    un service ou vérifier qu'il est déjà connu ne demande pas de
+    parcourir une liste.
+
+    Les services d'un hôte sont gardés DUREE_SERVICES secondes.
+    Un rafraîchissement n'interroge que les hôtes nouveaux ou dont
+    les services ont expiré, plusieurs à la fois.
+
+    L'uuid extrait de l'enregistrement brut (pybluez sous windows)
+    est gardé, pour ne pas analyser à nouveau le même enregistrement.
+
+    format d'un service:
+        {"protocol"       : "RFCOMM" ou "L2CAP",
+         "name"           : nom du service,
+         "profiles"       : liste de (uuid du profil, version),
+         "service-id"     : uuid du service,
+         "service-classes": liste des uuid des classes,
+         "port"           : port (canal RFCOMM ou psm L2CAP)}
+
+    :var DUREE_SERVICES:
+          durée de validité des services d'un hôte (s)
+    :var MAX_RECHERCHES:
+          nombre d'hôtes interrogés en même temps
+    :var TAILLE_CACHE_UUID:
+          nombre d'enregistrements bruts dont l'uuid est gardé
+"""
+
+import binascii
+import concurrent.futures
+import threading
+import time
+
+DUREE_SERVICES = 120
+MAX_RECHERCHES = 4
+TAILLE_CACHE_UUID = 1024
+
+def texte(valeur):
+    """
+        converti en str une valeur donnée par le transport
+        (pybluez donne parfois des bytes)
+    """
+    if isinstance(valeur,bytes):
+        return str(valeur,encoding="utf-8",errors="replace")
+    return str(valeur)
+
+class RegistreServices:
+    """
+        Services connus, repérés par hôte et par (hôte, protocole, port)
+    """
+
+    def __init__(self,duree=DUREE_SERVICES):
+        self.duree = duree
+        self.verrou = threading.Lock()
+        #hôte -> { (protocole,port) -> service }
+        self.parHote = {}
+        #hôte -> date d'expiration (time.monotonic)
+        self.expiration = {}
+        #enregistrement brut -> uuid
+        self.uuids = {}
+
+    def __contains__(self,hote):
+        return hote in self.parHote
+
+    def hotes(self):
+        """
+            liste des hôtes ayant des services
+        """
+        with self.verrou:
+            return [ h for h,s in self.parHote.items() if s ]
+
+    def services(self,hote):
+        """
+            liste des services d'un hôte, dans l'ordre de découverte
+        """
+        with self.verrou:
+            return list( self.parHote.get(hote,{}).values() )
+
+    def service(self,hote,protocole,port):
+        """
+            donne un service, ou None
+        """
+        with self.verrou:
+            return self.parHote.get(hote,{}).get( (protocole,port) )
+
+    def hotesAvecService(self,uuid,parmi=None):
+        """
+            donne les couples (hôte, port) qui proposent le service "uuid"
+
+            :param parmi: si donné, ne garde que ces hôtes
+        """
+        if parmi is not None:
+            parmi = set(parmi)
+        with self.verrou:
+            resultat = []
+            for hote,services in self.parHote.items():
+                if parmi is not None and not hote in parmi:
+                    continue
+                for s in services.values():
+                    if s["service-id"] == uuid or uuid in s["service-classes"]:
+                        resultat.append( (hote,s["port"]) )
+                        break
+            return resultat
+
+    def analyse(self,item):
+        """
+            converti un résultat de find_service en service
+        """
+        sid = item["service-id"]
+        #extrait l'uuid (pybluez sous windows ne donne que l'enregistrement brut)
+        if item.get("rawrecord"):
+            raw = item["rawrecord"]
+            uuid = self.uuids.get(raw)
+            if uuid is None:
+                uuid = str(binascii.hexlify( raw.split(b'\t')[3] ))[2:-1]
+                uuid = str(uuid[:8]+'-'+uuid[8:12]+'-'+uuid[12:16]+'-'+uuid[16:20]+'-'+uuid[20:32])
+                if len(self.uuids) >= TAILLE_CACHE_UUID:
+                    self.uuids.clear()
+                self.uuids[raw] = uuid
+        else:
+            uuid = texte(sid) if sid else sid
+        nom = item["name"]
+        return {"protocol"       : item["protocol"],
+                "name"           : texte(nom) if nom else "None",
+                "profiles"       : [ (texte(p[0]),p[1]) for p in item["profiles"] ],
+                "service-id"     : uuid,
+                "service-classes": [ texte(c) for c in item["service-classes"] ],
+                "port"           : item["port"]}
+
+    def ajoute(self,liste):
+        """
+            ajoute les services d'un résultat de find_service
+
+            :return: liste des services nouveaux, sous forme (hôte, service)
+        """
+        #analysés hors du verrou, puis rangés en une fois
+        analyses = [ (item["host"],(item["protocol"],item["port"]),self.analyse(item))
+                     for item in liste ]
+        nouveaux = []
+        with self.verrou:
+            for hote,cle,service in analyses:
+                services = self.parHote.setdefault(hote,{})
+                if not cle in services:
+                    services[cle] = service
+                    nouveaux.append( (hote,service) )
+        return nouveaux
+
+    def remplace(self,hote,liste):
+        """
+            remplace tous les services d'un hôte
+
+            :return: liste des services qui n'étaient pas connus,
+                     sous forme (hôte, service)
+        """
+        #nouveaux services de l'hôte, construits hors du verrou
+        services = {}
+        for item in liste:
+            cle = (item["protocol"],item["port"])
+            if not cle in services:
+                services[cle] = self.analyse(item)
+        #échangés avec les anciens, comparés en même temps
+        with self.verrou:
+            anciens = self.parHote.get(hote,{})
+            self.parHote[hote] = services
+            self.expiration[hote] = time.monotonic()+self.duree
+            return [ (hote,s) for cle,s in services.items() if not cle in anciens ]
+
+    def versDict(self):
+        """
+            donne les services sous forme de dictionnaire
+            hôte -> liste des services (pour la sauvegarde)
+        """
+        with self.verrou:
+            return { h : list(s.values()) for h,s in self.parHote.items() }
+
+    def chargeDict(self,services):
+        """
+            remplace les services par ceux d'un dictionnaire
+            donné par versDict. Ils sont considérés comme expirés :
+            la prochaine recherche les vérifie
+        """
+        parHote = {}
+        for hote,liste in services.items():
+            parHote[hote] = { (s["protocol"],s["port"]) : s for s in liste }
+        with self.verrou:
+            self.parHote = parHote
+            self.expiration = {}
+
+    def aRafraichir(self,hotes):
+        """
+            donne les hôtes nouveaux, ou dont les services ont expiré
+        """
+        maintenant = time.monotonic()
+        with self.verrou:
+            return [ h for h in hotes if self.expiration.get(h,0) <= maintenant ]
+
+    def oublieAbsents(self,hotes):
+        """
+            oublie les hôtes expirés qui ne sont plus à proximité
+
+            :param hotes: hôtes à proximité
+        """
+        presents = set(hotes)
+        maintenant = time.monotonic()
+        with self.verrou:
+            for h in [ h for h,e in self.expiration.items() if e <= maintenant and not h in presents ]:
+                del self.expiration[h]
+                self.parHote.pop(h,None)
+
+    def interroge(self,hotes,recherche,maxRecherches=MAX_RECHERCHES):
+        """
+            interroge les hôtes nouveaux ou expirés, sans modifier
+            le registre (voir remplace)
+
+            :param hotes: hôtes à proximité
+            :param recherche: fonction de recherche de service,
+                              appelée avec address=<hôte>
+            :return: liste de couples (hôte, résultat de "recherche"),
+                     sans les hôtes injoignables
+        """
+        aInterroger = self.aRafraichir(hotes)
+        resultats = []
+        if not aInterroger:
+            return resultats
+        with concurrent.futures.ThreadPoolExecutor( min(maxRecherches,len(aInterroger)) ) as executeur:
+            futurs = { executeur.submit(recherche,address=h) : h for h in aInterroger }
+            for futur in concurrent.futures.as_completed(futurs):
+                try:
+                    resultats.append( (futurs[futur],futur.result()) )
+                except OSError:
+                    #hôte injoignable : réessayé au prochain rafraîchissement
+                    continue
+        return resultats
+
+    def rafraichit(self,hotes,recherche,maxRecherches=MAX_RECHERCHES):
+        """
+            interroge les hôtes nouveaux ou expirés, et oublie
+            les hôtes expirés qui ne sont plus à proximité
+
+            :param hotes: hôtes à proximité
+            :param recherche: fonction de recherche de service,
+                              appelée avec address=<hôte>
+            :return: liste des services nouveaux, sous forme (hôte, service)
+        """
+        self.oublieAbsents(hotes)
+        nouveaux = []
+        for hote,liste in self.interroge(hotes,recherche,maxRecherches):
+            nouveaux.extend( self.remplace(hote,liste) )
+        return nouveaux
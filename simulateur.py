@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Simulateur d'un réseau de routeurs sur une seule machine.
+
+    Chaque routeur est un processus qui exécute main.py avec le
+    transport TCP (voir transport.py). Le registre, qui remplace le
+    serveur SDP et la recherche de périphériques, tourne dans le
+    processus du simulateur et définit quels routeurs sont à portée
+    les uns des autres.
+
+    Le simulateur démarre les routeurs, lance depuis le premier une
+    recherche standard, une découverte et une recherche réseau, puis
+    mesure le débit d'envoi de paquets vers un voisin, et le coût d'un
+    flux (voir multiplex.py) comparé à celui d'une nouvelle connexion.
+    Les résultats sont affichés en json.
+
+    usage:
+        python simulateur.py [-n NB] [-t chaine|etoile|complete|aleatoire|grappes]
+                             [--portee R] [--graine G] [--delai S]
+                             [--asyncio] [-v]
+
+    Un routeur simulé reçoit ses commandes sur l'entrée standard
+    (une par ligne) et répond en json sur la sortie standard:
+        standard, decouverte : lance l'action et donne sa durée
+        recherche [délai] : lance une recherche réseau, donne sa durée et
+                            le nombre de routeurs qui ont répondu
+        debit <adresse> <nombre> <taille> : envoie des paquets à <adresse>
+        relais <adresse> <nombre> <taille> : envoie des paquets relayés
+                                             à <adresse> (voir acheminement.py)
+        flux <adresse> <nombre> <taille> : ouvre l'un après l'autre des flux
+                                           vers <adresse>, qui renvoie les
+                                           données, puis autant de connexions
+                                           (ouvertes et fermées, sans données)
+        etat : nombre de périphériques connus, et de routes
+        statistiques : mesures du routeur (voir statistiques.py)
+        quitte : arrête le routeur
+"""
+
+import argparse
+import json
+import math
+import os
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from transport import Registre, RegistreServeur, RegistreDistant, TransportTCP
+
+#nombre moyen de routeurs par grappe (forme "grappes")
+TAILLE_GRAPPE = 50
+
+def adresseFictive(i):
+    """
+        adresse MAC fictive du i-ème routeur
+    """
+    return "00:00:00:%02X:%02X:%02X" % ( (i>>16)&255 , (i>>8)&255 , i&255 )
+
+def liensGeometriques(positions,portee):
+    """
+        couples d'indices des positions à moins de "portee" l'une de l'autre
+
+        Les positions sont rangées dans une grille de cases de côté
+        "portee" : seules les cases voisines sont comparées
+    """
+    cases = {}
+    for i,(x,y) in enumerate(positions):
+        cases.setdefault( (math.floor(x/portee),math.floor(y/portee)) , [] ).append(i)
+    liens = []
+    for (cx,cy),indices in cases.items():
+        for dx in (-1,0,1):
+            for dy in (-1,0,1):
+                autres = cases.get( (cx+dx,cy+dy) )
+                if autres is None:
+                    continue
+                for i in indices:
+                    for j in autres:
+                        (xi,yi) , (xj,yj) = positions[i] , positions[j]
+                        if i < j and math.hypot(xi-xj,yi-yj) <= portee:
+                            liens.append( (i,j) )
+    liens.sort()
+    return liens
+
+def genereLiens(nb,forme,portee=0.3,graine=None):
+    """
+        génère les couples d'indices de routeurs à portée
+
+        :param forme: "chaine", "etoile", "complete", "aleatoire"
+                      (graphe géométrique aléatoire dans le carré unité)
+                      ou "grappes" (de même, les routeurs étant regroupés
+                      autour de quelques centres)
+        :param portee: portée radio pour les formes "aleatoire" et "grappes"
+    """
+    if forme == "chaine":
+        return [ (i,i+1) for i in range(nb-1) ]
+    if forme == "etoile":
+        return [ (0,i) for i in range(1,nb) ]
+    if forme == "complete":
+        return [ (i,j) for i in range(nb) for j in range(i+1,nb) ]
+    if forme == "aleatoire":
+        hasard = random.Random(graine)
+        positions = [ (hasard.random(),hasard.random()) for i in range(nb) ]
+        return liensGeometriques(positions,portee)
+    if forme == "grappes":
+        hasard = random.Random(graine)
+        #une grappe pour TAILLE_GRAPPE routeurs environ, d'un écart type de 2 portées
+        centres = [ (hasard.random(),hasard.random()) for i in range(max(1,nb//TAILLE_GRAPPE)) ]
+        #le premier routeur de chaque grappe est placé en son centre
+        positions = centres[:nb]
+        for i in range(len(positions),nb):
+            x,y = hasard.choice(centres)
+            positions.append( (hasard.gauss(x,2*portee),hasard.gauss(y,2*portee)) )
+        return liensGeometriques(positions,portee)
+    raise ValueError("forme inconnue : "+forme)
+
+## routeur simulé
+
+def noeud(adresse,hote,port,serveurAsyncio=False):
+    """
+        exécute un routeur simulé, piloté par l'entrée standard
+    """
+    #les affichages du routeur ne doivent pas se mêler aux réponses
+    sortie = sys.stdout
+    sys.stdout = sys.stderr
+    verrouSortie = threading.Lock()
+    def repond(reponse):
+        with verrouSortie:
+            sortie.write( json.dumps(reponse)+"\n" )
+            sortie.flush()
+
+    import main
+    registre = RegistreDistant(hote,port)
+    main.transport = TransportTCP(registre,adresse,"routeur "+adresse[-8:])
+    #les routeurs simulés partagent le même dossier
+    main.FICHIER_NOMS = None
+    main.initialisation()
+    main.statistiques.active()
+    if serveurAsyncio:
+        t = threading.Thread(target = main.bouclePrincipaleAsync)
+    else:
+        t = threading.Thread(target = main.bouclePrincipale)
+    t.daemon = True
+    t.start()
+    #répond à la sonde de rechercheStandard
+    sonde = main.transport.socket( main.transport.RFCOMM )
+    sonde.bind( ("",main.CANAL_SONDE) )
+    sonde.listen(8)
+    def accepteSonde():
+        while True:
+            sock,_ = sonde.accept()
+            sock.close()
+    t = threading.Thread(target = accepteSonde)
+    t.daemon = True
+    t.start()
+    #compte les paquets relayés reçus
+    relaisRecus = [0]
+    def recoitRelais(source,donnees):
+        relaisRecus[0] += 1
+    main.receveursRelais.append(recoitRelais)
+    #renvoie les données des flux "echo"
+    def echo(flux):
+        while True:
+            d = flux.recv(main.TAILLE_RECEPTION)
+            if not d:
+                break
+            flux.sendall(d)
+    main.receveursFlux["echo"] = echo
+
+    def execute(ident,commande):
+        debut = time.perf_counter()
+        reponse = {"id": ident,"commande": commande[0]}
+        try:
+            if commande[0] == "standard":
+                main.rechercheStandard()
+            elif commande[0] == "decouverte":
+                envoyes,voisins = main.decouverteReseau()
+                reponse["envois"] = "%d/%d" % (envoyes,voisins)
+            elif commande[0] == "recherche":
+                delai = float(commande[1]) if len(commande) > 1 else main.DELAI_RECHERCHE
+                repondus,interroges = main.rechercheReseau("",[],delai)
+                reponse["reponses"] = "%d/%d" % (repondus,interroges)
+            elif commande[0] == "debit":
+                dest = commande[1]
+                nombre,taille = int(commande[2]),int(commande[3])
+                for s in main.transport.find_service("Paquet",main.UUID_Serveur,dest):
+                    main.portsServeur[dest] = s["port"]
+                donnees = "bruit," + "x"*taille
+                debut = time.perf_counter()
+                for i in range(nombre):
+                    main.socketServeur.envoiePaquet(dest,donnees)
+                duree = time.perf_counter()-debut
+                reponse["octets/s"] = nombre*taille/duree if duree else None
+            elif commande[0] == "relais":
+                dest = commande[1]
+                nombre,taille = int(commande[2]),int(commande[3])
+                route = main.tableRoutage.route(dest)
+                if route is None:
+                    raise ValueError("pas de route vers "+dest)
+                reponse["sauts"] = route[1]
+                donnees = b"x"*taille
+                debut = time.perf_counter()
+                for i in range(nombre):
+                    main.socketServeur.envoieRelais(dest,donnees)
+            elif commande[0] == "flux":
+                dest = commande[1]
+                nombre,taille = int(commande[2]),int(commande[3])
+                for s in main.transport.find_service("Paquet",main.UUID_Serveur,dest):
+                    main.portsServeur[dest] = s["port"]
+                donnees = b"x"*taille
+                #flux sur la connexion déjà ouverte vers le pair
+                main.socketServeur.envoiePaquet(dest,"bruit,")
+                debut = time.perf_counter()
+                for i in range(nombre):
+                    flux = main.socketServeur.multiplex.ouvre(dest,"echo")
+                    flux.sendall(donnees)
+                    recus = 0
+                    while recus < taille:
+                        d = flux.recv(taille-recus)
+                        if not d:
+                            raise ConnectionResetError("flux fermé avant l'écho")
+                        recus += len(d)
+                    flux.close()
+                reponse["ms/flux"] = 1000*(time.perf_counter()-debut)/nombre
+                #nouvelle connexion au serveur du pair, pour comparer
+                debut = time.perf_counter()
+                for i in range(nombre):
+                    main.connecteRFCOMM( (dest,main.portsServeur[dest]) ).close()
+                reponse["ms/connexion"] = 1000*(time.perf_counter()-debut)/nombre
+            elif commande[0] == "etat":
+                reponse["relaisRecus"] = relaisRecus[0]
+            elif commande[0] == "statistiques":
+                reponse["statistiques"] = main.statistiques.versDict()["mesures"]
+            else:
+                raise ValueError("commande inconnue")
+        except Exception as e:
+            reponse["erreur"] = repr(e)
+        reponse["duree"] = time.perf_counter()-debut
+        #modifications envoyées par la commande appliquées (voir commandes.py)
+        main.etatReseau.synchronise()
+        reponse["connus"] = len(main.mappageReseau)
+        reponse["routes"] = len(main.tableRoutage)
+        repond(reponse)
+
+    repond( {"pret": adresse} )
+    ident = 0
+    for ligne in sys.stdin:
+        commande = ligne.split()
+        if not commande:
+            continue
+        if commande[0] == "quitte":
+            break
+        ident += 1
+        #chaque commande dans son thread : une recherche bloquée
+        #n'empêche pas de répondre aux suivantes
+        t = threading.Thread(target = execute, args = [ident,commande])
+        t.daemon = True
+        t.start()
+    main.socketServeur.close()
+
+## simulateur
+
+def mesureRelais(source,destination,nombre,taille,delai):
+    """
+        mesure le débit de bout en bout de paquets relayés de
+        "source" à "destination" (jusqu'à la réception du dernier)
+    """
+    debut = time.perf_counter()
+    resultat = source.commande("relais %s %d %d" % (destination.adresse,nombre,taille),delai)
+    if "erreur" in resultat:
+        return resultat
+    fin = time.monotonic()+delai
+    recus = 0
+    while recus < nombre and time.monotonic() < fin:
+        recus = destination.commande("etat",delai).get("relaisRecus",0)
+        time.sleep(0.005)
+    duree = time.perf_counter()-debut
+    return {"destination": destination.adresse,
+            "sauts": resultat["sauts"],
+            "recus": recus,
+            "octets/s": recus*taille/duree,
+            "duree": duree}
+
+class RouteurSimule:
+    """
+        processus d'un routeur simulé
+    """
+
+    def __init__(self,adresse,registre,serveurAsyncio=False,verbeux=False):
+        self.adresse = adresse
+        options = ["--asyncio"] if serveurAsyncio else []
+        self.processus = subprocess.Popen(
+            [sys.executable,os.path.abspath(__file__),
+             "--noeud",adresse,"--registre","%s:%d" % registre] + options,
+            stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+            stderr = None if verbeux else subprocess.DEVNULL,
+            cwd = os.path.dirname(os.path.abspath(__file__)),
+            universal_newlines = True)
+        self.reponses = queue.Queue()
+        self.ident = 0
+        t = threading.Thread(target = self.lit)
+        t.daemon = True
+        t.start()
+
+    def lit(self):
+        for ligne in self.processus.stdout:
+            self.reponses.put( json.loads(ligne) )
+
+    def attendPret(self,delai):
+        try:
+            return self.reponses.get(timeout = delai)
+        except queue.Empty:
+            return None
+
+    def commande(self,texte,delai):
+        """
+            envoie une commande et attend sa réponse au plus "delai" secondes
+        """
+        self.ident += 1
+        ident = self.ident
+        self.processus.stdin.write(texte+"\n")
+        self.processus.stdin.flush()
+        fin = time.monotonic()+delai
+        while True:
+            try:
+                reponse = self.reponses.get( timeout = max(0,fin-time.monotonic()) )
+            except queue.Empty:
+                return {"commande": texte.split()[0],"erreur": "délai dépassé","duree": delai}
+            if reponse.get("id") == ident:
+                return reponse
+
+    def arrete(self):
+        try:
+            self.processus.stdin.write("quitte\n")
+            self.processus.stdin.flush()
+            self.processus.wait(timeout = 2)
+        except (OSError,subprocess.TimeoutExpired):
+            self.processus.kill()
+
+def simule(nb,forme,portee,graine,delai,serveurAsyncio=False,verbeux=False):
+    """
+        démarre "nb" routeurs simulés et mesure les actions du premier
+
+        :return: dictionnaire des résultats
+    """
+    registre = Registre()
+    serveur = RegistreServeur(registre)
+    adresses = [ adresseFictive(i) for i in range(nb) ]
+    liens = genereLiens(nb,forme,portee,graine)
+    for i,j in liens:
+        registre.relie(adresses[i],adresses[j])
+    resultats = {"routeurs": nb,"forme": forme,"liens": len(liens),
+                 "asyncio": serveurAsyncio}
+
+    debut = time.perf_counter()
+    routeurs = [ RouteurSimule(a,serveur.adresse,serveurAsyncio,verbeux) for a in adresses ]
+    try:
+        for r in routeurs:
+            if r.attendPret(delai) is None:
+                raise RuntimeError("le routeur "+r.adresse+" n'a pas démarré")
+        resultats["demarrage"] = time.perf_counter()-debut
+
+        premier = routeurs[0]
+        for commande in ("standard","decouverte"):
+            resultats[commande] = premier.commande(commande,delai)
+        #la recherche se termine d'elle même avant le délai du simulateur
+        resultats["recherche"] = premier.commande("recherche %g" % (0.8*delai),delai)
+        voisins = [ adresses[j] for i,j in liens if i == 0 ]
+        if voisins:
+            resultats["debit"] = premier.commande("debit %s 200 1000" % voisins[0],delai)
+            resultats["flux"] = premier.commande("flux %s 50 1000" % voisins[0],delai)
+        if nb > 2:
+            resultats["relais"] = mesureRelais(premier,routeurs[-1],200,1000,delai)
+        resultats["statistiques"] = premier.commande("statistiques",delai)["statistiques"]
+    finally:
+        for r in routeurs:
+            r.arrete()
+        serveur.close()
+    return resultats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "simulation de routeurs sur TCP local")
+    parser.add_argument("-n",type = int,default = 10,help = "nombre de routeurs")
+    parser.add_argument("-t","--topologie",default = "aleatoire",
+                        choices = ["chaine","etoile","complete","aleatoire","grappes"])
+    parser.add_argument("--portee",type = float,default = 0.3)
+    parser.add_argument("--graine",type = int,default = None)
+    parser.add_argument("--delai",type = float,default = 30,
+                        help = "durée maximale de chaque action (s)")
+    parser.add_argument("--asyncio",action = "store_true",
+                        help = "serveur des routeurs dans une boucle asyncio")
+    parser.add_argument("-v","--verbeux",action = "store_true",
+                        help = "affiche la sortie des routeurs")
+    parser.add_argument("--noeud",help = argparse.SUPPRESS)
+    parser.add_argument("--registre",help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.noeud:
+        hote,port = args.registre.rsplit(":",1)
+        noeud(args.noeud,hote,int(port),args.asyncio)
+    else:
+        print( json.dumps( simule(args.n,args.topologie,args.portee,args.graine,
+                                  args.delai,args.asyncio,args.verbeux) ,
+                          indent = 2 , ensure_ascii = False ) )
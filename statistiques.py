@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Statistiques du routeur : compteurs, jauges et histogrammes
+    des durées, pour trouver les étapes lentes.
+
+    Les mesures sont créées une fois, par nom, depuis un registre
+    (Statistiques), puis enregistrées sur les chemins critiques.
+    Un registre désactivé n'enregistre rien : chaque enregistrement
+    se réduit alors à un test, et les durées ne sont pas mesurées
+    (voir Statistiques.horloge).
+
+    Une jauge n'enregistre rien : sa valeur est donnée par une
+    fonction, appelée à la lecture.
+
+    Un histogramme range les valeurs dans des intervalles de bornes
+    géométriques (BORNES) : les quantiles sont approchés par la borne
+    supérieure de leur intervalle.
+
+    Le registre se lit sous forme de dictionnaire, enregistrable
+    en json (voir Statistiques.versDict).
+
+    :var BORNES:
+          bornes supérieures des intervalles des histogrammes
+          (de 1 µs à environ 1 min, en secondes)
+    :var QUANTILES:
+          quantiles donnés pour chaque histogramme
+"""
+
+import bisect
+import json
+import threading
+import time
+
+BORNES = [ 1e-6 * 2**i for i in range(27) ]
+QUANTILES = (0.5,0.9,0.99)
+
+def zero():
+    return 0.0
+
+class Compteur:
+    """
+        Nombre d'évènements (paquets, octets...), qui ne fait qu'augmenter
+    """
+
+    def __init__(self,actif=True):
+        self.actif = actif
+        self.verrou = threading.Lock()
+        self.valeur = 0
+
+    def ajoute(self,n=1):
+        if not self.actif:
+            return
+        with self.verrou:
+            self.valeur += n
+
+    def lis(self):
+        return self.valeur
+
+    def remetAZero(self):
+        with self.verrou:
+            self.valeur = 0
+
+class Jauge:
+    """
+        Valeur instantanée, donnée par une fonction à chaque lecture
+    """
+
+    def __init__(self,fonction):
+        self.fonction = fonction
+
+    def lis(self):
+        try:
+            return self.fonction()
+        except Exception as e:
+            #une jauge cassée ne doit pas empêcher la lecture des autres
+            return repr(e)
+
+    def remetAZero(self):
+        pass
+
+class Histogramme:
+    """
+        Répartition de valeurs (des durées, en secondes)
+    """
+
+    def __init__(self,actif=True,bornes=BORNES):
+        self.actif = actif
+        self.bornes = bornes
+        self.verrou = threading.Lock()
+        self.remetAZero()
+
+    def ajoute(self,valeur):
+        if not self.actif:
+            return
+        i = bisect.bisect_left(self.bornes,valeur)
+        with self.verrou:
+            self.nombres[i] += 1
+            self.nombre += 1
+            self.somme += valeur
+            if self.nombre == 1 or valeur < self.min:
+                self.min = valeur
+            if self.nombre == 1 or valeur > self.max:
+                self.max = valeur
+
+    def depuis(self,debut,horloge=time.perf_counter):
+        """
+            ajoute la durée écoulée depuis "debut" (voir Statistiques.horloge)
+        """
+        if self.actif and debut:
+            self.ajoute( horloge()-debut )
+
+    def quantile(self,q):
+        """
+            valeur sous laquelle se trouvent une proportion "q" des valeurs
+            (borne supérieure de son intervalle), ou None
+        """
+        with self.verrou:
+            if not self.nombre:
+                return None
+            rang = q*self.nombre
+            cumul = 0
+            for i,n in enumerate(self.nombres):
+                cumul += n
+                if cumul >= rang and n:
+                    if i == len(self.bornes):
+                        return self.max
+                    return min(self.bornes[i],self.max)
+            return self.max
+
+    def lis(self):
+        """
+            résumé de l'histogramme, sous forme de dictionnaire
+        """
+        resume = {"nombre": self.nombre,"somme": self.somme,
+                  "min": self.min,"max": self.max,
+                  "moyenne": self.somme/self.nombre if self.nombre else None}
+        for q in QUANTILES:
+            resume["p%d" % round(100*q)] = self.quantile(q)
+        return resume
+
+    def remetAZero(self):
+        with self.verrou:
+            self.nombres = [0]*(len(self.bornes)+1)
+            self.nombre = 0
+            self.somme = 0.0
+            self.min = None
+            self.max = None
+
+class Chronometre:
+    """
+        Mesure la durée d'un bloc "with" dans un histogramme
+    """
+
+    def __init__(self,histogramme,horloge):
+        self.histogramme = histogramme
+        self.horloge = horloge
+
+    def __enter__(self):
+        self.debut = self.horloge()
+        return self
+
+    def __exit__(self,*exception):
+        self.histogramme.depuis(self.debut)
+        return False
+
+class Statistiques:
+    """
+        Registre des mesures, repérées par nom
+    """
+
+    def __init__(self,actif=False):
+        self.verrou = threading.Lock()
+        self.mesures = {}
+        self.debut = time.time()
+        self.actif = False
+        self.horloge = zero
+        self.active(actif)
+
+    def active(self,actif=True):
+        """
+            active ou désactive l'enregistrement de toutes les mesures
+        """
+        with self.verrou:
+            self.actif = actif
+            #une horloge qui donne 0 : les durées ne sont pas mesurées
+            self.horloge = time.perf_counter if actif else zero
+            for mesure in self.mesures.values():
+                if not isinstance(mesure,Jauge):
+                    mesure.actif = actif
+
+    def ajouteMesure(self,nom,classe,*args):
+        with self.verrou:
+            mesure = self.mesures.get(nom)
+            if mesure is None:
+                if classe is Jauge:
+                    mesure = Jauge(*args)
+                else:
+                    mesure = classe(self.actif,*args)
+                self.mesures[nom] = mesure
+            elif not isinstance(mesure,classe):
+                raise ValueError("mesure "+nom+" déjà définie")
+            return mesure
+
+    def compteur(self,nom):
+        """
+            donne le compteur "nom", créé s'il n'existe pas
+        """
+        return self.ajouteMesure(nom,Compteur)
+
+    def histogramme(self,nom):
+        """
+            donne l'histogramme "nom", créé s'il n'existe pas
+        """
+        return self.ajouteMesure(nom,Histogramme)
+
+    def jauge(self,nom,fonction):
+        """
+            crée (ou remplace) la jauge "nom", lue par "fonction"
+        """
+        with self.verrou:
+            self.mesures[nom] = Jauge(fonction)
+            return self.mesures[nom]
+
+    def retire(self,nom):
+        with self.verrou:
+            self.mesures.pop(nom,None)
+
+    def chronometre(self,histogramme):
+        """
+            mesure la durée d'un bloc "with" dans un histogramme
+
+            :param histogramme: l'histogramme, déjà créé (sans recherche
+                                dans le registre), ou son nom
+        """
+        if isinstance(histogramme,str):
+            histogramme = self.histogramme(histogramme)
+        return Chronometre(histogramme,self.horloge)
+
+    def remetAZero(self):
+        with self.verrou:
+            mesures = list(self.mesures.values())
+            self.debut = time.time()
+        for mesure in mesures:
+            mesure.remetAZero()
+
+    def versDict(self):
+        """
+            valeurs de toutes les mesures, par nom
+        """
+        with self.verrou:
+            mesures = sorted(self.mesures.items())
+        return {"actif": self.actif,"debut": self.debut,"date": time.time(),
+                "mesures": { nom : mesure.lis() for nom,mesure in mesures }}
+
+    def sauve(self,chemin):
+        """
+            enregistre les valeurs de toutes les mesures en json
+        """
+        with open(chemin,"w",encoding="utf-8") as fichier:
+            json.dump(self.versDict(),fichier,indent = 2,ensure_ascii = False)
@@ -0,0 +1,460 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Stockage compact de la topologie du réseau.
+
+    Chaque périphérique connu reçoit un identifiant entier,
+    attribué à sa première apparition. Les liens sont conservés
+    sous forme d'ensembles d'identifiants, et un index permet de
+    retrouver l'identifiant d'une adresse MAC en temps constant.
+
+    Ainsi, l'ajout d'un lien ou le test de présence d'un lien
+    ne parcourent plus de liste, et la fusion d'une carte distante
+    reste linéaire en nombre de liens.
+
+    La carte simplifiée (arbre de parcours en largeur depuis un
+    point de départ) est calculée en un seul passage, puis gardée
+    en cache jusqu'à la prochaine modification de la topologie.
+
+    Chaque modification incrémente la version de la topologie et est
+    notée dans un journal (noeud modifié, ou lien retiré). Les
+    changements depuis une version donnée s'obtiennent en remontant
+    le journal, en un temps proportionnel au nombre de changements :
+    un routeur n'envoie à ses pairs que ce qui a changé depuis leur
+    dernière réponse. Le journal est régulièrement compacté (seule
+    la dernière modification de chaque noeud est gardée, et au plus
+    HISTORIQUE_RETRAITS liens retirés) : un pair trop en retard
+    reçoit alors la topologie complète.
+
+    Un instantané (Topologie.instantane) est une copie de la topologie,
+    à lire pendant qu'elle continue d'être modifiée. Il partage les
+    noeuds de la topologie : un noeud n'est copié qu'au moment où il
+    est modifié après l'instantané (copie sur écriture), une seule
+    fois jusqu'à l'instantané suivant.
+
+    :var NOM_INCONNU:
+          nom donné à un périphérique cité dans un lien
+          avant d'avoir été décrit
+    :var HISTORIQUE_RETRAITS:
+          nombre de liens retirés gardés dans le journal
+"""
+
+import random
+from collections import deque
+
+NOM_INCONNU = "None"
+HISTORIQUE_RETRAITS = 1024
+
+class Noeud:
+    """
+        Enregistrement d'un périphérique de la topologie
+
+        attributs:
+          adresse : adresse MAC du périphérique
+          nom : nom lisible du périphérique
+          direct : le périphérique est-il visible d'ici
+          avance : le périphérique a-t-il un serveur
+          liens : identifiants des périphériques contactables
+                  à travers celui-ci
+          entrants : identifiants des périphériques qui ont
+                     un lien vers celui-ci
+          generation : génération de la topologie qui a créé cet
+                       enregistrement (voir Topologie.modifiable)
+    """
+
+    __slots__ = ("adresse","nom","direct","avance","liens","entrants","generation")
+
+    def __init__(self,adresse,nom=NOM_INCONNU,direct=False,avance=False,liens=None,entrants=None,generation=0):
+        self.adresse = adresse
+        self.nom = nom
+        self.direct = direct
+        self.avance = avance
+        self.liens = set() if liens is None else liens
+        self.entrants = set() if entrants is None else entrants
+        self.generation = generation
+
+    def copie(self,generation):
+        return Noeud(self.adresse,self.nom,self.direct,self.avance,
+                     set(self.liens),set(self.entrants),generation)
+
+class Parcours:
+    """
+        Résultat d'un parcours en largeur de la topologie, gardé en
+        cache et partagé par ses lecteurs : il ne doit pas être modifié
+
+        attributs:
+          depart : adresse du point de départ
+          carte : arbre imbriqué des adresses atteintes
+                  (voir carteSimplifiee)
+          niveaux : distance de chaque adresse au départ
+          adresses : liste des adresses atteintes, par niveau croissant
+          version : version de la topologie parcourue
+    """
+
+    __slots__ = ("depart","carte","niveaux","adresses","version")
+
+    def __init__(self,depart,version):
+        self.depart = depart
+        self.carte = {}
+        self.niveaux = {}
+        self.adresses = []
+        self.version = version
+
+class Topologie:
+    """
+        Carte du réseau indexée par identifiants entiers
+
+        Remplace le dictionnaire de dictionnaires "mappageReseau",
+        en gardant les mêmes opérations : ajout de noeud, ajout de
+        lien, modification de "avance"/"direct" et parcours des voisins
+    """
+
+    def __init__(self):
+        #noeuds, repérés par leur identifiant
+        self.noeuds = []
+        #index adresse MAC -> identifiant
+        self.index = {}
+        #numéro de version, incrémenté à chaque modification
+        self.version = 0
+        #identifie cette suite de versions : les versions d'un
+        #routeur redémarré ne sont pas comparables aux précédentes
+        self.epoque = "%08x" % random.getrandbits(32)
+        #journal des modifications, par version croissante:
+        #  ( version , identifiant , None ) : noeud modifié
+        #  ( version , identifiant , arrivée ) : lien retiré
+        self.journal = []
+        #version du plus récent lien retiré oublié par le journal
+        self.versionOubli = 0
+        #parcours déjà calculés pour la version "versionCache"
+        self.cacheParcours = {}
+        self.versionCache = 0
+        #les noeuds d'une génération antérieure sont partagés
+        #avec un instantané, et copiés avant d'être modifiés
+        self.generation = 0
+        #dernier instantané créé
+        self.dernierInstantane = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self,adresse):
+        return adresse in self.index
+
+    def __iter__(self):
+        """
+            parcourt les adresses connues
+        """
+        return iter(list(self.index))
+
+    def identifiant(self,adresse):
+        """
+            donne l'identifiant d'une adresse,
+            en créant le noeud si besoin
+        """
+        ident = self.index.get(adresse)
+        if ident is None:
+            ident = len(self.noeuds)
+            self.noeuds.append( Noeud(adresse,generation = self.generation) )
+            self.index[adresse] = ident
+            self.modifie(ident)
+        return ident
+
+    def modifie(self,ident,retire=None):
+        """
+            passe à la version suivante, et note la modification
+            du noeud "ident" (ou le retrait du lien vers "retire")
+        """
+        self.version += 1
+        self.journal.append( (self.version,ident,retire) )
+        if len(self.journal) > 2*( len(self.noeuds)+HISTORIQUE_RETRAITS ):
+            self.compacteJournal()
+
+    def compacteJournal(self):
+        """
+            garde la dernière modification de chaque noeud,
+            et les HISTORIQUE_RETRAITS derniers liens retirés
+        """
+        vus = set()
+        retraits = 0
+        journal = []
+        for entree in reversed(self.journal):
+            version,ident,retire = entree
+            if retire is None:
+                if ident in vus:
+                    continue
+                vus.add(ident)
+            elif retraits < HISTORIQUE_RETRAITS:
+                retraits += 1
+            else:
+                self.versionOubli = max(self.versionOubli,version)
+                continue
+            journal.append(entree)
+        journal.reverse()
+        self.journal = journal
+
+    def noeud(self,adresse):
+        """
+            donne l'enregistrement d'une adresse connue
+        """
+        return self.noeuds[ self.index[adresse] ]
+
+    def modifiable(self,ident):
+        """
+            donne l'enregistrement d'un noeud à modifier, copié
+            s'il est partagé avec un instantané
+        """
+        noeud = self.noeuds[ident]
+        if noeud.generation != self.generation:
+            noeud = noeud.copie(self.generation)
+            self.noeuds[ident] = noeud
+        return noeud
+
+    def instantane(self):
+        """
+            donne une copie de la topologie dans son état actuel, qui
+            ne change plus : elle peut être lue par d'autres threads
+            pendant que celle-ci est modifiée, mais ne doit pas
+            être modifiée elle même
+
+            La copie partage les noeuds (voir Topologie.modifiable) :
+            son coût ne dépend que du nombre de noeuds, et le même
+            instantané est redonné tant que la topologie n'a pas changé
+        """
+        copie = self.dernierInstantane
+        if copie is not None and copie.version == self.version and copie.epoque == self.epoque:
+            return copie
+        copie = Topologie.__new__(Topologie)
+        copie.noeuds = list(self.noeuds)
+        copie.index = dict(self.index)
+        copie.version = self.version
+        copie.epoque = self.epoque
+        copie.journal = list(self.journal)
+        copie.versionOubli = self.versionOubli
+        copie.cacheParcours = {}
+        copie.versionCache = self.version
+        copie.generation = -1
+        copie.dernierInstantane = copie
+        #les noeuds actuels sont désormais partagés
+        self.generation += 1
+        self.dernierInstantane = copie
+        return copie
+
+    def ajouteNoeud(self,adresse,nom=None,direct=None,avance=None):
+        """
+            ajoute un noeud, ou met à jour les attributs donnés
+            d'un noeud existant
+
+            :return: l'enregistrement du noeud
+        """
+        ident = self.identifiant(adresse)
+        noeud = self.noeuds[ident]
+        if nom is not None and noeud.nom != nom:
+            noeud = self.modifiable(ident)
+            noeud.nom = nom
+            self.modifie(ident)
+        if direct is not None and noeud.direct != direct:
+            noeud = self.modifiable(ident)
+            noeud.direct = direct
+            self.modifie(ident)
+        if avance is not None and noeud.avance != avance:
+            noeud = self.modifiable(ident)
+            noeud.avance = avance
+            self.modifie(ident)
+        return noeud
+
+    def ajouteLien(self,depart,arrivee):
+        """
+            ajoute un lien de "depart" vers "arrivee"
+
+            :return: True si le lien est nouveau
+        """
+        idArrivee = self.identifiant(arrivee)
+        idDepart = self.identifiant(depart)
+        if idArrivee in self.noeuds[idDepart].liens:
+            return False
+        self.modifiable(idDepart).liens.add(idArrivee)
+        self.modifiable(idArrivee).entrants.add(idDepart)
+        self.modifie(idDepart)
+        return True
+
+    def retireLien(self,depart,arrivee):
+        """
+            retire le lien de "depart" vers "arrivee", s'il existe
+        """
+        if not self.aLien(depart,arrivee):
+            return
+        idDepart = self.index[depart]
+        idArrivee = self.index[arrivee]
+        self.modifiable(idDepart).liens.discard(idArrivee)
+        self.modifiable(idArrivee).entrants.discard(idDepart)
+        self.modifie(idDepart,idArrivee)
+
+    def remplaceLiens(self,depart,arrivees):
+        """
+            remplace tous les liens partant de "depart"
+        """
+        idDepart = self.identifiant(depart)
+        liens = set( self.identifiant(a) for a in arrivees )
+        noeud = self.noeuds[idDepart]
+        if liens != noeud.liens:
+            ajoutes = liens - noeud.liens
+            retires = noeud.liens - liens
+            self.modifiable(idDepart).liens = liens
+            for i in ajoutes:
+                self.modifiable(i).entrants.add(idDepart)
+            for i in retires:
+                self.modifiable(i).entrants.discard(idDepart)
+                self.modifie(idDepart,i)
+            if ajoutes:
+                self.modifie(idDepart)
+
+    def aLien(self,depart,arrivee):
+        """
+            le lien de "depart" vers "arrivee" existe-t-il
+        """
+        if not (depart in self.index and arrivee in self.index):
+            return False
+        return self.index[arrivee] in self.noeud(depart).liens
+
+    def liens(self,adresse):
+        """
+            donne les adresses des voisins d'un noeud
+        """
+        noeuds = self.noeuds
+        return [ noeuds[i].adresse for i in self.noeud(adresse).liens ]
+
+    def elements(self):
+        """
+            parcourt les couples (adresse, noeud)
+        """
+        noeuds = self.noeuds
+        return [ (a, noeuds[i]) for a,i in self.index.items() ]
+
+    def parcours(self,depart,interdits=()):
+        """
+            parcourt la topologie en largeur depuis "depart",
+            sans passer par les interdits.
+
+            Seuls les périphériques avancés (et le départ) sont
+            traversés, les autres restent des feuilles de la carte.
+            Le résultat est gardé en cache tant que la topologie
+            n'est pas modifiée (si aucun interdit n'est donné).
+
+            :return: un objet Parcours
+        """
+        #oublie les parcours d'une ancienne version
+        if self.versionCache != self.version:
+            self.cacheParcours = {}
+            self.versionCache = self.version
+        #résultat en cache
+        if not interdits and depart in self.cacheParcours:
+            return self.cacheParcours[depart]
+        resultat = Parcours(depart,self.version)
+        if not depart in self.index:
+            return resultat
+        noeuds = self.noeuds
+        idDepart = self.index[depart]
+        vus = set( self.index[a] for a in interdits if a in self.index )
+        vus.add(idDepart)
+        niveaux = resultat.niveaux
+        adresses = resultat.adresses
+        #file des noeuds à développer : (identifiant, niveau, sous-carte)
+        file = deque( [ (idDepart,0,resultat.carte) ] )
+        while file:
+            ident,niveau,sousCarte = file.popleft()
+            for voisin in noeuds[ident].liens:
+                if voisin in vus:
+                    continue
+                vus.add(voisin)
+                noeud = noeuds[voisin]
+                carteVoisin = {}
+                sousCarte[noeud.adresse] = carteVoisin
+                niveaux[noeud.adresse] = niveau+1
+                adresses.append(noeud.adresse)
+                if noeud.avance:
+                    file.append( (voisin,niveau+1,carteVoisin) )
+        if not interdits:
+            self.cacheParcours[depart] = resultat
+        return resultat
+
+    def changements(self,depuis):
+        """
+            donne les changements depuis la version "depuis"
+
+            :return: tuple ( adresses des noeuds ajoutés ou modifiés ,
+                             liens retirés sous forme (depart,arrivee) ),
+                     ou None si le journal ne remonte pas jusque là
+        """
+        if depuis > self.version or depuis < self.versionOubli:
+            return None
+        noeuds = self.noeuds
+        modifies = set()
+        retraits = set()
+        #remonte le journal jusqu'à la version demandée
+        journal = self.journal
+        for k in range( len(journal)-1 , -1 , -1 ):
+            version,ident,retire = journal[k]
+            if version <= depuis:
+                break
+            if retire is None:
+                modifies.add(ident)
+            elif not retire in noeuds[ident].liens:
+                #lien retiré, et pas rajouté depuis
+                retraits.add( (ident,retire) )
+        return ( [ noeuds[i].adresse for i in modifies ] ,
+                 [ (noeuds[d].adresse,noeuds[a].adresse) for d,a in retraits ] )
+
+    @classmethod
+    def depuisTableaux(cls,adresses,noms,direct,avance,debuts,cibles):
+        """
+            crée une topologie depuis des tableaux, sans passer par
+            ajouteNoeud/ajouteLien (voir instantane.py)
+
+            Les entrants sont reconstruits depuis les liens : ils
+            sont toujours cohérents avec eux
+
+            :param adresses,noms,direct,avance: attributs du noeud i
+            :param debuts,cibles: les liens du noeud i sont les
+                                  identifiants cibles[debuts[i]:debuts[i+1]]
+        """
+        topo = cls()
+        cibles = cibles.tolist()
+        topo.noeuds = [ Noeud( adresses[i] , noms[i] , direct[i] , avance[i] ,
+                               set( cibles[debuts[i]:debuts[i+1]] ) , set() )
+                        for i in range(len(adresses)) ]
+        noeuds = topo.noeuds
+        for i in range(len(adresses)):
+            for c in cibles[debuts[i]:debuts[i+1]]:
+                noeuds[c].entrants.add(i)
+        topo.index = { a : i for i,a in enumerate(adresses) }
+        #nouvelle époque : un pair reçoit d'abord la topologie complète
+        topo.version = 1
+        topo.versionOubli = 1
+        return topo
+
+    def versDict(self):
+        """
+            donne la carte sous l'ancienne forme de dictionnaire
+        """
+        carte = {}
+        for adresse,noeud in self.elements():
+            carte[adresse] = {"nom": noeud.nom,
+                              "direct": noeud.direct,
+                              "avance": noeud.avance,
+                              "liens": self.liens(adresse)}
+        return carte
+
+    @classmethod
+    def depuisDict(cls,carte):
+        """
+            crée une topologie depuis l'ancienne forme de dictionnaire
+        """
+        topo = cls()
+        for adresse,item in carte.items():
+            topo.ajouteNoeud(adresse,item["nom"],item["direct"],item["avance"])
+        for adresse,item in carte.items():
+            for l in item["liens"]:
+                topo.ajouteLien(adresse,l)
+        return topo
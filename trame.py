@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Découpage des paquets échangés entre routeurs.
+
+    Chaque paquet est précédé d'un en-tête binaire fixe de 4 octets,
+    donnant la taille du paquet (entier non signé, gros-boutiste).
+
+    À la réception, les données sont lues directement dans un tampon
+    réutilisable (recv_into), et les paquets complets en sont extraits
+    sous forme de memoryview, sans copie. Ainsi le coût de réception
+    reste proportionnel à la taille des données, même pour de gros paquets.
+
+    Le même format est utilisé à l'envoi (voir SocketServeur.envoiePaquet)
+    et à la réception (voir SocketServeur.serveurDataThread).
+
+    Les paquets qui commencent par l'un des préfixes "en flux" du
+    lecteur (de grandes réponses) ne sont pas attendus en entier : ils
+    sont donnés par morceaux (Morceau), au fur et à mesure de leur
+    réception, et le tampon garde sa taille. Ces morceaux peuvent être
+    découpés en enregistrements (voir decoupeEnregistrements).
+
+    :var TAILLE_TAMPON:
+          taille initiale du tampon de réception
+    :var MAX_TRAME:
+          taille maximale d'un paquet, au-delà la connexion est abandonnée
+"""
+
+import struct
+
+ENTETE = struct.Struct("!I")
+TAILLE_ENTETE = ENTETE.size
+TAILLE_TAMPON = 4096
+MAX_TRAME = 16*1024*1024
+
+class ErreurTrame(ValueError):
+    """
+        paquet invalide (trop grand)
+    """
+    pass
+
+def encodeTrame(donnees):
+    """
+        ajoute l'en-tête de taille à un paquet
+
+        :param donnees: octets du paquet
+    """
+    if len(donnees) > MAX_TRAME:
+        raise ErreurTrame("paquet trop grand : "+str(len(donnees))+" octets")
+    return ENTETE.pack(len(donnees)) + donnees
+
+class Morceau:
+    """
+        Partie d'un paquet lu en flux
+
+        attributs:
+          donnees : vue sur le tampon, valable jusqu'à la trame suivante
+          premier : le morceau commence-t-il le paquet
+          dernier : le morceau termine-t-il le paquet
+    """
+    __slots__ = ("donnees","premier","dernier")
+
+    def __init__(self,donnees,premier,dernier):
+        self.donnees = donnees
+        self.premier = premier
+        self.dernier = dernier
+
+def decoupeEnregistrements(separateur=b";"):
+    """
+        générateur qui découpe un flux d'octets en enregistrements
+
+        Chaque morceau envoyé (send) donne la liste des enregistrements
+        qu'il termine ; None marque la fin du flux, et donne le dernier.
+        Seul l'enregistrement en cours est gardé entre deux morceaux.
+
+        utilisation:
+            decoupe = decoupeEnregistrements()
+            next(decoupe)
+            for morceau in morceaux:
+                for enregistrement in decoupe.send(morceau):
+                    ...
+            for enregistrement in decoupe.send(None):
+                ...
+    """
+    reste = b""
+    complets = []
+    while True:
+        morceau = yield complets
+        if morceau is None:
+            complets = [reste] if reste else []
+            reste = b""
+        else:
+            complets = (reste+bytes(morceau)).split(separateur)
+            reste = complets.pop()
+
+def fonctionReception(sock):
+    """
+        donne la fonction qui reçoit des données du socket dans une
+        vue, choisie une fois selon ce que le socket sait faire
+
+        :return: fonction ( vue ) -> nombre d'octets reçus
+                 (0 si la connexion est fermée)
+    """
+    if hasattr(sock,"recv_into"):
+        return sock.recv_into
+    #socket sans recv_into (pybluez)
+    def recoit(vue):
+        d = sock.recv(len(vue))
+        vue[:len(d)] = d
+        return len(d)
+    return recoit
+
+class LecteurTrames:
+    """
+        Extrait les paquets d'un flux d'octets
+
+        utilisation:
+            lecteur = LecteurTrames()
+            while lecteur.recoit(sock):
+                for trame in lecteur.trames():
+                    ...
+
+        Une trame donnée par "trames" est une vue sur le tampon :
+        elle n'est valable que jusqu'à la trame suivante
+
+        Un paquet qui commence par l'un des "prefixesFlux" est donné
+        en plusieurs Morceau, au lieu d'une seule trame
+    """
+
+    def __init__(self,taille=TAILLE_TAMPON,maxTrame=MAX_TRAME,prefixesFlux=()):
+        self.tailleInitiale = taille
+        self.maxTrame = maxTrame
+        self.prefixesFlux = tuple(prefixesFlux)
+        self.taillePrefixe = max( [ len(p) for p in self.prefixesFlux ] , default = 0 )
+        #octets restants du paquet lu en flux
+        self.resteFlux = 0
+        self.tampon = bytearray(taille)
+        self.vue = memoryview(self.tampon)
+        #données reçues et pas encore extraites : tampon[debut:fin]
+        self.debut = 0
+        self.fin = 0
+        #socket lu, et sa fonction de réception (voir fonctionReception)
+        self.socket = None
+        self.reception = None
+
+    def recoit(self,sock):
+        """
+            reçoit des données du socket dans le tampon
+
+            :return: nombre d'octets reçus (0 si la connexion est fermée)
+        """
+        if self.fin == len(self.tampon):
+            self.fairePlace( self.fin-self.debut+1 )
+        if sock is not self.socket:
+            self.socket = sock
+            self.reception = fonctionReception(sock)
+        n = self.reception( self.vue[self.fin:] )
+        self.fin += n
+        return n
+
+    def trames(self):
+        """
+            donne les paquets complets du tampon
+        """
+        while True:
+            disponible = self.fin-self.debut
+            #suite d'un paquet lu en flux
+            if self.resteFlux:
+                if not disponible:
+                    break
+                n = min(disponible,self.resteFlux)
+                d = self.debut
+                self.debut = d+n
+                self.resteFlux -= n
+                yield Morceau(self.vue[d:d+n],False,self.resteFlux == 0)
+                continue
+            if disponible < TAILLE_ENTETE:
+                break
+            taille, = ENTETE.unpack_from(self.tampon,self.debut)
+            if taille > self.maxTrame:
+                raise ErreurTrame("paquet trop grand : "+str(taille)+" octets")
+            if self.prefixesFlux:
+                #début du paquet nécessaire pour reconnaitre un paquet en flux
+                besoin = TAILLE_ENTETE+min(taille,self.taillePrefixe)
+                if disponible < besoin:
+                    self.fairePlace(besoin)
+                    break
+                d = self.debut+TAILLE_ENTETE
+                if self.tampon.startswith(self.prefixesFlux,d,d+taille):
+                    n = min(disponible-TAILLE_ENTETE,taille)
+                    self.debut = d+n
+                    self.resteFlux = taille-n
+                    yield Morceau(self.vue[d:d+n],True,self.resteFlux == 0)
+                    continue
+            if disponible < TAILLE_ENTETE+taille:
+                #paquet incomplet : s'assure qu'il tiendra dans le tampon
+                self.fairePlace(TAILLE_ENTETE+taille)
+                break
+            d = self.debut+TAILLE_ENTETE
+            self.debut = d+taille
+            yield self.vue[d:d+taille]
+        if self.debut == self.fin:
+            self.debut = self.fin = 0
+            #revient à la taille initiale après un gros paquet
+            if len(self.tampon) > 4*self.tailleInitiale:
+                self.remplaceTampon( bytearray(self.tailleInitiale) )
+
+    def fairePlace(self,besoin):
+        """
+            déplace les données en attente au début du tampon,
+            et l'agrandit si elles ont besoin de "besoin" octets
+        """
+        if self.debut+besoin <= len(self.tampon):
+            return
+        reste = self.fin-self.debut
+        if besoin > len(self.tampon):
+            nouveau = bytearray( max(besoin,2*len(self.tampon)) )
+            nouveau[:reste] = self.vue[self.debut:self.fin]
+            self.remplaceTampon(nouveau)
+        else:
+            self.vue[:reste] = self.vue[self.debut:self.fin]
+        self.debut = 0
+        self.fin = reste
+
+    def remplaceTampon(self,tampon):
+        self.vue.release()
+        self.tampon = tampon
+        self.vue = memoryview(tampon)
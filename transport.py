@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Couche de transport du routeur.
+
+    Un transport remplace le module "bluetooth" de pybluez : il fournit
+    les mêmes constantes (RFCOMM, L2CAP, PORT_ANY) et les mêmes fonctions
+    (socket, advertise_service, stop_advertising, find_service,
+    discover_devices, lookup_name). Le reste du programme n'appelle
+    plus pybluez directement.
+
+    Deux transports sont disponibles:
+      TransportBluetooth : pybluez, importé seulement à la première utilisation
+      TransportTCP : sockets TCP locaux, avec un registre qui joue le rôle
+                     du serveur SDP et de la recherche de périphériques.
+                     Plusieurs routeurs peuvent ainsi tourner sur la
+                     même machine (voir simulateur.py)
+
+    Le registre connaît pour chaque périphérique simulé:
+      - son adresse MAC (fictive) et son nom
+      - les périphériques à portée (qu'il peut découvrir et contacter)
+      - ses canaux ouverts, et le port TCP réel de chacun
+      - les services annoncés sur ces canaux
+
+    :var METHODES_REGISTRE:
+          méthodes du registre accessibles à distance
+"""
+
+import json
+import socket
+import threading
+
+METHODES_REGISTRE = ("ajouteAppareil","relie","appareils","nom",
+                     "ouvreCanal","fermeCanal","resoudCanal",
+                     "annonce","retireService","services")
+
+class TransportBluetooth:
+    """
+        Transport par bluetooth, à travers pybluez
+    """
+
+    #valeurs de pybluez
+    RFCOMM = 3
+    L2CAP = 0
+    PORT_ANY = 0
+
+    def __init__(self):
+        self._module = None
+
+    @property
+    def module(self):
+        """
+            module pybluez, importé à la première utilisation
+        """
+        if self._module is None:
+            try:
+                import bluetooth
+            except ImportError:
+                raise OSError("pybluez introuvable")
+            self._module = bluetooth
+        return self._module
+
+    def socket(self,protocole):
+        return self.module.BluetoothSocket(protocole)
+
+    def advertise_service(self,sock,nom,service_id="",service_classes=[],profiles=[]):
+        self.module.advertise_service(sock,nom,service_id,service_classes,profiles)
+
+    def stop_advertising(self,sock):
+        self.module.stop_advertising(sock)
+
+    def find_service(self,name=None,uuid=None,address=None):
+        return self.module.find_service(name,uuid,address)
+
+    def discover_devices(self):
+        return self.module.discover_devices()
+
+    def lookup_name(self,adresse,timeout=10):
+        return self.module.lookup_name(adresse,timeout)
+
+class TransportTCP:
+    """
+        Transport par TCP local, pour un périphérique simulé
+    """
+
+    RFCOMM = 3
+    L2CAP = 0
+    PORT_ANY = 0
+
+    def __init__(self,registre,adresse,nom,hote="127.0.0.1"):
+        """
+            :param registre: Registre, ou RegistreDistant partagé
+                             par tous les périphériques simulés
+            :param adresse: adresse MAC fictive de ce périphérique
+        """
+        self.registre = registre
+        self.adresse = adresse
+        self.hote = hote
+        registre.ajouteAppareil(adresse,nom)
+
+    def socket(self,protocole):
+        return SocketTCP(self,protocole)
+
+    def advertise_service(self,sock,nom,service_id="",service_classes=[],profiles=[]):
+        if sock.protocole == self.L2CAP:
+            protocole = "L2CAP"
+        else:
+            protocole = "RFCOMM"
+        self.registre.annonce(self.adresse,sock.canal,
+                              {"name": nom,
+                               "description": "",
+                               "provider": "",
+                               "protocol": protocole,
+                               "service-id": service_id,
+                               "service-classes": list(service_classes),
+                               "profiles": [ list(p) for p in profiles ]})
+
+    def stop_advertising(self,sock):
+        self.registre.retireService(self.adresse,sock.canal)
+
+    def find_service(self,name=None,uuid=None,address=None):
+        return self.registre.services(self.adresse,name,uuid,address)
+
+    def discover_devices(self):
+        return self.registre.appareils(self.adresse)
+
+    def lookup_name(self,adresse,timeout=10):
+        return self.registre.nom(adresse)
+
+class SocketTCP:
+    """
+        Socket TCP qui se présente comme un socket bluetooth:
+        les adresses sont des couples (adresse MAC, canal)
+
+        À la connexion, le client envoie son adresse MAC,
+        pour que le serveur connaisse l'adresse de son pair
+    """
+
+    def __init__(self,transport,protocole,sock=None,pair=None):
+        self.transport = transport
+        self.protocole = protocole
+        self.sock = sock if sock is not None else socket.socket()
+        #comme en RFCOMM, les petits paquets partent tout de suite
+        #(sans l'algorithme de Nagle, qui les retarderait de 40 ms)
+        self.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        self.canal = 0
+        self.pair = pair
+
+    def bind(self,adresse):
+        self.sock.bind( (self.transport.hote,0) )
+        hote,port = self.sock.getsockname()
+        self.canal = self.transport.registre.ouvreCanal(self.transport.adresse,adresse[1],hote,port)
+
+    def listen(self,n):
+        self.sock.listen(n)
+
+    def accept(self):
+        sock,_ = self.sock.accept()
+        #lit l'adresse MAC du client
+        adresse = b""
+        while not adresse.endswith(b"\n"):
+            d = sock.recv(1)
+            if not d:
+                sock.close()
+                raise ConnectionAbortedError("connexion fermée avant identification")
+            adresse += d
+        pair = ( str(adresse[:-1],encoding="ascii") , 0 )
+        return SocketTCP(self.transport,self.protocole,sock,pair) , pair
+
+    def connect(self,adresse):
+        destination = self.transport.registre.resoudCanal(self.transport.adresse,adresse[0],adresse[1])
+        if destination is None:
+            raise ConnectionRefusedError("aucun service sur "+str(adresse))
+        self.sock.connect( tuple(destination) )
+        self.sock.sendall( bytes(self.transport.adresse+"\n",encoding="ascii") )
+        self.pair = tuple(adresse)
+
+    def getsockname(self):
+        return (self.transport.adresse,self.canal)
+
+    def getpeername(self):
+        return self.pair
+
+    def close(self):
+        if self.canal:
+            self.transport.registre.fermeCanal(self.transport.adresse,self.canal)
+            self.canal = 0
+        self.sock.close()
+
+    #le reste est celui du socket TCP
+    def __getattr__(self,nom):
+        return getattr(self.sock,nom)
+
+class Registre:
+    """
+        Registre des périphériques simulés, de leurs canaux et services.
+
+        Remplace le serveur SDP et la recherche de périphériques
+        bluetooth pour TransportTCP
+    """
+
+    def __init__(self):
+        self.verrou = threading.Lock()
+        #adresse -> nom
+        self.noms = {}
+        #adresse -> ensemble des adresses à portée, si la portée est limitée
+        self.portee = None
+        #(adresse,canal) -> (hote,port)
+        self.canaux = {}
+        #(adresse,canal) -> description du service
+        self.servicesAnnonces = {}
+
+    def ajouteAppareil(self,adresse,nom):
+        with self.verrou:
+            self.noms[adresse] = nom
+
+    def relie(self,a,b):
+        """
+            met a et b à portée l'un de l'autre.
+            Tant qu'aucun lien n'est défini, tous les
+            périphériques sont à portée
+        """
+        with self.verrou:
+            if self.portee is None:
+                self.portee = {}
+            self.portee.setdefault(a,set()).add(b)
+            self.portee.setdefault(b,set()).add(a)
+
+    def aPortee(self,depuis,adresse):
+        if self.portee is None:
+            return depuis != adresse
+        return adresse in self.portee.get(depuis,())
+
+    def appareils(self,depuis):
+        with self.verrou:
+            return [ a for a in self.noms if self.aPortee(depuis,a) ]
+
+    def nom(self,adresse):
+        with self.verrou:
+            return self.noms.get(adresse)
+
+    def ouvreCanal(self,adresse,canal,hote,port):
+        """
+            associe un canal de "adresse" au port TCP (hote,port).
+            Le canal 0 choisit le premier canal libre
+
+            :return: le canal
+        """
+        with self.verrou:
+            if not canal:
+                canal = 1
+                while (adresse,canal) in self.canaux:
+                    canal += 1
+            elif (adresse,canal) in self.canaux:
+                raise OSError("canal "+str(canal)+" déjà utilisé")
+            self.canaux[(adresse,canal)] = (hote,port)
+            return canal
+
+    def fermeCanal(self,adresse,canal):
+        with self.verrou:
+            self.canaux.pop( (adresse,canal) , None )
+            self.servicesAnnonces.pop( (adresse,canal) , None )
+
+    def resoudCanal(self,depuis,adresse,canal):
+        """
+            donne le port TCP d'un canal à portée de "depuis"
+        """
+        with self.verrou:
+            if not self.aPortee(depuis,adresse):
+                return None
+            return self.canaux.get( (adresse,canal) )
+
+    def annonce(self,adresse,canal,service):
+        with self.verrou:
+            self.servicesAnnonces[(adresse,canal)] = service
+
+    def retireService(self,adresse,canal):
+        with self.verrou:
+            self.servicesAnnonces.pop( (adresse,canal) , None )
+
+    def services(self,depuis,name=None,uuid=None,address=None):
+        """
+            recherche de services, sous la forme donnée par pybluez
+        """
+        with self.verrou:
+            resultat = []
+            for (adresse,canal),service in self.servicesAnnonces.items():
+                if not self.aPortee(depuis,adresse):
+                    continue
+                if address is not None and address != adresse:
+                    continue
+                if name is not None and name != service["name"]:
+                    continue
+                if uuid is not None and not (uuid == service["service-id"]
+                                             or uuid in service["service-classes"]):
+                    continue
+                item = dict(service)
+                item["host"] = adresse
+                item["port"] = canal
+                resultat.append(item)
+            return resultat
+
+class RegistreServeur:
+    """
+        Rend un registre accessible aux autres processus,
+        par TCP (une requête json par ligne)
+    """
+
+    def __init__(self,registre,hote="127.0.0.1",port=0):
+        self.registre = registre
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        self.sock.bind( (hote,port) )
+        self.sock.listen(64)
+        self.adresse = self.sock.getsockname()
+        t = threading.Thread(target = self.boucle)
+        t.daemon = True
+        t.start()
+
+    def boucle(self):
+        while True:
+            try:
+                sock,_ = self.sock.accept()
+            except OSError:
+                return
+            t = threading.Thread(target = self.client, args = [sock])
+            t.daemon = True
+            t.start()
+
+    def client(self,sock):
+        fichier = sock.makefile("rwb")
+        for ligne in fichier:
+            requete = json.loads(ligne)
+            try:
+                if not requete["m"] in METHODES_REGISTRE:
+                    raise AttributeError(requete["m"])
+                reponse = {"r": getattr(self.registre,requete["m"])(*requete["a"])}
+            except Exception as e:
+                reponse = {"e": str(e)}
+            fichier.write( bytes(json.dumps(reponse)+"\n",encoding="utf-8") )
+            fichier.flush()
+        sock.close()
+
+    def close(self):
+        self.sock.close()
+
+class RegistreDistant:
+    """
+        Accès à un registre d'un autre processus (voir RegistreServeur)
+    """
+
+    def __init__(self,hote,port):
+        self.sock = socket.create_connection( (hote,port) )
+        self.fichier = self.sock.makefile("rwb")
+        self.verrou = threading.Lock()
+
+    def appel(self,methode,*args):
+        with self.verrou:
+            self.fichier.write( bytes(json.dumps({"m": methode,"a": args})+"\n",encoding="utf-8") )
+            self.fichier.flush()
+            reponse = json.loads( self.fichier.readline() )
+        if "e" in reponse:
+            raise OSError(reponse["e"])
+        return reponse["r"]
+
+    def __getattr__(self,nom):
+        if not nom in METHODES_REGISTRE:
+            raise AttributeError(nom)
+        return lambda *args: self.appel(nom,*args)
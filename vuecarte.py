@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+    Vue de la carte du réseau, utilisable pour les grands réseaux.
+
+    L'arbre du parcours de la carte (voir carteSimplifiee) est d'abord
+    réduit (voir regroupe) : il est développé en largeur jusqu'à
+    MAX_NOEUDS noeuds, et les sous-arbres plus profonds sont remplacés
+    par leur racine, dessinée comme un groupe qui porte le nombre de
+    périphériques cachés. Au delà de MAX_ENFANTS, les voisins suivants
+    d'un noeud sont remplacés par un seul groupe "reste". Un
+    double-clic ouvre un groupe, ou referme un noeud ouvert.
+
+    Les noeuds gardés sont placés en anneaux (voir disposition.py),
+    en coordonnées de la carte, et rangés dans une grille de cases
+    de TAILLE_CASE (PlanCarte). Seuls les noeuds de la partie visible
+    du canvas, et les liens qui la traversent, ont des objets dessinés.
+    Les noms ne sont dessinés qu'à partir du zoom ECHELLE_NOMS.
+
+    Un déplacement (glisser) ou un zoom (molette) ne recalcule pas la
+    disposition : les objets déjà dessinés sont déplacés, et ceux qui
+    sortent de la vue sont réutilisés pour ceux qui y entrent.
+
+    Ce module n'importe pas tkinter : la vue dessine sur un canvas
+    qui lui est donné.
+
+    :var MAX_NOEUDS:
+          nombre de noeuds dessinés avant de regrouper les sous-arbres
+          (hors groupes ouverts à la demande)
+    :var MAX_ENFANTS:
+          nombre de voisins d'un noeud dessinés avant le groupe "reste"
+    :var ESPACE:
+          écart minimal entre deux noeuds d'un anneau (unités de la carte)
+    :var RAYON_CARTE:
+          rayon minimal de l'anneau le plus éloigné
+    :var TAILLE_CASE:
+          côté des cases de la grille des noeuds (unités de la carte)
+    :var ECHELLE_NOMS:
+          zoom (pixels par unité de la carte) à partir duquel les noms
+          sont dessinés
+"""
+
+import math
+from collections import deque
+
+from disposition import dispositionAnneaux
+
+MAX_NOEUDS = 500
+MAX_ENFANTS = 64
+ESPACE = 30
+RAYON_CARTE = 220
+TAILLE_CASE = 120
+ECHELLE_NOMS = 0.6
+ZOOM_MIN = 0.01
+ZOOM_MAX = 8
+#taille des noeuds dessinés (pixels, au zoom 1)
+DEMI_COTE = 10
+#marge autour de la partie visible, où les objets sont déjà dessinés (pixels)
+MARGE = 40
+#repère du groupe des voisins cachés d'un noeud : ( RESTE , adresse du noeud )
+RESTE = "reste"
+
+def nombreDescendants(sousCarte):
+    """
+        nombre de périphériques d'un sous-arbre de la carte
+    """
+    nombre = 0
+    pile = [sousCarte]
+    while pile:
+        carte = pile.pop()
+        nombre += len(carte)
+        pile.extend( c for c in carte.values() if c )
+    return nombre
+
+def regroupe(carte,depart,ouverts=(),maxNoeuds=MAX_NOEUDS,maxEnfants=MAX_ENFANTS):
+    """
+        réduit l'arbre d'une carte aux noeuds à dessiner
+
+        :param carte: arbre de la carte (voir carteSimplifiee)
+        :param ouverts: noeuds et groupes "reste" ouverts à la demande
+        :return: tuple ( dictionnaire niveau -> liste des noeuds gardés ,
+                         dictionnaire groupe -> nombre de périphériques cachés ,
+                         dictionnaire noeud -> noeud parent )
+                 où les noeuds sont des adresses, ou ( RESTE , adresse )
+    """
+    points = {0: [depart]}
+    groupes = {}
+    parents = {}
+    gardes = 1
+    file = deque( [ (depart,carte,0) ] )
+    while file:
+        ident,sousCarte,niveau = file.popleft()
+        if not sousCarte:
+            continue
+        enfants = list(sousCarte.items())
+        reste = (RESTE,ident)
+        caches = []
+        if len(enfants) > maxEnfants and not reste in ouverts:
+            caches = enfants[maxEnfants:]
+            enfants = enfants[:maxEnfants]
+        #trop de noeuds : sous-arbre caché derrière sa racine
+        if niveau and gardes+len(enfants) > maxNoeuds and not ident in ouverts:
+            groupes[ident] = nombreDescendants(sousCarte)
+            continue
+        gardes += len(enfants) + bool(caches)
+        anneau = points.setdefault(niveau+1,[])
+        for add,c in enfants:
+            anneau.append(add)
+            parents[add] = ident
+            file.append( (add,c,niveau+1) )
+        if caches:
+            anneau.append(reste)
+            parents[reste] = ident
+            groupes[reste] = len(caches) + sum( nombreDescendants(c) for _,c in caches )
+    return points , groupes , parents
+
+class PlanCarte:
+    """
+        Disposition des noeuds gardés d'une carte, indexée par cases
+        pour retrouver vite ceux d'une partie de la carte
+
+        attributs:
+          positions : noeud -> (x,y), en unités de la carte
+          groupes : groupe -> nombre de périphériques cachés
+          liens : liste de tuples ( a , b , xmin , ymin , xmax , ymax )
+          rayon : rayon de l'anneau le plus éloigné
+    """
+
+    def __init__(self,carte,depart,voisins,ouverts=(),maxNoeuds=MAX_NOEUDS,maxEnfants=MAX_ENFANTS):
+        """
+            :param carte: arbre de la carte (voir carteSimplifiee)
+            :param voisins: fonction donnant les adresses liées à une adresse
+        """
+        points , self.groupes , parents = regroupe(carte,depart,ouverts,maxNoeuds,maxEnfants)
+        #rayon suffisant pour que l'anneau le plus chargé ne se chevauche pas
+        maxdist = max(points)
+        self.rayon = RAYON_CARTE
+        for d,adresses in points.items():
+            if d:
+                self.rayon = max( self.rayon , maxdist*len(adresses)*ESPACE/(2*math.pi*d) )
+        def voisinsGardes(ident):
+            if type(ident) is tuple:
+                return [ parents[ident] ]
+            return voisins(ident)
+        self.positions = dispositionAnneaux(points,voisinsGardes,self.rayon)
+        #liens de l'arbre, et liens entre noeuds gardés
+        positions = self.positions
+        self.liens = []
+        dejaVus = set()
+        def ajouteLien(a,b):
+            if (a,b) in dejaVus or (b,a) in dejaVus:
+                return
+            dejaVus.add( (a,b) )
+            (xa,ya),(xb,yb) = positions[a],positions[b]
+            self.liens.append( (a,b,min(xa,xb),min(ya,yb),max(xa,xb),max(ya,yb)) )
+        for ident,parent in parents.items():
+            ajouteLien(parent,ident)
+        for ident in positions:
+            if type(ident) is tuple:
+                continue
+            for l in voisins(ident):
+                if l in positions:
+                    ajouteLien(ident,l)
+        #grille des noeuds
+        self.cases = {}
+        for ident,(x,y) in positions.items():
+            self.cases.setdefault( (int(x//TAILLE_CASE),int(y//TAILLE_CASE)) , [] ).append(ident)
+
+    def noeudsDans(self,xmin,ymin,xmax,ymax):
+        """
+            noeuds dans un rectangle de la carte
+        """
+        positions = self.positions
+        cx0,cx1 = int(xmin//TAILLE_CASE),int(xmax//TAILLE_CASE)
+        cy0,cy1 = int(ymin//TAILLE_CASE),int(ymax//TAILLE_CASE)
+        #rectangle plus grand que la carte : parcourt les cases existantes
+        if (cx1-cx0+1)*(cy1-cy0+1) > len(self.cases):
+            cases = [ c for (cx,cy),c in self.cases.items()
+                      if cx0 <= cx <= cx1 and cy0 <= cy <= cy1 ]
+        else:
+            cases = [ self.cases[(cx,cy)] for cx in range(cx0,cx1+1) for cy in range(cy0,cy1+1)
+                      if (cx,cy) in self.cases ]
+        for case in cases:
+            for ident in case:
+                x,y = positions[ident]
+                if xmin <= x <= xmax and ymin <= y <= ymax:
+                    yield ident
+
+    def liensDans(self,xmin,ymin,xmax,ymax):
+        """
+            indices des liens dont le rectangle englobant
+            touche un rectangle de la carte
+        """
+        for i,(a,b,x0,y0,x1,y1) in enumerate(self.liens):
+            if x0 <= xmax and x1 >= xmin and y0 <= ymax and y1 >= ymin:
+                yield i
+
+class VueCarte:
+    """
+        Carte du réseau dessinée sur un canvas tkinter, avec
+        déplacement, zoom et ouverture des groupes
+    """
+
+    def __init__(self,canvas,carte,depart):
+        """
+            :param canvas: canvas tkinter, occupé par la vue
+            :param carte: mappage à dessiner (Topologie, de préférence
+                          un instantané qui ne change plus)
+            :param depart: adresse du point de départ
+        """
+        self.canvas = canvas
+        self.carte = carte
+        self.depart = depart
+        self.ouverts = set()
+        #objets dessinés : noeud -> ( rectangle , texte ), indice du lien -> ligne
+        self.noeudsDessines = {}
+        self.liensDessines = {}
+        #objets cachés, réutilisables
+        self.noeudsLibres = []
+        self.lignesLibres = []
+        #objet -> noeud, pour le double-clic
+        self.noeudDe = {}
+        self.plan = None
+        self.dispose()
+        #zoom initial : toute la carte dans le canvas
+        largeur,hauteur = self.taille()
+        self.echelle = min( ZOOM_MAX , max( ZOOM_MIN , min(largeur,hauteur)/(2.2*self.plan.rayon+2*DEMI_COTE) ) )
+        self.origine = ( largeur/2 , hauteur/2 )
+        canvas.bind("<ButtonPress-1>",self.saisit)
+        canvas.bind("<B1-Motion>",self.glisse)
+        canvas.bind("<Double-Button-1>",self.ouvre)
+        canvas.bind("<MouseWheel>",self.zoome)
+        canvas.bind("<Button-4>",self.zoome)
+        canvas.bind("<Button-5>",self.zoome)
+        canvas.bind("<Configure>",lambda e: self.redessine())
+        self.redessine()
+
+    def dispose(self):
+        """
+            recalcule la disposition, après l'ouverture d'un groupe
+        """
+        parcours = self.carte.parcours(self.depart)
+        self.plan = PlanCarte(parcours.carte,self.depart,self.carte.liens,self.ouverts)
+        #les lignes ne correspondent plus aux mêmes liens
+        for indice in list(self.liensDessines):
+            self.libereLien(indice)
+
+    def taille(self):
+        largeur = self.canvas.winfo_width()
+        hauteur = self.canvas.winfo_height()
+        #canvas pas encore affiché
+        if largeur <= 1 or hauteur <= 1:
+            largeur = int(self.canvas["width"])
+            hauteur = int(self.canvas["height"])
+        return largeur , hauteur
+
+    def versEcran(self,x,y):
+        return x*self.echelle+self.origine[0] , y*self.echelle+self.origine[1]
+
+    def versCarte(self,x,y):
+        return (x-self.origine[0])/self.echelle , (y-self.origine[1])/self.echelle
+
+    def texte(self,ident):
+        if type(ident) is tuple:
+            return "+%d" % self.plan.groupes[ident]
+        nom = self.carte.noeud(ident).nom
+        if ident in self.plan.groupes:
+            return "%s (+%d)" % (nom,self.plan.groupes[ident])
+        return nom
+
+    def couleur(self,ident):
+        if type(ident) is tuple or ident in self.plan.groupes:
+            return "orange"
+        noeud = self.carte.noeud(ident)
+        if noeud.nom == "origine":
+            return "blue"
+        if noeud.avance:
+            return "purple"
+        return "white"
+
+    def redessine(self):
+        """
+            dessine les noeuds et liens de la partie visible, en
+            déplaçant les objets déjà dessinés et en réutilisant
+            ceux qui sortent de la vue
+        """
+        canvas = self.canvas
+        largeur,hauteur = self.taille()
+        xmin,ymin = self.versCarte(-MARGE,-MARGE)
+        xmax,ymax = self.versCarte(largeur+MARGE,hauteur+MARGE)
+        visibles = set( self.plan.noeudsDans(xmin,ymin,xmax,ymax) )
+        liens = set( self.plan.liensDans(xmin,ymin,xmax,ymax) )
+        #libère les objets sortis de la vue
+        for ident in [ i for i in self.noeudsDessines if not i in visibles ]:
+            self.libereNoeud(ident)
+        for indice in [ i for i in self.liensDessines if not i in liens ]:
+            self.libereLien(indice)
+        #liens, sous les noeuds
+        positions = self.plan.positions
+        for indice in liens:
+            a,b = self.plan.liens[indice][:2]
+            ligne = self.liensDessines.get(indice)
+            if ligne is None:
+                ligne = self.prendLigne()
+                self.liensDessines[indice] = ligne
+            canvas.coords(ligne,*self.versEcran(*positions[a]),*self.versEcran(*positions[b]))
+        #noeuds, et leur nom à partir d'un certain zoom
+        demi = max( 2 , min( DEMI_COTE , DEMI_COTE*self.echelle ) )
+        etatNoms = "normal" if self.echelle >= ECHELLE_NOMS else "hidden"
+        for ident in visibles:
+            objets = self.noeudsDessines.get(ident)
+            if objets is None:
+                objets = self.prendNoeud()
+                rectangle,texte = objets
+                canvas.itemconfigure(rectangle,fill = self.couleur(ident))
+                canvas.itemconfigure(texte,text = self.texte(ident))
+                self.noeudsDessines[ident] = objets
+                self.noeudDe[rectangle] = ident
+                self.noeudDe[texte] = ident
+            rectangle,texte = objets
+            x,y = self.versEcran(*positions[ident])
+            canvas.coords(rectangle,x-demi,y-demi,x+demi,y+demi)
+            canvas.coords(texte,x+demi+3,y)
+            canvas.itemconfigure(texte,state = etatNoms)
+        canvas.tag_raise("noeud")
+
+    def prendNoeud(self):
+        if self.noeudsLibres:
+            rectangle,texte = self.noeudsLibres.pop()
+            self.canvas.itemconfigure(rectangle,state = "normal")
+            return rectangle , texte
+        rectangle = self.canvas.create_rectangle(0,0,0,0,tags = ("noeud",))
+        texte = self.canvas.create_text(0,0,anchor = "w",tags = ("noeud",))
+        return rectangle , texte
+
+    def libereNoeud(self,ident):
+        rectangle,texte = self.noeudsDessines.pop(ident)
+        del self.noeudDe[rectangle]
+        del self.noeudDe[texte]
+        self.canvas.itemconfigure(rectangle,state = "hidden")
+        self.canvas.itemconfigure(texte,state = "hidden")
+        self.noeudsLibres.append( (rectangle,texte) )
+
+    def prendLigne(self):
+        if self.lignesLibres:
+            ligne = self.lignesLibres.pop()
+            self.canvas.itemconfigure(ligne,state = "normal")
+            return ligne
+        return self.canvas.create_line(0,0,0,0,fill = "black",width = 2)
+
+    def libereLien(self,indice):
+        ligne = self.liensDessines.pop(indice)
+        self.canvas.itemconfigure(ligne,state = "hidden")
+        self.lignesLibres.append(ligne)
+
+    ## évènements
+
+    def saisit(self,event):
+        self.saisie = (event.x,event.y)
+
+    def glisse(self,event):
+        """
+            déplace la vue avec la souris
+        """
+        x0,y0 = self.saisie
+        self.saisie = (event.x,event.y)
+        self.origine = ( self.origine[0]+event.x-x0 , self.origine[1]+event.y-y0 )
+        self.redessine()
+
+    def zoome(self,event):
+        """
+            zoom de la molette, centré sur la souris
+        """
+        if event.num == 5 or getattr(event,"delta",0) < 0:
+            facteur = 1/1.25
+        else:
+            facteur = 1.25
+        self.zoomeEn(event.x,event.y,facteur)
+
+    def zoomeEn(self,x,y,facteur):
+        echelle = min( ZOOM_MAX , max( ZOOM_MIN , self.echelle*facteur ) )
+        cx,cy = self.versCarte(x,y)
+        self.echelle = echelle
+        #le point sous la souris ne bouge pas
+        self.origine = ( x-cx*echelle , y-cy*echelle )
+        self.redessine()
+
+    def ouvre(self,event):
+        """
+            ouvre le groupe sous la souris, ou referme un noeud ouvert
+        """
+        objets = self.canvas.find_withtag("current")
+        if not objets or not objets[0] in self.noeudDe:
+            return
+        ident = self.noeudDe[objets[0]]
+        if ident in self.ouverts:
+            self.ouverts.discard(ident)
+        elif type(ident) is tuple or ident in self.plan.groupes:
+            self.ouverts.add(ident)
+        else:
+            return
+        self.basculeGroupe(ident,event.x,event.y)
+
+    def basculeGroupe(self,ident,x,y):
+        """
+            recalcule la disposition après l'ouverture ou la fermeture
+            de "ident", en le gardant à la position (x,y) de l'écran
+        """
+        #un groupe "reste" ouvert disparait : son parent reste en place
+        if type(ident) is tuple and ident in self.ouverts:
+            ident = ident[1]
+        for i in list(self.noeudsDessines):
+            self.libereNoeud(i)
+        self.dispose()
+        if ident in self.plan.positions:
+            cx,cy = self.plan.positions[ident]
+            self.origine = ( x-cx*self.echelle , y-cy*self.echelle )
+        self.redessine()